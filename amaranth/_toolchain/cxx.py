@@ -1,12 +1,111 @@
+import time
 import tempfile
 import sysconfig
 import warnings
 import os.path
+import hashlib
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
 
 __all__ = ["build_cxx"]
 
 
+# Compiling generated C++ code often takes much longer than generating it, so shared objects can
+# be cached on disk, keyed by everything that could affect the result of the build. The cache is
+# enabled by setting `AMARANTH_CXX_CACHE_DIR` to the directory where it should be stored (e.g.
+# `~/.cache/amaranth/cxx`). Its size is limited to `AMARANTH_CXX_CACHE_SIZE` bytes, evicting
+# the least recently used entries first; setting the size to 0 disables the cache.
+_CACHE_DIR_VAR  = "AMARANTH_CXX_CACHE_DIR"
+_CACHE_SIZE_VAR = "AMARANTH_CXX_CACHE_SIZE"
+_CACHE_SIZE_DEFAULT = 512 * 1024 * 1024
+# Temporary files (whose names start with a dot) are removed from the cache once they are older
+# than this, since the build that was writing them must have been interrupted.
+_CACHE_TEMP_MAX_AGE = 60 * 60
+
+# Commands that run the compiler given to them as the next argument, e.g. `CXX="ccache g++"`.
+_COMPILER_WRAPPERS = {"ccache", "sccache", "distcc", "icecc", "env"}
+
+
+def _cache_dir():
+    return os.environ.get(_CACHE_DIR_VAR) or None
+
+
+def _cache_size():
+    return int(os.environ.get(_CACHE_SIZE_VAR, _CACHE_SIZE_DEFAULT))
+
+
+def _compiler_executable(command):
+    words = command.split()
+    for word in words:
+        # Skip wrappers, as well as environment variable assignments passed to `env`.
+        if os.path.basename(word) not in _COMPILER_WRAPPERS and "=" not in word:
+            return word
+    return words[0]
+
+
+def _compiler_identity(executables):
+    identity = list(executables)
+    try:
+        # The same command line may refer to a different compiler after an upgrade.
+        identity.append(subprocess.run([_compiler_executable(executables[0]), "--version"],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, encoding="utf-8").stdout)
+    except OSError:
+        pass
+    return identity
+
+
+def _cache_key(*, cxx_sources, output_name, include_dirs, macros, compiler_identity):
+    digest = hashlib.sha256()
+    def update(*items):
+        for item in items:
+            digest.update(str(item).encode("utf-8"))
+            digest.update(b"\0")
+
+    for cxx_filename, cxx_source in sorted(cxx_sources.items()):
+        update(cxx_filename, cxx_source)
+    update(output_name, *macros, *compiler_identity)
+    for include_dir in include_dirs:
+        update(include_dir)
+        # Hashing the contents of every header would be slow for large include directories, such
+        # as the one of Yosys; their size and modification time will change if they are replaced.
+        for dirpath, dirnames, filenames in sorted(os.walk(include_dir)):
+            for filename in sorted(filenames):
+                stat = os.stat(os.path.join(dirpath, filename))
+                update(os.path.relpath(os.path.join(dirpath, filename), include_dir),
+                       stat.st_size, stat.st_mtime_ns)
+    return digest.hexdigest()
+
+
+def _cache_evict(cache_dir, max_size):
+    # Evict least recently used entries first; entries are touched when they are used.
+    entries = []
+    stale_before = time.time() - _CACHE_TEMP_MAX_AGE
+    for entry in os.scandir(cache_dir):
+        if not entry.is_file():
+            continue
+        stat = entry.stat()
+        if entry.name.startswith("."):
+            # Temporary files that are still being written are neither evicted nor counted.
+            if stat.st_mtime < stale_before:
+                try:
+                    os.unlink(entry.path)
+                except OSError:
+                    pass
+            continue
+        entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+        total_size -= size
+
+
 def build_cxx(*, cxx_sources, output_name, include_dirs, macros):
     build_dir = tempfile.TemporaryDirectory(prefix="amaranth_cxx_")
 
@@ -51,6 +150,26 @@ def build_cxx(*, cxx_sources, output_name, include_dirs, macros):
         except:
             pass
 
+        so_filename = cc_driver.shared_object_filename(output_name)
+
+        cache_dir  = _cache_dir()
+        cache_size = _cache_size()
+        if cache_dir is not None and cache_size > 0:
+            cache_key = _cache_key(
+                cxx_sources=cxx_sources,
+                output_name=output_name,
+                include_dirs=include_dirs,
+                macros=macros,
+                compiler_identity=_compiler_identity([f"{cxx} {cflags}", ld_cxxflags]),
+            )
+            cache_filename = os.path.join(cache_dir, f"{cache_key}-{so_filename}")
+            try:
+                shutil.copyfile(cache_filename, so_filename)
+                os.utime(cache_filename)
+                return build_dir, so_filename
+            except OSError:
+                pass
+
         for include_dir in include_dirs:
             cc_driver.add_include_dir(include_dir)
         for macro in macros:
@@ -61,11 +180,28 @@ def build_cxx(*, cxx_sources, output_name, include_dirs, macros):
 
         cxx_filenames = list(cxx_sources.keys())
         obj_filenames = cc_driver.object_filenames(cxx_filenames)
-        so_filename = cc_driver.shared_object_filename(output_name)
 
-        cc_driver.compile(cxx_filenames)
+        # Every translation unit is compiled by a separate compiler process, so the work can be
+        # spread over all available cores.
+        with ThreadPoolExecutor(max_workers=min(len(cxx_filenames), os.cpu_count() or 1)) as pool:
+            for _ in pool.map(lambda cxx_filename: cc_driver.compile([cxx_filename]),
+                              cxx_filenames):
+                pass
         cc_driver.link_shared_object(obj_filenames, output_filename=so_filename, target_lang="c++")
 
+        if cache_dir is not None and cache_size > 0:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                # Write the entry under a temporary name first, so that concurrent builds never
+                # observe an incomplete shared object.
+                with tempfile.NamedTemporaryFile(dir=cache_dir, prefix=".", delete=False) as f:
+                    with open(so_filename, "rb") as so_file:
+                        shutil.copyfileobj(so_file, f)
+                os.replace(f.name, cache_filename)
+                _cache_evict(cache_dir, cache_size)
+            except OSError:
+                pass
+
         return build_dir, so_filename
 
     finally:
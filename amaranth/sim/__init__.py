@@ -1,4 +1,6 @@
 from .core import *
+from .runner import *
 
 
-__all__ = ["Settle", "Delay", "Tick", "Passive", "Active", "Simulator"]
+__all__ = ["Settle", "Delay", "Tick", "Passive", "Active", "Simulator",
+           "ScenarioResult", "RegressionReport", "run_regression"]
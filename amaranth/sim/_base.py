@@ -1,4 +1,4 @@
-__all__ = ["BaseProcess", "BaseSignalState", "BaseSimulation", "BaseEngine"]
+__all__ = ["BaseProcess", "BaseSimulation", "BaseEngine"]
 
 
 class BaseProcess:
@@ -15,18 +15,6 @@ class BaseProcess:
         raise NotImplementedError
 
 
-class BaseSignalState:
-    __slots__ = ()
-
-    signal = NotImplemented
-
-    curr = NotImplemented
-    next = NotImplemented
-
-    def set(self, value):
-        raise NotImplementedError
-
-
 class BaseSimulation:
     def reset(self):
         raise NotImplementedError
@@ -34,7 +22,11 @@ class BaseSimulation:
     def get_signal(self, signal):
         raise NotImplementedError
 
-    slots = NotImplemented
+    curr = NotImplemented
+    next = NotImplemented
+
+    def set(self, index, value):
+        raise NotImplementedError
 
     def add_trigger(self, process, signal, *, trigger=None):
         raise NotImplementedError
@@ -53,9 +45,24 @@ class BaseEngine:
     def add_clock_process(self, clock, *, phase, period):
         raise NotImplementedError
 
+    def remove_process(self, process):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
     def reset(self):
         raise NotImplementedError
 
+    def checkpoint(self):
+        raise NotImplementedError
+
+    def restore(self, checkpoint):
+        raise NotImplementedError
+
+    def fork(self):
+        raise NotImplementedError
+
     @property
     def now(self):
         raise NotImplementedError
@@ -63,5 +70,24 @@ class BaseEngine:
     def advance(self):
         raise NotImplementedError
 
-    def write_vcd(self, *, vcd_file, gtkw_file, traces):
+    async def advance_async(self):
+        raise NotImplementedError
+
+    def peek(self, value):
+        raise NotImplementedError
+
+    def poke(self, lhs, value):
+        raise NotImplementedError
+
+    def run_vectors(self, *, inputs, outputs, clock, edge, count):
+        raise NotImplementedError
+
+    def write_vcd(self, *, vcd_file, gtkw_file, traces, include=None, exclude=(), depth=None,
+                  sample_domain=None, history=None, trigger=None, background=False):
+        raise NotImplementedError
+
+    def record_trace(self, *, traces):
+        raise NotImplementedError
+
+    def profile(self):
         raise NotImplementedError
@@ -1,21 +1,24 @@
 import inspect
+import asyncio
 
 from ..hdl import *
-from ..hdl.ast import Statement, SignalSet
-from .core import Tick, Settle, Delay, Passive, Active
+from ..hdl.ast import Statement
+from .core import Tick, Settle, Delay, Passive, Active, _Changed
 from ._base import BaseProcess
-from ._pyrtl import _ValueCompiler, _RHSValueCompiler, _StatementCompiler
+from ._pyrtl import _CommandCompiler
 
 
 __all__ = ["PyCoroProcess"]
 
 
 class PyCoroProcess(BaseProcess):
-    def __init__(self, state, domains, constructor, *, default_cmd=None):
+    def __init__(self, state, domains, constructor, *, default_cmd=None, compiler=None):
         self.state = state
         self.domains = domains
         self.constructor = constructor
         self.default_cmd = default_cmd
+        # Compiled commands are shared between every process of a simulation, if possible.
+        self.compiler = compiler if compiler is not None else _CommandCompiler(state)
 
         self.reset()
 
@@ -24,19 +27,22 @@ class PyCoroProcess(BaseProcess):
         self.passive = False
 
         self.coroutine = self.constructor()
-        self.exec_locals = {
-            "slots": self.state.slots,
-            "result": None,
-            **_ValueCompiler.helpers
-        }
-        self.waits_on = SignalSet()
+        self.is_async  = inspect.iscoroutine(self.coroutine)
+        # A process waits on very few signals at a time, so a list is cheaper than a set.
+        self.waits_on = []
 
     def src_loc(self):
         coroutine = self.coroutine
         if coroutine is None:
             return None
-        while coroutine.gi_yieldfrom is not None and inspect.isgenerator(coroutine.gi_yieldfrom):
-            coroutine = coroutine.gi_yieldfrom
+        while True:
+            if inspect.isgenerator(coroutine):
+                inner = coroutine.gi_yieldfrom
+            else:
+                inner = coroutine.cr_await
+            if not (inspect.isgenerator(inner) or inspect.iscoroutine(inner)):
+                break
+            coroutine = inner
         if inspect.isgenerator(coroutine):
             frame = coroutine.gi_frame
         if inspect.iscoroutine(coroutine):
@@ -45,13 +51,24 @@ class PyCoroProcess(BaseProcess):
 
     def add_trigger(self, signal, trigger=None):
         self.state.add_trigger(self, signal, trigger=trigger)
-        self.waits_on.add(signal)
+        if not any(waits_on is signal for waits_on in self.waits_on):
+            self.waits_on.append(signal)
 
     def clear_triggers(self):
         for signal in self.waits_on:
             self.state.remove_trigger(self, signal)
         self.waits_on.clear()
 
+    def wait_external(self, future):
+        if not self.state.asynchronous:
+            raise RuntimeError("Process {!r} is waiting on an asyncio future or task, which "
+                               "requires running the simulation with run_async()"
+                               .format(self.src_loc()))
+        if future is not None:
+            # Like `asyncio.Task`, acknowledge that the coroutine is waiting on the future.
+            future._asyncio_future_blocking = False
+        self.state.external[self] = future
+
     def run(self):
         if self.coroutine is None:
             return
@@ -63,17 +80,20 @@ class PyCoroProcess(BaseProcess):
             try:
                 command = self.coroutine.send(response)
                 if command is None:
+                    if self.is_async:
+                        # `async def` processes only yield `None` by awaiting `asyncio.sleep(0)`.
+                        self.wait_external(None)
+                        return
                     command = self.default_cmd
                 response = None
 
                 if isinstance(command, Value):
-                    exec(_RHSValueCompiler.compile(self.state, command, mode="curr"),
-                        self.exec_locals)
-                    response = Const.normalize(self.exec_locals["result"], command.shape())
+                    run, args = self.compiler(command)
+                    response = Const.normalize(run(*args), command.shape())
 
                 elif isinstance(command, Statement):
-                    exec(_StatementCompiler.compile(self.state, command),
-                        self.exec_locals)
+                    run, args = self.compiler(command)
+                    run(*args)
 
                 elif type(command) is Tick:
                     domain = command.domain
@@ -98,6 +118,11 @@ class PyCoroProcess(BaseProcess):
                     self.state.wait_interval(self, command.interval)
                     return
 
+                elif type(command) is _Changed:
+                    for signal in command.signals:
+                        self.add_trigger(signal)
+                    return
+
                 elif type(command) is Passive:
                     self.passive = True
 
@@ -110,6 +135,10 @@ class PyCoroProcess(BaseProcess):
                                     "add_sync_process() instead?"
                                     .format(self.src_loc()))
 
+                elif asyncio.isfuture(command):
+                    self.wait_external(command)
+                    return
+
                 else:
                     raise TypeError("Received unsupported command {!r} from process {!r}"
                                     .format(command, self.src_loc()))
@@ -1,10 +1,14 @@
 import os
+import sys
+import marshal
+import hashlib
 import tempfile
 from contextlib import contextmanager
 
 from ..hdl import *
-from ..hdl.ast import SignalSet
-from ..hdl.xfrm import ValueVisitor, StatementVisitor, LHSGroupFilter
+from ..hdl.ast import (SignalSet, SignalDict, Operator, Slice, Part, ArrayProxy, Assign,
+                       Switch)
+from ..hdl.xfrm import ValueVisitor, StatementVisitor, LHSGroupAnalyzer, LHSGroupFilter
 from ._base import BaseProcess
 
 
@@ -12,10 +16,19 @@ __all__ = ["PyRTLProcess"]
 
 
 class PyRTLProcess(BaseProcess):
-    __slots__ = ("is_comb", "runnable", "passive", "run")
+    __slots__ = ("is_comb", "hierarchy", "domain", "inputs", "outputs", "runnable", "passive",
+                 "run")
 
-    def __init__(self, *, is_comb):
+    def __init__(self, *, is_comb, hierarchy=("top",), domain=None):
         self.is_comb  = is_comb
+        # Hierarchical name of the fragment the process was compiled from, and the name of
+        # the domain of its statements (`None` for combinational processes).
+        self.hierarchy = hierarchy
+        self.domain    = domain
+        # Signals the process is sensitive to (for comb processes only), and signals it drives.
+        # These are used to build the combinational dependency graph of the design.
+        self.inputs   = SignalSet()
+        self.outputs  = SignalSet()
 
         self.reset()
 
@@ -26,9 +39,10 @@ class PyRTLProcess(BaseProcess):
 
 class _PythonEmitter:
     def __init__(self):
-        self._buffer = []
-        self._suffix = 0
-        self._level  = 0
+        self._prelude = []
+        self._buffer  = []
+        self._suffix  = 0
+        self._level   = 0
 
     def append(self, code):
         self._buffer.append("    " * self._level)
@@ -42,7 +56,8 @@ class _PythonEmitter:
         self._level -= 1
 
     def flush(self, indent=""):
-        code = "".join(self._buffer)
+        code = "".join(self._prelude + self._buffer)
+        self._prelude.clear()
         self._buffer.clear()
         return code
 
@@ -56,12 +71,94 @@ class _PythonEmitter:
         self.append(f"{name} = {value}")
         return name
 
+    def def_const(self, prefix, value):
+        # Constants are defined once, before the code that uses them, rather than every time
+        # that code runs.
+        name = self.gen_var(prefix)
+        self._prelude.append(f"{name} = {value}\n")
+        return name
+
+    @contextmanager
+    def def_function(self, prefix, params=()):
+        # Like constants, functions are defined before the code that uses them. Code emitted
+        # within this context becomes the body of the function.
+        name = self.gen_var(prefix)
+        buffer, level = self._buffer, self._level
+        self._buffer, self._level = [], 1
+        self._buffer.append(f"def {name}({', '.join(params)}):\n")
+        try:
+            yield name
+        finally:
+            self._prelude.extend(self._buffer)
+            self._buffer, self._level = buffer, level
+
+    def slot(self, signal_index):
+        return f"{signal_index}"
+
+    def const(self, value):
+        return f"{value.value}"
+
+    def set_signal(self, signal_index):
+        # Equivalent to `BaseSimulation.set()`, inlined to avoid a method call.
+        slot = self.slot(signal_index)
+        self.append(f"if next[{slot}] != next_{slot}:")
+        with self.indent():
+            self.append(f"next[{slot}] = next_{slot}")
+            self.append(f"pending.add({slot})")
+
+
+class _ClosureEmitter(_PythonEmitter):
+    """Emitter for code that does not depend on the slot numbering of the simulation state.
+
+    Slots are referred to by parameters of a function named ``make``, which returns the function
+    whose body is being emitted. The emitted code can be reused for any simulation state by calling
+    ``make`` with the slots of the same signals in that state, in the order of :attr:`slots`.
+    """
+    def __init__(self):
+        super().__init__()
+        self.slots = []
+        self._slot_names = {}
+
+    def slot(self, signal_index):
+        try:
+            return self._slot_names[signal_index]
+        except KeyError:
+            name = self._slot_names[signal_index] = f"slot_{len(self.slots)}"
+            self.slots.append(signal_index)
+            return name
+
+    def flush(self, indent=""):
+        code = super().flush()
+        return (f"def make({', '.join(self._slot_names[index] for index in self.slots)}):\n" +
+                "".join(f"    {line}\n" for line in code.splitlines()) +
+                f"    return run\n")
+
 
 class _Compiler:
     def __init__(self, state, emitter):
         self.state = state
         self.emitter = emitter
 
+    def dispatch(self, gen_index, count, emit_case):
+        """Emit code that calls ``emit_case(index)`` for the value of ``gen_index``.
+
+        The index is dispatched on with a balanced tree of comparisons, which takes a logarithmic
+        rather than linear number of comparisons in ``count``. If ``gen_index`` is not less than
+        ``count``, ``emit_case(count - 1)`` is used.
+        """
+        def emit_tree(start, stop):
+            if stop - start == 1:
+                emit_case(start)
+            else:
+                middle = (start + stop) // 2
+                self.emitter.append(f"if {gen_index} < {middle}:")
+                with self.emitter.indent():
+                    emit_tree(start, middle)
+                self.emitter.append(f"else:")
+                with self.emitter.indent():
+                    emit_tree(middle, stop)
+        emit_tree(0, count)
+
 
 class _ValueCompiler(ValueVisitor, _Compiler):
     helpers = {
@@ -70,6 +167,53 @@ class _ValueCompiler(ValueVisitor, _Compiler):
         "zmod": lambda lhs, rhs: 0 if rhs == 0 else lhs % rhs,
     }
 
+    def memory_proxy(self, value):
+        """Recognize an access to a native memory.
+
+        If ``value`` is an :class:`ArrayProxy` that selects among every word of a memory stored
+        natively in the simulation state, or among identical slices of every word, returns a tuple
+        ``(base, depth, word_width, start, stop)``, where ``base`` is the slot of the first word,
+        and ``start`` and ``stop`` are the bounds of the slice. Otherwise, returns ``None``.
+        """
+        elems = value.elems
+        if not elems:
+            return None
+        first_elem = elems[0]
+        if isinstance(first_elem, Slice):
+            start, stop = first_elem.start, first_elem.stop
+            first_elem  = first_elem.value
+        else:
+            start, stop = 0, None
+        if not isinstance(first_elem, Signal) or first_elem not in self.state.signals:
+            return None
+        base = self.state.signals[first_elem]
+        if base not in self.state.memories:
+            return None
+
+        memory = self.state.memories[base]
+        words  = memory._array
+        if len(elems) != len(words):
+            return None
+        if stop is None:
+            for elem, word in zip(elems, words):
+                if elem is not word:
+                    return None
+            stop = memory.width
+        else:
+            for elem, word in zip(elems, words):
+                if not (isinstance(elem, Slice) and elem.value is word and
+                        elem.start == start and elem.stop == stop):
+                    return None
+        return base, len(words), memory.width, start, stop
+
+    def array_index(self, value, gen_index, depth):
+        # An out of bounds index selects the last element.
+        index_mask = (1 << len(value.index)) - 1
+        gen_index = self.emitter.def_var("index", f"{index_mask} & {gen_index}")
+        if index_mask >= depth:
+            gen_index = f"({gen_index} if {gen_index} < {depth} else {depth - 1})"
+        return gen_index
+
     def on_value(self, value):
         # Very large values are unlikely to compile or simulate in reasonable time.
         if len(value) > 2 ** 16:
@@ -103,24 +247,31 @@ class _ValueCompiler(ValueVisitor, _Compiler):
 
 
 class _RHSValueCompiler(_ValueCompiler):
-    def __init__(self, state, emitter, *, mode, inputs=None):
+    def __init__(self, state, emitter, *, mode, inputs=None, direct=frozenset()):
         super().__init__(state, emitter)
         assert mode in ("curr", "next")
         self.mode = mode
         # If not None, `inputs` gets populated with RHS signals.
         self.inputs = inputs
+        # The next state of signals with these indexes is read from `next` instead of from local
+        # variables. See `_LHSValueCompiler` for details.
+        self.direct = direct
 
     def on_Const(self, value):
-        return f"{value.value}"
+        return self.emitter.const(value)
 
     def on_Signal(self, value):
         if self.inputs is not None:
             self.inputs.add(value)
 
+        signal_index = self.state.get_signal(value)
+        slot = self.emitter.slot(signal_index)
         if self.mode == "curr":
-            return f"slots[{self.state.get_signal(value)}].{self.mode}"
+            return f"curr[{slot}]"
+        elif signal_index in self.direct:
+            return f"next[{slot}]"
         else:
-            return f"next_{self.state.get_signal(value)}"
+            return f"next_{slot}"
 
     def on_Operator(self, value):
         def mask(value):
@@ -224,58 +375,96 @@ class _RHSValueCompiler(_ValueCompiler):
         return f"0"
 
     def on_ArrayProxy(self, value):
+        memory_proxy = self.memory_proxy(value)
+        if memory_proxy is not None and (self.mode == "curr" or memory_proxy[0] in self.direct):
+            base, depth, word_width, start, stop = memory_proxy
+            if self.inputs is not None:
+                self.inputs.update(self.state.slots[base:base + depth])
+            gen_slot = f"{self.emitter.slot(base)} + " \
+                       f"{self.array_index(value, self(value.index), depth)}"
+            return f"({(1 << (stop - start)) - 1} & ({self.mode}[{gen_slot}] >> {start}))"
+
+        elems = value.elems
+        if not elems:
+            return f"0"
+
+        # Elements are selected by indexing a table, so that reading an element of a large array
+        # is no slower than reading an element of a small one. Constants and signals are stored
+        # in the table directly, and any other element is computed by a function stored in it.
+        if all(isinstance(elem, Const) for elem in elems):
+            gen_index = self.array_index(value, self(value.index), len(elems))
+            gen_table = self.emitter.def_const("table", repr(tuple(elem.value for elem in elems)))
+            return f"{gen_table}[{gen_index}]"
+        if all(isinstance(elem, Signal) for elem in elems):
+            indexes = [self.state.get_signal(elem) for elem in elems]
+            if self.mode == "curr" or all(index in self.direct for index in indexes):
+                if self.inputs is not None:
+                    self.inputs.update(elems)
+                gen_index = self.array_index(value, self(value.index), len(elems))
+                gen_table = self.emitter.def_const("table",
+                    f"({', '.join(map(self.emitter.slot, indexes))},)")
+                return f"{self.mode}[{gen_table}[{gen_index}]]"
+        if self.mode == "curr":
+            gen_index = self.array_index(value, self(value.index), len(elems))
+            gen_elems = []
+            for elem in elems:
+                with self.emitter.def_function("elem") as gen_elem:
+                    self.emitter.append(f"return {self(elem)}")
+                gen_elems.append(gen_elem)
+            gen_table = self.emitter.def_const("table", f"({', '.join(gen_elems)},)")
+            return f"{gen_table}[{gen_index}]()"
+
+        # The next state of signals may be stored in local variables, which are not accessible
+        # to functions in a table.
         index_mask = (1 << len(value.index)) - 1
         gen_index = self.emitter.def_var("rhs_index", f"{index_mask} & {self(value.index)}")
         gen_value = self.emitter.gen_var("rhs_proxy")
-        if value.elems:
-            for index, elem in enumerate(value.elems):
-                if index == 0:
-                    self.emitter.append(f"if {index} == {gen_index}:")
-                else:
-                    self.emitter.append(f"elif {index} == {gen_index}:")
-                with self.emitter.indent():
-                    self.emitter.append(f"{gen_value} = {self(elem)}")
-            self.emitter.append(f"else:")
-            with self.emitter.indent():
-                self.emitter.append(f"{gen_value} = {self(value.elems[-1])}")
-            return gen_value
-        else:
-            return f"0"
-
-    @classmethod
-    def compile(cls, state, value, *, mode):
-        emitter = _PythonEmitter()
-        compiler = cls(state, emitter, mode=mode)
-        emitter.append(f"result = {compiler(value)}")
-        return emitter.flush()
+        def emit_elem(index):
+            self.emitter.append(f"{gen_value} = {self(elems[index])}")
+        self.dispatch(gen_index, len(elems), emit_elem)
+        return gen_value
 
 
 class _LHSValueCompiler(_ValueCompiler):
-    def __init__(self, state, emitter, *, rhs, outputs=None):
+    def __init__(self, state, emitter, *, rhs, outputs=None, direct=frozenset()):
         super().__init__(state, emitter)
         # `rrhs` is used to translate rvalues that are syntactically a part of an lvalue, e.g.
         # the offset of a Part.
         self.rrhs = rhs
         # `lrhs` is used to translate the read part of a read-modify-write cycle during partial
         # update of an lvalue.
-        self.lrhs = _RHSValueCompiler(state, emitter, mode="next", inputs=None)
+        self.lrhs = _RHSValueCompiler(state, emitter, mode="next", inputs=None, direct=direct)
         # If not None, `outputs` gets populated with signals on LHS.
         self.outputs = outputs
+        # Signals with these indexes (such as words of native memories) are updated in `next`
+        # directly, and are not loaded into local variables before the update. This requires
+        # that the process does not include these signals in its set of drivers, and avoids
+        # the per-signal overhead of processes that only update a few of many signals they drive.
+        self.direct = direct
 
     def on_Const(self, value):
         raise TypeError # :nocov:
 
+    def sign(self, value, arg):
+        value_mask = (1 << len(value)) - 1
+        if value.shape().signed:
+            return f"sign({value_mask} & {arg}, {-1 << (len(value) - 1)})"
+        else: # unsigned
+            return f"{value_mask} & {arg}"
+
     def on_Signal(self, value):
         if self.outputs is not None:
             self.outputs.add(value)
 
         def gen(arg):
-            value_mask = (1 << len(value)) - 1
-            if value.shape().signed:
-                value_sign = f"sign({value_mask} & {arg}, {-1 << (len(value) - 1)})"
-            else: # unsigned
-                value_sign = f"{value_mask} & {arg}"
-            self.emitter.append(f"next_{self.state.get_signal(value)} = {value_sign}")
+            value_sign = self.sign(value, arg)
+            signal_index = self.state.get_signal(value)
+            slot = self.emitter.slot(signal_index)
+            if signal_index in self.direct:
+                self.emitter.append(f"next[{slot}] = {value_sign}")
+                self.emitter.append(f"pending.add({slot})")
+            else:
+                self.emitter.append(f"next_{slot} = {value_sign}")
         return gen
 
     def on_Operator(self, value):
@@ -313,30 +502,55 @@ class _LHSValueCompiler(_ValueCompiler):
         raise TypeError # :nocov:
 
     def on_ArrayProxy(self, value):
+        memory_proxy = self.memory_proxy(value)
+        if memory_proxy is not None and memory_proxy[0] in self.direct:
+            base, depth, word_width, start, stop = memory_proxy
+            def gen(arg):
+                gen_slot = self.emitter.def_var("mem_slot",
+                    f"{self.emitter.slot(base)} + "
+                    f"{self.array_index(value, self.rrhs(value.index), depth)}")
+                width_mask = (1 << (stop - start)) - 1
+                if stop - start == word_width:
+                    self.emitter.append(f"next[{gen_slot}] = {width_mask} & {arg}")
+                else:
+                    self.emitter.append(f"next[{gen_slot}] = next[{gen_slot}] & " \
+                        f"{~(width_mask << start)} | (({width_mask} & {arg}) << {start})")
+                self.emitter.append(f"pending.add({gen_slot})")
+            return gen
+
+        # Signals of the same shape that are updated directly are selected by indexing a table,
+        # just like they are when an array is read.
+        elems = value.elems
+        if (elems and all(isinstance(elem, Signal) for elem in elems) and
+                len({(len(elem), elem.shape().signed) for elem in elems}) == 1 and
+                all(self.state.get_signal(elem) in self.direct for elem in elems)):
+            if self.outputs is not None:
+                self.outputs.update(elems)
+            def gen(arg):
+                gen_index = self.array_index(value, self.rrhs(value.index), len(elems))
+                gen_slots = (self.emitter.slot(self.state.get_signal(elem)) for elem in elems)
+                gen_table = self.emitter.def_const("table", f"({', '.join(gen_slots)},)")
+                gen_slot = self.emitter.def_var("array_slot", f"{gen_table}[{gen_index}]")
+                self.emitter.append(f"next[{gen_slot}] = {self.sign(elems[0], arg)}")
+                self.emitter.append(f"pending.add({gen_slot})")
+            return gen
+
         def gen(arg):
             index_mask = (1 << len(value.index)) - 1
             gen_index = self.emitter.def_var("index", f"{self.rrhs(value.index)} & {index_mask}")
-            if value.elems:
-                for index, elem in enumerate(value.elems):
-                    if index == 0:
-                        self.emitter.append(f"if {index} == {gen_index}:")
-                    else:
-                        self.emitter.append(f"elif {index} == {gen_index}:")
-                    with self.emitter.indent():
-                        self(elem)(arg)
-                self.emitter.append(f"else:")
-                with self.emitter.indent():
-                    self(value.elems[-1])(arg)
+            if elems:
+                self.dispatch(gen_index, len(elems), lambda index: self(elems[index])(arg))
             else:
                 self.emitter.append(f"pass")
         return gen
 
 
 class _StatementCompiler(StatementVisitor, _Compiler):
-    def __init__(self, state, emitter, *, inputs=None, outputs=None):
+    def __init__(self, state, emitter, *, inputs=None, outputs=None, direct=frozenset()):
         super().__init__(state, emitter)
         self.rhs = _RHSValueCompiler(state, emitter, mode="curr", inputs=inputs)
-        self.lhs = _LHSValueCompiler(state, emitter, rhs=self.rhs, outputs=outputs)
+        self.lhs = _LHSValueCompiler(state, emitter, rhs=self.rhs, outputs=outputs,
+                                     direct=direct)
 
     def on_statements(self, stmts):
         for stmt in stmts:
@@ -351,9 +565,15 @@ class _StatementCompiler(StatementVisitor, _Compiler):
             gen_rhs = f"sign({gen_rhs}, {-1 << (len(stmt.rhs) - 1)})"
         return self.lhs(stmt.lhs)(gen_rhs)
 
+    # Switches with at least this many cases are compiled to a jump table. Calling the function of
+    # a case costs about as much as testing 16 patterns.
+    JUMP_TABLE_CASES = 16
+
     def on_Switch(self, stmt):
         gen_test_value = self.rhs(stmt.test) # check for oversized value before generating mask
         gen_test = self.emitter.def_var("test", f"{(1 << len(stmt.test)) - 1} & {gen_test_value}")
+        if len(stmt.cases) >= self.JUMP_TABLE_CASES:
+            return self._jump_table(stmt, gen_test)
         for index, (patterns, stmts) in enumerate(stmt.cases.items()):
             gen_checks = []
             if not patterns:
@@ -374,6 +594,65 @@ class _StatementCompiler(StatementVisitor, _Compiler):
             with self.emitter.indent():
                 self(stmts)
 
+    def _jump_table(self, stmt, gen_test):
+        # Every case is compiled to a function, and the function of the matching case is looked
+        # up by the test value and called, which takes the same time regardless of the number of
+        # cases. The functions receive and return the local variables holding the next state of
+        # the signals assigned by the switch. Patterns with wildcards are grouped by mask, with one
+        # table per mask that maps the masked test value to the index of the first case it
+        # matches; the first matching case is then the one with the lowest index found in any of
+        # the tables. A test value that matches no case selects a function that does nothing.
+        gen_nexts = []
+        for signal in stmt._lhs_signals():
+            signal_index = self.state.get_signal(signal)
+            if signal_index not in self.lhs.direct:
+                gen_nexts.append(f"next_{self.emitter.slot(signal_index)}")
+
+        cases = list(stmt.cases.items())
+        gen_cases = []
+        for patterns, stmts in [*cases, ((), [])]:
+            with self.emitter.def_function("case", gen_nexts) as gen_case:
+                if stmts or not gen_nexts:
+                    self(stmts)
+                if gen_nexts:
+                    self.emitter.append(f"return {', '.join(gen_nexts)}")
+            gen_cases.append(gen_case)
+
+        test_mask = (1 << len(stmt.test)) - 1
+        tables = {}
+        for index, (patterns, stmts) in enumerate(cases):
+            if not patterns:
+                tables.setdefault(0, {}).setdefault(0, index)
+            for pattern in patterns:
+                mask  = int("".join("0" if b == "-" else "1" for b in pattern), 2)
+                value = int("".join("0" if b == "-" else  b  for b in pattern), 2)
+                tables.setdefault(mask, {}).setdefault(value, index)
+
+        if len(tables) == 1:
+            # The table can map the test value to the function directly.
+            (mask, table), = tables.items()
+            gen_table = self.emitter.def_const("table", "{{{}}}.get".format(
+                ", ".join(f"{value}: {gen_cases[index]}" for value, index in table.items())))
+            if mask != test_mask:
+                gen_test = f"{mask} & {gen_test}"
+            gen_call = f"{gen_table}({gen_test}, {gen_cases[-1]})({', '.join(gen_nexts)})"
+        else:
+            gen_lookups = []
+            for mask, table in tables.items():
+                gen_table = self.emitter.def_const("table", f"{table!r}.get")
+                if mask == test_mask:
+                    gen_lookups.append(f"{gen_table}({gen_test}, {len(cases)})")
+                else:
+                    gen_lookups.append(f"{gen_table}({mask} & {gen_test}, {len(cases)})")
+            gen_functions = self.emitter.def_const("cases", f"({', '.join(gen_cases)},)")
+            gen_call = f"{gen_functions}[min({', '.join(gen_lookups)})]({', '.join(gen_nexts)})"
+        if len(gen_nexts) == 1:
+            self.emitter.append(f"{gen_nexts[0]} = {gen_call}")
+        elif gen_nexts:
+            self.emitter.append(f"{', '.join(gen_nexts)} = {gen_call}")
+        else:
+            self.emitter.append(gen_call)
+
     def on_Assert(self, stmt):
         raise NotImplementedError # :nocov:
 
@@ -383,83 +662,504 @@ class _StatementCompiler(StatementVisitor, _Compiler):
     def on_Cover(self, stmt):
         raise NotImplementedError # :nocov:
 
+
+class _ProcessKey:
+    """Structural description of the code generated for a process.
+
+    Signals are described by their shape, reset value, and storage in the simulation state, and
+    are numbered in the order of their first appearance, so that the description of structurally
+    identical processes is the same regardless of which signals they use and which slots these
+    signals occupy.
+    """
+    def __init__(self, state):
+        self.state   = state
+        self.signals = SignalDict()
+        self.order   = []
+
+    def signal(self, signal):
+        try:
+            return self.signals[signal][0]
+        except KeyError:
+            signal_index = self.state.get_signal(signal)
+            memory = self.state.memories.get(signal_index)
+            position = len(self.order)
+            self.signals[signal] = (position, (len(signal), signal.shape().signed, signal.reset,
+                self.state.is_memory_word(signal_index),
+                memory and (len(memory._array), memory.width)))
+            self.order.append(signal)
+            return position
+
+    def value(self, value):
+        if isinstance(value, Const):
+            return ("C", value.value, len(value), value.shape().signed)
+        if isinstance(value, Signal):
+            return ("S", self.signal(value))
+        if isinstance(value, Operator):
+            return ("O", value.operator, *map(self.value, value.operands))
+        if isinstance(value, Slice):
+            return ("Sl", value.start, value.stop, self.value(value.value))
+        if isinstance(value, Part):
+            return ("P", value.width, value.stride, self.value(value.value),
+                    self.value(value.offset))
+        if isinstance(value, Cat):
+            return ("Cat", *map(self.value, value.parts))
+        if isinstance(value, Repl):
+            return ("R", value.count, self.value(value.value))
+        if isinstance(value, ArrayProxy):
+            return ("A", self.value(value.index), *map(self.value, value.elems))
+        return self.unknown(value)
+
+    def statement(self, stmt):
+        if isinstance(stmt, Assign):
+            return ("=", self.value(stmt.lhs), self.value(stmt.rhs))
+        if isinstance(stmt, Switch):
+            return ("Sw", self.value(stmt.test),
+                    *((patterns, self.statements(stmts)) for patterns, stmts in stmt.cases.items()))
+        return self.unknown(stmt)
+
+    def statements(self, stmts):
+        return tuple(map(self.statement, stmts))
+
+    def unknown(self, obj):
+        # Any other value or statement cannot be compiled anyway.
+        return ("?", repr(obj))
+
+    def __call__(self, *, is_comb, direct_signals, signals, stmts):
+        description = (
+            is_comb,
+            tuple(map(self.signal, direct_signals)),
+            tuple(map(self.signal, signals)),
+            self.statements(stmts),
+            tuple(attrs for position, attrs in self.signals.values()),
+        )
+        return hashlib.sha256(repr(description).encode("utf-8")).hexdigest()
+
+
+class _CodeCache:
+    """On-disk cache of code generated for processes.
+
+    Entries are keyed by the structural description of a process (see :class:`_ProcessKey`),
+    and contain the compiled code object along with the positions of the signals it uses in that
+    description. Constructing a simulator for a design whose processes are all in the cache skips
+    both code generation and compilation.
+
+    The cache is enabled by setting the ``AMARANTH_PYSIM_CACHE_DIR`` environment variable to
+    the directory where it should be stored, or by constructing simulators within
+    :meth:`in_directory`. The number of cache hits and misses is counted in :attr:`hits` and
+    :attr:`misses`.
+    """
+    # Increment when the code generator changes in a way that affects the generated code.
+    VERSION = 4
+
+    _instances = {}
+    _override  = None
+
     @classmethod
-    def compile(cls, state, stmt):
-        output_indexes = [state.get_signal(signal) for signal in stmt._lhs_signals()]
-        emitter = _PythonEmitter()
-        for signal_index in output_indexes:
-            emitter.append(f"next_{signal_index} = slots[{signal_index}].next")
-        compiler = cls(state, emitter)
-        compiler(stmt)
-        for signal_index in output_indexes:
-            emitter.append(f"slots[{signal_index}].set(next_{signal_index})")
-        return emitter.flush()
+    def _get(cls, directory):
+        if directory not in cls._instances:
+            cls._instances[directory] = cls(directory)
+        return cls._instances[directory]
 
+    @classmethod
+    def default(cls):
+        if cls._override is not None:
+            return cls._get(cls._override)
+        directory = os.getenv("AMARANTH_PYSIM_CACHE_DIR")
+        if not directory:
+            return None
+        return cls._get(directory)
 
-class _FragmentCompiler:
+    @classmethod
+    @contextmanager
+    def in_directory(cls, directory):
+        """Use the cache in ``directory`` for simulators constructed within this context,
+        regardless of the environment."""
+        saved_override = cls._override
+        cls._override = os.fspath(directory)
+        try:
+            yield cls._get(cls._override)
+        finally:
+            cls._override = saved_override
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits      = 0
+        self.misses    = 0
+        self._entries  = {}
+
+    def _filename(self, key):
+        return os.path.join(self.directory, f"{key}.{sys.implementation.cache_tag}.pysim")
+
+    def get(self, key):
+        if key not in self._entries:
+            try:
+                with open(self._filename(key), "rb") as f:
+                    version, *entry = marshal.load(f)
+                if version != self.VERSION:
+                    raise ValueError
+                self._entries[key] = tuple(entry)
+            except (OSError, EOFError, ValueError, TypeError):
+                self.misses += 1
+                return None
+        self.hits += 1
+        return self._entries[key]
+
+    def put(self, key, code, slot_positions, input_positions):
+        self._entries[key] = (code, slot_positions, input_positions)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Write the entry under a temporary name first, so that concurrent simulations never
+            # observe an incomplete entry.
+            with tempfile.NamedTemporaryFile(dir=self.directory, prefix=".", delete=False) as f:
+                marshal.dump((self.VERSION, code, slot_positions, input_positions), f)
+            os.replace(f.name, self._filename(key))
+        except OSError:
+            pass
+
+
+class _CommandKey(_ProcessKey):
+    """Structural description of a value or a statement used as a command by a testbench.
+
+    Unlike :class:`_ProcessKey`, signals are described by their identity, since the command is
+    only ever compiled for one simulation state. The values of constants are excluded from
+    the description and collected in :attr:`consts`, so that e.g. assignments of different
+    values to the same signal share the same compiled code.
+    """
+    def __init__(self, state):
+        super().__init__(state)
+        self.consts = []
+        self.const_names = {}
+        self._array_level = 0
+
+    def signal(self, signal):
+        return signal.duid
+
+    def value(self, value):
+        if isinstance(value, Const) and not self._array_level:
+            self.const_names[id(value)] = f"const_{len(self.consts)}"
+            self.consts.append(value.value)
+            return ("C", len(value), value.shape().signed)
+        if isinstance(value, ArrayProxy):
+            # Elements of arrays are compiled into tables that are built before the command runs,
+            # so the constants in them cannot be arguments, and are described by their value.
+            index = self.value(value.index)
+            self._array_level += 1
+            try:
+                return ("A", index, *map(self.value, value.elems))
+            finally:
+                self._array_level -= 1
+        return super().value(value)
+
+    def unknown(self, obj):
+        raise TypeError
+
+
+class _CommandEmitter(_PythonEmitter):
+    def __init__(self, const_names):
+        super().__init__()
+        self._const_names = const_names
+        self._function_level = 0
+
+    @contextmanager
+    def def_function(self, prefix, params=()):
+        self._function_level += 1
+        try:
+            with super().def_function(prefix, params) as name:
+                yield name
+        finally:
+            self._function_level -= 1
+
+    def const(self, value):
+        # Functions are defined outside of `run`, where its arguments are not accessible; their
+        # constants are described by value in the key of the command, and can be emitted as is.
+        if not self._function_level:
+            name = self._const_names.get(id(value))
+            if name is not None:
+                return name
+        return super().const(value)
+
+
+class _CommandCompiler:
+    """Compiler for values and statements used as commands by testbench processes.
+
+    Each command is compiled to a function that takes the values of the constants in it as
+    arguments. Compiled functions are memoized by the structure of the command, so a testbench
+    that repeatedly reads or writes the same signals only compiles code the first time.
+    """
     def __init__(self, state):
         self.state = state
+        self.cache = {}
+        self.signal_cache = {}
+        self.exec_locals = {
+            "curr": self.state.curr,
+            "next": self.state.next,
+            "pending": self.state.pending,
+            **_ValueCompiler.helpers
+        }
+
+    def __call__(self, command):
+        """Compile a command.
+
+        Returns a tuple ``(run, args)``, where ``run(*args)`` returns the value of ``command``
+        if it is a :class:`Value`, or applies ``command`` if it is a :class:`Statement`.
+        """
+        # Reading a signal is by far the most common command, so the result of compiling it is
+        # also memoized by the identity of the signal, which avoids building its key.
+        if type(command) is Signal:
+            try:
+                signal, run, args = self.signal_cache[id(command)]
+                if signal is command:
+                    return run, args
+            except KeyError:
+                pass
+            run, args = self._call(command)
+            self.signal_cache[id(command)] = (command, run, args)
+            return run, args
+        return self._call(command)
+
+    def _call(self, command):
+        command_key = _CommandKey(self.state)
+        try:
+            if isinstance(command, Value):
+                key = command_key.value(command)
+            else:
+                key = command_key.statement(command)
+        except TypeError:
+            # The command cannot be compiled, and `_compile` will raise an appropriate exception.
+            return self._compile(command, command_key), command_key.consts
+
+        try:
+            run = self.cache[key]
+        except KeyError:
+            run = self.cache[key] = self._compile(command, command_key)
+        return run, command_key.consts
+
+    def _compile(self, command, command_key):
+        emitter = _CommandEmitter(command_key.const_names)
+        const_args = (f"const_{index}" for index in range(len(command_key.consts)))
+        emitter.append(f"def run({', '.join(const_args)}):")
+        with emitter.indent():
+            if isinstance(command, Value):
+                compiler = _RHSValueCompiler(self.state, emitter, mode="curr")
+                emitter.append(f"return {compiler(command)}")
+            else:
+                output_indexes = [self.state.get_signal(signal)
+                                  for signal in command._lhs_signals()]
+                for signal_index in output_indexes:
+                    emitter.append(f"next_{signal_index} = next[{signal_index}]")
+                compiler = _StatementCompiler(self.state, emitter)
+                compiler(command)
+                for signal_index in output_indexes:
+                    emitter.set_signal(signal_index)
+        # Each command has its own namespace, since the names of tables it defines are only
+        # unique within it.
+        exec_locals = dict(self.exec_locals)
+        exec(emitter.flush(), exec_locals)
+        return exec_locals["run"]
+
+
+class _FragmentCompiler:
+    def __init__(self, state, *, cache=None):
+        self.state = state
+        self.cache = cache
 
     def __call__(self, fragment):
+        # Memory words must occupy consecutive slots, so they are allocated before any other
+        # signals are.
+        for memory in self._find_memories(fragment):
+            self.state.add_memory(memory)
+        return self._compile(fragment, hierarchy=("top",))
+
+    def _find_memories(self, fragment):
+        if isinstance(fragment, Instance) and fragment.type in ("$memrd", "$memwr"):
+            memory = fragment.parameters["MEMID"]
+            if memory.depth > 0 and len(memory._array) == memory.depth:
+                yield memory
+        for subfragment, subfragment_name in fragment.subfragments:
+            yield from self._find_memories(subfragment)
+
+    def _compile(self, fragment, *, hierarchy):
         processes = set()
 
+        # Memory write ports drive every word of the memory, but only ever update a single word
+        # at a time; they update it in place instead of loading every word into a local variable.
+        memory_words = SignalSet()
+        if isinstance(fragment, Instance) and fragment.type == "$memwr":
+            memory = fragment.parameters["MEMID"]
+            if memory in self.state.memories.values():
+                memory_words.update(memory._array)
+
         for domain_name, domain_signals in fragment.drivers.items():
             domain_stmts = LHSGroupFilter(domain_signals)(fragment.statements)
-            domain_process = PyRTLProcess(is_comb=domain_name is None)
-
-            emitter = _PythonEmitter()
-            emitter.append(f"def run():")
-            emitter._level += 1
 
             if domain_name is None:
-                for signal in domain_signals:
-                    signal_index = self.state.get_signal(signal)
-                    emitter.append(f"next_{signal_index} = {signal.reset}")
-
-                inputs = SignalSet()
-                _StatementCompiler(self.state, emitter, inputs=inputs)(domain_stmts)
-
-                for input in inputs:
-                    self.state.add_trigger(domain_process, input)
-
+                # Combinational logic is split into independent groups of signals (a group is
+                # a transitive closure of signals that appear together on LHS), each with its own
+                # process. A process is only triggered by the inputs of its own group, so a change
+                # in the inputs of one group does not re-evaluate the logic of the others.
+                groups = list(LHSGroupAnalyzer()(domain_stmts).values())
+                ungrouped = SignalSet(domain_signals)
+                for group_signals in groups:
+                    ungrouped -= group_signals
+                if ungrouped:
+                    groups.append(ungrouped)
             else:
-                domain = fragment.domains[domain_name]
-                clk_trigger = 1 if domain.clk_edge == "pos" else 0
-                self.state.add_trigger(domain_process, domain.clk, trigger=clk_trigger)
-                if domain.rst is not None and domain.async_reset:
-                    rst_trigger = 1
-                    self.state.add_trigger(domain_process, domain.rst, trigger=rst_trigger)
-
-                for signal in domain_signals:
-                    signal_index = self.state.get_signal(signal)
-                    emitter.append(f"next_{signal_index} = slots[{signal_index}].next")
-
-                _StatementCompiler(self.state, emitter)(domain_stmts)
-
-            for signal in domain_signals:
-                signal_index = self.state.get_signal(signal)
-                emitter.append(f"slots[{signal_index}].set(next_{signal_index})")
-
-            # There shouldn't be any exceptions raised by the generated code, but if there are
-            # (almost certainly due to a bug in the code generator), use this environment variable
-            # to make backtraces useful.
-            code = emitter.flush()
-            if os.getenv("AMARANTH_pysim_dump"):
-                file = tempfile.NamedTemporaryFile("w", prefix="amaranth_pysim_", delete=False)
-                file.write(code)
-                filename = file.name
+                groups = [domain_signals]
+
+            if len(groups) > 1:
+                # Distribute the statements to their groups in a single pass. Only a statement
+                # that drives several groups (which can only be a `Switch`) has to be filtered
+                # for each of them.
+                signal_groups = SignalDict()
+                for group_index, group_signals in enumerate(groups):
+                    for signal in group_signals:
+                        signal_groups[signal] = group_index
+                groups_stmts = [[] for _ in groups]
+                mixed_groups = set()
+                for stmt in domain_stmts:
+                    stmt_groups = {signal_groups[signal] for signal in stmt._lhs_signals()
+                                   if signal in signal_groups}
+                    for group_index in stmt_groups:
+                        groups_stmts[group_index].append(stmt)
+                    if len(stmt_groups) > 1:
+                        mixed_groups.update(stmt_groups)
+                for group_index in mixed_groups:
+                    groups_stmts[group_index] = \
+                        LHSGroupFilter(groups[group_index])(groups_stmts[group_index])
             else:
-                filename = "<string>"
-
-            exec_locals = {"slots": self.state.slots, **_ValueCompiler.helpers}
-            exec(compile(code, filename, "exec"), exec_locals)
-            domain_process.run = exec_locals["run"]
-
-            processes.add(domain_process)
+                groups_stmts = [domain_stmts]
+
+            for group_signals, group_stmts in zip(groups, groups_stmts):
+                group_process = PyRTLProcess(is_comb=domain_name is None, hierarchy=hierarchy,
+                                             domain=domain_name)
+                group_process.outputs.update(group_signals)
+                direct_signals = SignalSet(memory_words)
+                if domain_name is not None:
+                    # Likewise, synchronous processes usually only update a single element of
+                    # an array of registers at a time. (Combinational processes have to assign
+                    # every signal they drive anyway.)
+                    direct_signals.update(signal for signal in self._array_signals(group_stmts)
+                                          if signal in group_signals)
+                group_signals = SignalSet(signal for signal in group_signals
+                                          if signal not in direct_signals)
+
+                if domain_name is not None:
+                    domain = fragment.domains[domain_name]
+                    clk_trigger = 1 if domain.clk_edge == "pos" else 0
+                    self.state.add_trigger(group_process, domain.clk, trigger=clk_trigger)
+                    if domain.rst is not None and domain.async_reset:
+                        rst_trigger = 1
+                        self.state.add_trigger(group_process, domain.rst, trigger=rst_trigger)
+
+                group_process.run = self._compile_process(group_process, group_signals,
+                    group_stmts, direct_signals=direct_signals)
+
+                if domain_name is None:
+                    for input in group_process.inputs:
+                        self.state.add_trigger(group_process, input)
+
+                processes.add(group_process)
 
         for subfragment_index, (subfragment, subfragment_name) in enumerate(fragment.subfragments):
             if subfragment_name is None:
                 subfragment_name = "U${}".format(subfragment_index)
-            processes.update(self(subfragment))
+            processes.update(self._compile(subfragment,
+                                           hierarchy=(*hierarchy, subfragment_name)))
 
         return processes
+
+    def _array_signals(self, stmts):
+        # Signals that are elements of arrays of signals assigned to by `stmts`.
+        signals = SignalSet()
+        def on_value(value):
+            if isinstance(value, ArrayProxy):
+                if all(isinstance(elem, Signal) for elem in value.elems):
+                    signals.update(value.elems)
+                else:
+                    for elem in value.elems:
+                        on_value(elem)
+            elif isinstance(value, (Slice, Part)):
+                on_value(value.value)
+            elif isinstance(value, Cat):
+                for part in value.parts:
+                    on_value(part)
+        def on_statements(stmts):
+            for stmt in stmts:
+                if isinstance(stmt, Assign):
+                    on_value(stmt.lhs)
+                elif isinstance(stmt, Switch):
+                    for case_stmts in stmt.cases.values():
+                        on_statements(case_stmts)
+        on_statements(stmts)
+        return signals
+
+    def _compile_process(self, process, signals, stmts, *, direct_signals):
+        exec_locals = {
+            "curr": self.state.curr,
+            "next": self.state.next,
+            "pending": self.state.pending,
+            **_ValueCompiler.helpers
+        }
+
+        if self.cache is not None:
+            process_key = _ProcessKey(self.state)
+            key = process_key(is_comb=process.is_comb, direct_signals=direct_signals,
+                              signals=signals, stmts=stmts)
+            entry = self.cache.get(key)
+            if entry is not None:
+                code, slot_positions, input_positions = entry
+                process.inputs.update(process_key.order[position] for position in input_positions)
+                exec(code, exec_locals)
+                return exec_locals["make"](*(self.state.get_signal(process_key.order[position])
+                                             for position in slot_positions))
+
+        emitter = _ClosureEmitter()
+        emitter.append(f"def run():")
+        emitter._level += 1
+
+        if process.is_comb:
+            for signal in signals:
+                signal_index = self.state.get_signal(signal)
+                emitter.append(f"next_{emitter.slot(signal_index)} = {signal.reset}")
+
+            _StatementCompiler(self.state, emitter, inputs=process.inputs)(stmts)
+
+        else:
+            for signal in signals:
+                signal_index = self.state.get_signal(signal)
+                slot = emitter.slot(signal_index)
+                emitter.append(f"next_{slot} = next[{slot}]")
+
+            direct = {self.state.get_signal(signal) for signal in direct_signals}
+            _StatementCompiler(self.state, emitter, direct=direct)(stmts)
+
+        for signal in signals:
+            signal_index = self.state.get_signal(signal)
+            emitter.set_signal(signal_index)
+
+        # There shouldn't be any exceptions raised by the generated code, but if there are
+        # (almost certainly due to a bug in the code generator), use this environment variable
+        # to make backtraces useful.
+        slots = emitter.slots
+        code = emitter.flush()
+        if os.getenv("AMARANTH_pysim_dump"):
+            file = tempfile.NamedTemporaryFile("w", prefix="amaranth_pysim_", delete=False)
+            file.write(code)
+            filename = file.name
+        else:
+            filename = "<string>"
+
+        code = compile(code, filename, "exec")
+        if self.cache is not None:
+            positions = process_key.signals
+            try:
+                self.cache.put(key, code,
+                    tuple(positions[self.state.slots[index]][0] for index in slots),
+                    tuple(positions[signal][0] for signal in process.inputs))
+            except KeyError:
+                # A signal used by the process does not appear in its description; this is
+                # a bug in `_ProcessKey`, but the process can still be simulated.
+                pass
+
+        exec(code, exec_locals)
+        return exec_locals["make"](*slots)
@@ -1,7 +1,11 @@
 import inspect
 import warnings
+import functools
+import array
+from collections.abc import Mapping
 
 from .._utils import deprecated
+from ..hdl.ast import Value, Const, SignalDict
 from ..hdl.cd import *
 from ..hdl.ir import *
 from ._base import BaseEngine
@@ -11,7 +15,9 @@ __all__ = ["Settle", "Delay", "Tick", "Passive", "Active", "Simulator"]
 
 
 class Command:
-    pass
+    def __await__(self):
+        # Allows `async def` processes to use commands as `await Tick()`, etc.
+        return (yield self)
 
 
 class Settle(Command):
@@ -52,6 +58,14 @@ class Active(Command):
         return "(active)"
 
 
+class _Changed(Command):
+    def __init__(self, *signals):
+        self.signals = signals
+
+    def __repr__(self):
+        return "(changed {})".format(" ".join(map(repr, self.signals)))
+
+
 class Simulator:
     def __init__(self, fragment, *, engine="pysim"):
         if isinstance(engine, type) and issubclass(engine, BaseEngine):
@@ -59,6 +73,15 @@ class Simulator:
         elif engine == "pysim":
             from .pysim import PySimEngine
             engine = PySimEngine
+        elif engine == "pysim-levelized":
+            from .pysim import PyLevelizedSimEngine
+            engine = PyLevelizedSimEngine
+        elif engine == "pysim-cycle":
+            from .pysim import PyCycleSimEngine
+            engine = PyCycleSimEngine
+        elif engine == "cxxsim":
+            from .cxxsim import CxxrtlSimEngine
+            engine = CxxrtlSimEngine
         else:
             raise TypeError("Value '{!r}' is not a simulation engine class or "
                             "a simulation engine name"
@@ -66,7 +89,8 @@ class Simulator:
 
         self._fragment = Fragment.get(fragment, platform=None).prepare()
         self._engine   = engine(self._fragment)
-        self._clocked  = set()
+        # Maps each clocked domain to the clock process driving it.
+        self._clocked  = dict()
 
     def _check_process(self, process):
         if not (inspect.isgeneratorfunction(process) or inspect.iscoroutinefunction(process)):
@@ -76,20 +100,36 @@ class Simulator:
 
     def add_process(self, process):
         process = self._check_process(process)
-        def wrapper():
-            # Only start a bench process after comb settling, so that the reset values are correct.
-            yield Settle()
-            yield from process()
-        self._engine.add_coroutine_process(wrapper, default_cmd=None)
+        if inspect.iscoroutinefunction(process):
+            @functools.wraps(process)
+            async def wrapper():
+                await Settle()
+                await process()
+        else:
+            @functools.wraps(process)
+            def wrapper():
+                # Only start a bench process after comb settling, so that the reset values are
+                # correct.
+                yield Settle()
+                yield from process()
+        return self._engine.add_coroutine_process(wrapper, default_cmd=None)
 
     def add_sync_process(self, process, *, domain="sync"):
         process = self._check_process(process)
-        def wrapper():
-            # Only start a sync process after the first clock edge (or reset edge, if the domain
-            # uses an asynchronous reset). This matches the behavior of synchronous FFs.
-            yield Tick(domain)
-            yield from process()
-        self._engine.add_coroutine_process(wrapper, default_cmd=Tick(domain))
+        if inspect.iscoroutinefunction(process):
+            @functools.wraps(process)
+            async def wrapper():
+                await Tick(domain)
+                await process()
+        else:
+            @functools.wraps(process)
+            def wrapper():
+                # Only start a sync process after the first clock edge (or reset edge, if the
+                # domain uses an asynchronous reset). This matches the behavior of synchronous
+                # FFs.
+                yield Tick(domain)
+                yield from process()
+        return self._engine.add_coroutine_process(wrapper, default_cmd=Tick(domain))
 
     def add_clock(self, period, *, phase=None, domain="sync", if_exists=False):
         """Add a clock process.
@@ -136,8 +176,22 @@ class Simulator:
             # to happen at a non-zero time, distinguishing it from the reset values in the waveform
             # viewer.
             phase = period / 2
-        self._engine.add_clock_process(domain.clk, phase=phase, period=period)
-        self._clocked.add(domain)
+        process = self._engine.add_clock_process(domain.clk, phase=phase, period=period)
+        self._clocked[domain] = process
+        return process
+
+    def remove_process(self, process):
+        """Remove a process or a clock.
+
+        Removes a process that was added with :meth:`add_process` or :meth:`add_sync_process`,
+        or a clock that was added with :meth:`add_clock`, given the value returned by that
+        method. Together with :meth:`clear`, this makes it possible to reuse one simulation
+        of a design (which is only compiled once) for many independent tests.
+        """
+        self._engine.remove_process(process)
+        for domain, clock_process in list(self._clocked.items()):
+            if clock_process is process:
+                del self._clocked[domain]
 
     def reset(self):
         """Reset the simulation.
@@ -146,6 +200,62 @@ class Simulator:
         """
         self._engine.reset()
 
+    def clear(self):
+        """Clear the simulation.
+
+        Remove every user process and every clock, and assign the reset value to every signal
+        in the simulation. Afterwards, the simulation behaves as if it was just constructed, except
+        that the design does not have to be compiled again.
+        """
+        self._engine.clear()
+        self._clocked.clear()
+
+    def checkpoint(self):
+        """Take a snapshot of the state of the simulation.
+
+        Returns an opaque object that can be passed to :meth:`restore` to return the simulation
+        to the current point, e.g. to run several scenarios starting after a lengthy
+        initialization. The snapshot includes the values of every signal (and the contents of
+        every memory), the current time, and the state of every clock.
+
+        The state of user processes cannot be captured. Processes that have finished by the time
+        of the snapshot remain finished when it is restored, and processes that have not are
+        restarted from the beginning (their generator function is called again). Processes added
+        after the snapshot is taken are removed when it is restored.
+
+        Checkpoints are not supported by the ``"cxxsim"`` engine, which raises :exc:`TypeError`.
+        """
+        return (self, self._engine.checkpoint(), dict(self._clocked))
+
+    def restore(self, checkpoint):
+        """Restore the state of the simulation from a snapshot taken by :meth:`checkpoint`.
+
+        A snapshot can be restored any number of times, but not while waveforms are being written
+        by :meth:`write_vcd` or traces are being recorded by :meth:`record_trace`.
+        """
+        simulator, engine_checkpoint, clocked = checkpoint
+        if simulator is not self:
+            raise ValueError("Cannot restore a checkpoint of a different simulation")
+        self._engine.restore(engine_checkpoint)
+        self._clocked = dict(clocked)
+
+    def fork(self):
+        """Create an independent copy of the simulation.
+
+        The design is compiled again for the copy, and the copy starts in the current state of
+        the simulation, with the same clocks. As with :meth:`restore`, user processes that have
+        not finished are restarted from the beginning in the copy. Waveform files that are being
+        written are not written by the copy.
+
+        Forking is not supported by the ``"cxxsim"`` engine, which raises :exc:`TypeError`.
+        """
+        simulator = object.__new__(type(self))
+        simulator._fragment = self._fragment
+        simulator._engine, processes = self._engine.fork()
+        simulator._clocked  = {domain: processes[process]
+                               for domain, process in self._clocked.items()}
+        return simulator
+
     # TODO(amaranth-0.4): replace with _real_step
     @deprecated("instead of `sim.step()`, use `sim.advance()`")
     def step(self):
@@ -185,7 +295,221 @@ class Simulator:
         while (self.advance() or run_passive) and self._engine.now < deadline:
             pass
 
-    def write_vcd(self, vcd_file, gtkw_file=None, *, traces=()):
+    def tick(self, domain="sync"):
+        """Wait until the next active edge of the clock of ``domain``.
+
+        Returns a command, which can be used as ``await sim.tick()`` in an ``async def``
+        process, or as ``yield sim.tick()`` in a generator process.
+        """
+        return Tick(domain)
+
+    def delay(self, interval=None):
+        """Wait for ``interval`` seconds (or, if ``None``, until the end of the current timestep).
+
+        Returns a command, which can be used as ``await sim.delay(1e-6)`` in an ``async def``
+        process, or as ``yield sim.delay(1e-6)`` in a generator process.
+        """
+        return Delay(interval)
+
+    def changed(self, *signals):
+        """Wait until any of ``signals`` changes.
+
+        With the ``pysim-cycle`` engine, changes of signals driven by combinational logic do not
+        wake up processes.
+
+        Returns a command, which can be used as ``await sim.changed(sig)`` in an ``async def``
+        process, or as ``yield sim.changed(sig)`` in a generator process.
+        """
+        return _Changed(*signals)
+
+    async def advance_async(self):
+        """Advance the simulation, running ``async def`` processes within an :mod:`asyncio` event
+        loop.
+
+        Behaves like :meth:`advance`, except that ``async def`` processes may also await
+        :mod:`asyncio` futures and tasks (e.g. I/O with sockets or subprocesses). While any
+        process is waiting on one, the simulation does not advance in time, but every other
+        process keeps running; once no process can run, the event loop runs until one of the
+        futures completes. Time spent waiting on I/O therefore overlaps with the simulation,
+        and the results do not depend on how long the I/O took.
+
+        To let other :mod:`asyncio` tasks (e.g. requests to a reference model started with
+        :func:`asyncio.ensure_future` earlier) make progress, a process may also
+        ``await asyncio.sleep(0)``. The event loop is not run otherwise.
+        """
+        return await self._engine.advance_async()
+
+    async def run_async(self):
+        """Run the simulation while any processes are active, within an :mod:`asyncio` event loop.
+
+        See :meth:`run` and :meth:`advance_async`. It can be used as: ::
+
+            async def testbench():
+                for sample in samples:
+                    sim.poke(dut.i_data, sample)
+                    await sim.tick()
+                    assert sim.peek(dut.o_data) == await model.query(sample)
+
+            sim = Simulator(dut)
+            sim.add_clock(1e-6)
+            sim.add_sync_process(testbench)
+            asyncio.run(sim.run_async())
+        """
+        while await self.advance_async():
+            pass
+
+    async def run_until_async(self, deadline, *, run_passive=False):
+        """Run the simulation until it advances to ``deadline``, within an :mod:`asyncio` event
+        loop.
+
+        See :meth:`run_until` and :meth:`advance_async`.
+        """
+        assert self._engine.now <= deadline
+        while (await self.advance_async() or run_passive) and self._engine.now < deadline:
+            pass
+
+    def _clocked_domain(self, domain):
+        if not isinstance(domain, ClockDomain):
+            if domain in self._fragment.domains:
+                domain = self._fragment.domains[domain]
+            else:
+                raise ValueError("Domain {!r} is not present in simulation"
+                                 .format(domain))
+        if domain not in self._clocked:
+            raise ValueError("Domain {!r} is not driven by a clock process"
+                             .format(domain.name))
+        return domain
+
+    def peek(self, value):
+        """Read the current value of ``value``.
+
+        Unlike a process yielding ``value``, this method can be called from outside of any
+        process, e.g. between calls to :meth:`advance` or :meth:`advance_cycles`. If any signals
+        were changed by :meth:`poke`, the design is settled first, so that the result reflects
+        those changes. Reading the same signal (or an expression of the same structure) many times
+        only compiles code the first time.
+
+        Arguments
+        ---------
+        value : Value
+            Value to read.
+
+        Returns
+        -------
+        int
+            The value, which is negative if ``value`` is signed and has its sign bit set.
+        """
+        return self._engine.peek(Value.cast(value))
+
+    def poke(self, signal, value):
+        """Change the value of ``signal`` to ``value``.
+
+        Unlike a process yielding ``signal.eq(value)``, this method can be called from outside of
+        any process. The change takes effect (and the design reacts to it) at the current time,
+        the next time the simulation is advanced or :meth:`peek` is called.
+
+        Arguments
+        ---------
+        signal : Value
+            Signal, or any other value that can be assigned to (e.g. a slice of a signal).
+        value : int or Value
+            Value to assign.
+        """
+        self._engine.poke(Value.cast(signal), value)
+
+    def advance_cycles(self, count=1, *, domain="sync"):
+        """Advance the simulation by ``count`` cycles of the clock of ``domain``.
+
+        Stops once the design settles after the ``count``-th active edge of the clock, which must
+        be driven by a clock process (see :meth:`add_clock`). Other processes keep running as usual.
+
+        Arguments
+        ---------
+        count : int
+            Number of cycles.
+        domain : str or ClockDomain
+            Domain whose clock determines the cycles. If specified as a string, the domain with
+            that name is looked up in the root fragment of the simulation.
+        """
+        domain = self._clocked_domain(domain)
+        self._engine.run_vectors(inputs=SignalDict(), outputs=SignalDict(),
+                                 clock=domain.clk, edge=domain.clk_edge, count=count)
+
+    def run_vectors(self, inputs, outputs=(), *, domain="sync"):
+        """Drive inputs and sample outputs of the design once per clock cycle.
+
+        On each cycle, every signal in ``inputs`` is set to its next value, the simulation
+        advances past the next active edge of the clock of ``domain`` and settles, and the value
+        of every signal in ``outputs`` is recorded. Other processes keep running as usual, but
+        the inputs are driven and the outputs are sampled by the engine itself, which is much
+        faster than doing the same with a process. It can be used as: ::
+
+            sim = Simulator(frag)
+            sim.add_clock(1e-6)
+            results = sim.run_vectors([(dut.i_data, samples)], [dut.o_data])
+            filtered = results[dut.o_data]
+
+        Arguments
+        ---------
+        inputs : SignalDict or iterable of (Signal, sequence of int)
+            Values to drive each signal with, one per cycle (e.g. NumPy arrays, or lists). Every
+            sequence must have the same length, which determines the number of cycles to run.
+        outputs : iterable of Signal, or SignalDict or iterable of (Signal, mutable sequence)
+            Signals to sample after each cycle. If sequences are specified along with the signals,
+            the values are written to them (e.g. preallocated NumPy arrays), and they must be
+            at least as long as the inputs.
+        domain : str or ClockDomain
+            Domain whose clock, which must be driven by a clock process (see :meth:`add_clock`),
+            determines the cycles. If specified as a string, the domain with that name is looked
+            up in the root fragment of the simulation.
+
+        Returns
+        -------
+        SignalDict of sequence of int
+            The values of each output signal, one per cycle. Unless provided in ``outputs``, they
+            are stored in an :class:`array.array` of 64-bit integers, or in a list for signals
+            wider than 64 bits.
+        """
+        domain = self._clocked_domain(domain)
+
+        counts = set()
+        input_values = SignalDict()
+        if isinstance(inputs, Mapping):
+            inputs = inputs.items()
+        for signal, values in inputs:
+            # Values are normalized only once, outside of the simulation loop.
+            shape = signal.shape()
+            input_values[signal] = [Const.normalize(int(value), shape) for value in values]
+            counts.add(len(values))
+        if len(counts) > 1:
+            raise ValueError("Input vectors must all have the same length, not {}"
+                             .format(", ".join(str(count) for count in sorted(counts))))
+        count, = counts or {0}
+
+        if isinstance(outputs, Mapping):
+            outputs = outputs.items()
+        output_values = SignalDict()
+        for output in outputs:
+            if isinstance(output, tuple):
+                signal, values = output
+                if len(values) < count:
+                    raise ValueError("Output vector for {!r} has length {}, which is shorter "
+                                     "than the input vectors ({})"
+                                     .format(signal, len(values), count))
+            elif len(output) > 64:
+                signal, values = output, [0] * count
+            elif output.shape().signed:
+                signal, values = output, array.array("q", bytes(8 * count))
+            else:
+                signal, values = output, array.array("Q", bytes(8 * count))
+            output_values[signal] = values
+
+        self._engine.run_vectors(inputs=input_values, outputs=output_values,
+                                 clock=domain.clk, edge=domain.clk_edge, count=count)
+        return output_values
+
+    def write_vcd(self, vcd_file, gtkw_file=None, *, traces=(), include=None, exclude=(),
+                  depth=None, sample_domain=None, history=None, trigger=None, background=False):
         """Write waveforms to a Value Change Dump file, optionally populating a GTKWave save file.
 
         This method returns a context manager. It can be used as: ::
@@ -202,12 +526,132 @@ class Simulator:
         gtkw_file : str or file-like object
             GTKWave save file or filename.
         traces : iterable of Signal
-            Signals to display traces for.
+            Signals to display traces for. Memory words (e.g. ``memory[0]``) are only included
+            in the waveforms if they are listed here, and signals listed here are included
+            regardless of ``include``, ``exclude`` and ``depth``.
+        include : str or iterable of str
+            Glob patterns matched against dot-separated hierarchical names of signals, e.g.
+            ``"top.cpu.*"``. If specified, only signals whose name matches one of the patterns
+            are included in the waveforms.
+        exclude : str or iterable of str
+            Glob patterns of hierarchical names of signals to leave out of the waveforms.
+        depth : int
+            If specified, only signals in submodules at most ``depth`` levels below the toplevel
+            module are included in the waveforms. The toplevel module itself is at depth 0.
+        sample_domain : None or str or ClockDomain
+            If specified, signals are sampled once per active edge of the clock of this domain
+            (after the design settles following the edge), and written to the waveforms only if
+            their value has changed since the previous sample. Changes in between the edges, such
+            as glitches of combinational logic, are not recorded. If specified as a string, the
+            domain with that name is looked up in the root fragment of the simulation.
+        history : None or int
+            If specified, the waveforms are recorded in flight recorder mode: only the changes
+            made during the last ``history`` timesteps (or samples, if ``sample_domain`` is
+            specified) are kept in memory, and the file is only written if an exception is
+            raised within the ``with`` block (e.g. by a failing process), ``trigger`` becomes
+            true, or the ``dump()`` method of the object returned by the context manager is
+            called. Afterwards, further changes are written as they happen.
+        trigger : None or Value
+            In flight recorder mode, the history is written as soon as this value is non-zero.
+            Can only be specified together with ``history``.
+        background : bool
+            If ``True``, the waveforms are formatted and written to the file by a separate
+            process, to which the changes of signals are sent in batches, so that the simulation
+            only pays for recording them. Requires ``vcd_file`` to be a filename. The file is
+            complete once the context manager exits, and an error raised while writing it is
+            re-raised by the simulation (at the latest, when the context manager exits).
         """
-        if self._engine.now != 0.0:
+        def close_files():
             for file in (vcd_file, gtkw_file):
                 if hasattr(file, "close"):
                     file.close()
+
+        if self._engine.now != 0.0:
+            close_files()
             raise ValueError("Cannot start writing waveforms after advancing simulation time")
 
-        return self._engine.write_vcd(vcd_file=vcd_file, gtkw_file=gtkw_file, traces=traces)
+        if history is not None and (not isinstance(history, int) or history <= 0):
+            close_files()
+            raise TypeError("History length must be a positive integer, not {!r}"
+                            .format(history))
+
+        if trigger is not None and history is None:
+            close_files()
+            raise ValueError("Trigger can only be used in flight recorder mode, i.e. together "
+                             "with history")
+
+        if background and not isinstance(vcd_file, str):
+            close_files()
+            raise TypeError("Writing waveforms in the background requires the VCD file to be "
+                            "specified by name, not {!r}"
+                            .format(vcd_file))
+
+        if sample_domain is not None and not isinstance(sample_domain, ClockDomain):
+            if sample_domain in self._fragment.domains:
+                sample_domain = self._fragment.domains[sample_domain]
+            else:
+                close_files()
+                raise ValueError("Domain {!r} is not present in simulation"
+                                 .format(sample_domain))
+
+        if isinstance(include, str):
+            include = (include,)
+        if isinstance(exclude, str):
+            exclude = (exclude,)
+        return self._engine.write_vcd(vcd_file=vcd_file, gtkw_file=gtkw_file, traces=traces,
+                                      include=include, exclude=exclude, depth=depth,
+                                      sample_domain=sample_domain, history=history,
+                                      trigger=trigger, background=background)
+
+    def record_trace(self, traces):
+        """Record changes of signals in memory.
+
+        This method returns a context manager, which returns a trace object. It can be used as: ::
+
+            sim = Simulator(frag)
+            sim.add_clock(1e-6)
+            with sim.record_trace([stb, ack]) as trace:
+                sim.run_until(1e-3)
+            timestamps, values = trace.numpy(stb)
+            acks = trace.values_at(ack, [n * 1e-6 for n in range(1000)])
+
+        ``trace.numpy(signal)`` returns the times (as ``int64`` picoseconds) and the values of
+        every change of ``signal``, as well as of its value when the recording started, as NumPy
+        arrays. ``trace.values_at(signal, times)`` returns a NumPy array of the values of ``signal``
+        at each of ``times`` (in seconds). NumPy must be installed to use either of them.
+
+        Arguments
+        ---------
+        traces : iterable of Signal
+            Signals to record changes of.
+        """
+        return self._engine.record_trace(traces=traces)
+
+    def profile(self):
+        """Measure where the simulation spends its time.
+
+        This method returns a context manager, which returns a profile object. It can be used
+        as: ::
+
+            sim = Simulator(frag)
+            sim.add_clock(1e-6)
+            with sim.profile() as profile:
+                sim.run_until(1e-3)
+            print(profile.table())
+
+        While the simulation is being profiled, the number of times each process ran and the time
+        it took is counted, as well as the number of delta cycles it took to settle the design at
+        each time step, the number of times each signal changed, and the time spent writing
+        waveform files. (With the ``pysim-levelized`` and ``pysim-cycle`` engines, combinational
+        processes evaluated in dependency order do not take delta cycles of their own.) Processes
+        compiled from the design are identified by the hierarchical name of their fragment and by
+        their domain (or ``comb``), and testbench processes by the name of their function.
+
+        ``profile.table(limit=20)`` returns the results as human-readable tables,
+        ``profile.as_dict(limit=None)`` returns them as a dictionary, and
+        ``profile.json(limit=None)`` returns them as a JSON string.
+
+        Profiling slows the simulation down considerably, but does not affect its speed at all
+        when it is not enabled.
+        """
+        return self._engine.profile()
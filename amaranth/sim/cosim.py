@@ -0,0 +1,424 @@
+"""Co-simulation with external processes.
+
+A :class:`CosimBridge` exchanges the values of signals with a peer running in a separate process
+(e.g. a C++ reference model or a firmware emulator) once per cycle of a clock domain, over
+a :class:`SocketTransport` or a :class:`MmapTransport`. :class:`CosimPeer` implements the peer
+side of the protocol in Python, and can stand in for an external peer in tests.
+
+Protocol
+--------
+
+Every message is a sequence of bytes; its framing is defined by the transport. The bridge first
+sends a hello message: the bytes ``amaranth-cosim 1\\n`` followed by a UTF-8 JSON object with
+the keys ``quantum`` (an integer ``N``), ``inputs`` and ``outputs`` (lists of
+``[name, width, signed]``, describing the signals driven by the peer and read by the peer,
+respectively).
+
+All further messages are batches of rows. A row contains the values of every input (or output)
+signal, concatenated with the first signal in the least significant bits (as with :class:`Cat`),
+as a little-endian integer of ``ceil(total_width / 8)`` bytes (but at least 1 byte, even if
+there are no signals); signed values are stored in two's complement.
+
+The peer answers the hello message with a batch of ``N`` input rows. Input rows are applied
+one per cycle, each right after the preceding active clock edge (the first one at the start
+of the simulation). The bridge samples the outputs at each active clock edge, and after every
+``N`` edges, sends a batch of ``N`` output rows and waits for the next batch of ``N`` input rows.
+With ``N = 1`` the simulation runs in lock-step with the peer; with larger ``N``, the peer can
+only react to the outputs ``N`` cycles later, but the number of round trips is divided by ``N``.
+
+A batch with fewer than ``N`` input rows (possibly none) is the last one; once its rows are
+applied, the bridge process finishes.
+"""
+
+import os
+import json
+import mmap
+import time
+import socket
+import struct
+
+from ..hdl.ast import Cat
+from .core import Tick
+
+
+__all__ = ["SocketTransport", "MmapTransport", "CosimBridge", "CosimPeer"]
+
+
+_HELLO = b"amaranth-cosim 1\n"
+
+
+class SocketTransport:
+    """Transport over a connected stream socket (usually a UNIX domain socket).
+
+    Each message is prefixed with its length, as a 32-bit little-endian integer.
+    """
+    def __init__(self, sock):
+        self.sock = sock
+
+    @classmethod
+    def pair(cls):
+        """Create two connected transports, e.g. for a peer running in a thread or a forked
+        process."""
+        sock_a, sock_b = socket.socketpair()
+        return cls(sock_a), cls(sock_b)
+
+    @classmethod
+    def connect(cls, path):
+        """Connect to a peer listening on the UNIX domain socket ``path``."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        return cls(sock)
+
+    @classmethod
+    def listen(cls, path):
+        """Wait for a peer to connect to the UNIX domain socket ``path``.
+
+        The socket file is removed once the peer connects (or if waiting for it fails).
+        """
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            server.bind(path)
+            try:
+                server.listen(1)
+                sock, _ = server.accept()
+            finally:
+                os.unlink(path)
+        finally:
+            server.close()
+        return cls(sock)
+
+    def _recv_exactly(self, size):
+        chunks = []
+        while size > 0:
+            chunk = self.sock.recv(size)
+            if not chunk:
+                raise EOFError("Co-simulation peer closed the connection")
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def send(self, message):
+        self.sock.sendall(struct.pack("<I", len(message)) + message)
+
+    def recv(self):
+        size, = struct.unpack("<I", self._recv_exactly(4))
+        return self._recv_exactly(size)
+
+    def close(self):
+        self.sock.close()
+
+
+class _Ring:
+    # A single-producer, single-consumer ring buffer. `head` and `tail` are byte counters that
+    # are only ever incremented, by the producer and the consumer respectively. They are naturally
+    # aligned 64-bit words, accessed through a memoryview so that each load or store is a single
+    # 8-byte access, and the other side never observes a partially written counter.
+    HEADER = 16
+
+    def __init__(self, buffer, offset, capacity):
+        assert offset % 8 == 0
+        self.buffer   = buffer
+        self.counters = memoryview(buffer)[offset:offset + self.HEADER].cast("Q")
+        self.capacity = capacity
+        self.data     = offset + self.HEADER
+
+    def release(self):
+        self.counters.release()
+
+    def _copy_in(self, position, data):
+        start = position % self.capacity
+        first = min(len(data), self.capacity - start)
+        self.buffer[self.data + start:self.data + start + first] = data[:first]
+        self.buffer[self.data:self.data + len(data) - first] = data[first:]
+
+    def _copy_out(self, position, size):
+        start = position % self.capacity
+        first = min(size, self.capacity - start)
+        return (self.buffer[self.data + start:self.data + start + first] +
+                self.buffer[self.data:self.data + size - first])
+
+    def try_put(self, message):
+        counters = self.counters
+        head, tail = counters[0], counters[1]
+        if self.capacity - (head - tail) < 4 + len(message):
+            return False
+        self._copy_in(head, struct.pack("<I", len(message)) + message)
+        # Publish the message only after it has been written.
+        counters[0] = head + 4 + len(message)
+        return True
+
+    def try_get(self):
+        counters = self.counters
+        head, tail = counters[0], counters[1]
+        if head == tail:
+            return None
+        size, = struct.unpack("<I", self._copy_out(tail, 4))
+        message = self._copy_out(tail + 4, size)
+        # Release the space only after the message has been read.
+        counters[1] = tail + 4 + size
+        return message
+
+
+class MmapTransport:
+    """Transport over a pair of ring buffers in a shared memory mapped file.
+
+    The file starts with the magic bytes ``AMCOSIM1`` and the capacity of each ring (a multiple
+    of 8) as a 64-bit little-endian integer, followed by two rings: the first one carries messages
+    sent by the ``"sim"`` side, and the second one carries messages sent by the ``"peer"`` side.
+    Each ring consists of a 64-bit write counter, a 64-bit read counter, and ``capacity`` bytes
+    of data; each message is written at the write counter (modulo capacity, wrapping around)
+    prefixed with its length as a 32-bit little-endian integer, after which the write counter is
+    incremented by the size of both.
+
+    The counters are stored in the native byte order, and are aligned to 8 bytes; a peer must
+    access each of them with a single atomic 64-bit load or store. The sending side must store
+    the write counter with release semantics (after writing the message), and the receiving side
+    must load it with acquire semantics (before reading the message); likewise, the receiving
+    side must store the read counter with release semantics, and the sending side must load it
+    with acquire semantics. In C++, this corresponds to ``std::atomic<uint64_t>`` with
+    ``memory_order_release`` and ``memory_order_acquire``. Python provides no memory barriers, so
+    this implementation relies on the hardware preserving the order of its stores and loads, as
+    x86-64 does.
+
+    Neither side blocks in the kernel while waiting for the other; they poll the counters,
+    yielding the CPU between attempts, so that exchanging a message does not require any system
+    calls if the other side is ready. If the other side does not respond for ``timeout`` seconds
+    (e.g. because it has crashed), :exc:`TimeoutError` is raised; a ``timeout`` of ``None``
+    waits forever.
+    """
+    _MAGIC  = b"AMCOSIM1"
+    _HEADER = 16
+
+    def __init__(self, path, *, side, timeout=60.0):
+        if side not in ("sim", "peer"):
+            raise ValueError("Side must be one of 'sim' or 'peer', not {!r}"
+                             .format(side))
+        self.timeout = timeout
+        with open(path, "r+b") as file:
+            self.mmap = mmap.mmap(file.fileno(), 0)
+        if self.mmap[:8] != self._MAGIC:
+            self.mmap.close()
+            raise ValueError("File {!r} is not a co-simulation shared memory file"
+                             .format(path))
+        capacity, = struct.unpack_from("<Q", self.mmap, 8)
+        if (capacity % 8 != 0 or
+                len(self.mmap) < self._HEADER + 2 * (_Ring.HEADER + capacity)):
+            self.mmap.close()
+            raise ValueError("File {!r} is not a co-simulation shared memory file"
+                             .format(path))
+        rings = [_Ring(self.mmap, self._HEADER + index * (_Ring.HEADER + capacity), capacity)
+                 for index in range(2)]
+        if side == "sim":
+            self.tx, self.rx = rings
+        else:
+            self.rx, self.tx = rings
+
+    @classmethod
+    def create(cls, path, *, capacity=1 << 20, side="sim", timeout=60.0):
+        """Create (or overwrite) the file ``path``, with two rings of ``capacity`` bytes each."""
+        if not isinstance(capacity, int) or capacity <= 0 or capacity % 8 != 0:
+            raise ValueError("Capacity must be a positive multiple of 8, not {!r}"
+                             .format(capacity))
+        with open(path, "wb") as file:
+            file.write(cls._MAGIC + struct.pack("<Q", capacity))
+            file.truncate(cls._HEADER + 2 * (_Ring.HEADER + capacity))
+        return cls(path, side=side, timeout=timeout)
+
+    def _wait(self, attempt):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        spins = 0
+        while True:
+            result = attempt()
+            if result is not None and result is not False:
+                return result
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError("Co-simulation peer did not respond within {} s"
+                                   .format(self.timeout))
+            # Poll eagerly at first, since the peer usually responds quickly, and back off if
+            # it does not. Yielding the CPU lets the peer run when both share a core.
+            spins += 1
+            if spins < 1000 and hasattr(os, "sched_yield"):
+                os.sched_yield()
+            else:
+                time.sleep(1e-4)
+
+    def send(self, message):
+        if 4 + len(message) > self.tx.capacity:
+            raise ValueError("Message of {} bytes does not fit into a ring of {} bytes"
+                             .format(len(message), self.tx.capacity))
+        self._wait(lambda: self.tx.try_put(message))
+
+    def recv(self):
+        return self._wait(self.rx.try_get)
+
+    def close(self):
+        self.tx.release()
+        self.rx.release()
+        self.mmap.close()
+
+
+def _row_size(width):
+    return max(1, (width + 7) // 8)
+
+
+class CosimBridge:
+    """Process exchanging signal values with a co-simulation peer once per clock cycle.
+
+    The bridge is added to a simulation like any other process: ::
+
+        transport = SocketTransport.listen("/tmp/model.sock")
+        bridge = CosimBridge(transport, inputs=[dut.i_data], outputs=[dut.o_data], quantum=16)
+        sim = Simulator(dut)
+        sim.add_clock(1e-6)
+        sim.add_process(bridge.process)
+        sim.run()
+
+    See the documentation of the :mod:`amaranth.sim.cosim` module for the protocol.
+
+    Arguments
+    ---------
+    transport : SocketTransport or MmapTransport
+        Transport connected to the peer.
+    inputs : iterable of Signal
+        Signals driven by the peer.
+    outputs : iterable of Signal
+        Signals sampled for the peer.
+    quantum : int
+        Number of cycles per batch; ``1`` runs the simulation in lock-step with the peer.
+    domain : str or ClockDomain
+        Domain whose clock determines the cycles.
+    """
+    def __init__(self, transport, *, inputs=(), outputs=(), quantum=1, domain="sync"):
+        if not isinstance(quantum, int):
+            raise TypeError("Quantum must be an integer, not {!r}"
+                            .format(quantum))
+        if quantum < 1:
+            raise ValueError("Quantum must be a positive integer, not {!r}"
+                             .format(quantum))
+        self.transport = transport
+        self.inputs    = list(inputs)
+        self.outputs   = list(outputs)
+        self.quantum   = quantum
+        self.domain    = domain
+
+    def _hello(self):
+        def describe(signals):
+            return [[signal.name, len(signal), signal.shape().signed] for signal in signals]
+        return _HELLO + json.dumps({
+            "quantum": self.quantum,
+            "inputs":  describe(self.inputs),
+            "outputs": describe(self.outputs),
+        }).encode("utf-8")
+
+    def process(self):
+        in_value,  out_value = Cat(*self.inputs), Cat(*self.outputs)
+        in_size,   out_size  = _row_size(len(in_value)), _row_size(len(out_value))
+
+        def recv_batch():
+            batch = self.transport.recv()
+            if len(batch) % in_size != 0 or len(batch) > in_size * self.quantum:
+                raise ValueError("Co-simulation peer sent a batch of {} bytes, which is not "
+                                 "a whole number of rows of {} bytes, up to {} rows"
+                                 .format(len(batch), in_size, self.quantum))
+            return [int.from_bytes(batch[offset:offset + in_size], "little")
+                    for offset in range(0, len(batch), in_size)]
+
+        self.transport.send(self._hello())
+        rows = recv_batch()
+        while True:
+            samples = bytearray()
+            for row in rows:
+                if self.inputs:
+                    yield in_value.eq(row)
+                yield Tick(self.domain)
+                sample = yield out_value
+                samples += sample.to_bytes(out_size, "little")
+            if len(rows) < self.quantum:
+                # The peer has finished.
+                return
+            self.transport.send(bytes(samples))
+            rows = recv_batch()
+
+
+class CosimPeer:
+    """Pure-Python co-simulation peer.
+
+    Calls ``model`` once per cycle to compute the values of the inputs of the design. The first
+    ``quantum`` calls receive ``None``, and every further call receives a tuple of the values of
+    the outputs sampled ``quantum`` cycles earlier (see the documentation of
+    the :mod:`amaranth.sim.cosim` module). ``model`` returns a sequence of the values of
+    the inputs, or ``None`` to finish the simulation.
+
+    Attributes
+    ----------
+    quantum : int
+    inputs : list of (str, int, bool)
+        Name, width and signedness of each input, as sent by the bridge.
+    outputs : list of (str, int, bool)
+        Name, width and signedness of each output, as sent by the bridge.
+    """
+    def __init__(self, transport, model):
+        self.transport = transport
+        self.model     = model
+        self.quantum   = None
+        self.inputs    = None
+        self.outputs   = None
+
+    @staticmethod
+    def _layout(signals):
+        offsets = []
+        offset = 0
+        for name, width, signed in signals:
+            offsets.append((offset, width, signed))
+            offset += width
+        return offsets, _row_size(offset)
+
+    def _encode(self, values):
+        row = 0
+        for (offset, width, signed), value in zip(self._in_layout, values):
+            row |= (value & ((1 << width) - 1)) << offset
+        return row.to_bytes(self._in_size, "little")
+
+    def _decode(self, row):
+        row = int.from_bytes(row, "little")
+        values = []
+        for offset, width, signed in self._out_layout:
+            value = (row >> offset) & ((1 << width) - 1)
+            if signed and value >> (width - 1):
+                value -= 1 << width
+            values.append(value)
+        return tuple(values)
+
+    def _batch(self, samples):
+        batch = bytearray()
+        for sample in samples:
+            values = self.model(sample)
+            if values is None:
+                return bytes(batch), False
+            batch += self._encode(values)
+        return bytes(batch), True
+
+    def run(self):
+        """Serve the bridge until ``model`` returns ``None``, or the bridge disconnects."""
+        hello = self.transport.recv()
+        if not hello.startswith(_HELLO):
+            raise ValueError("Co-simulation bridge sent an unrecognized hello message {!r}"
+                             .format(hello[:len(_HELLO)]))
+        description = json.loads(hello[len(_HELLO):].decode("utf-8"))
+        self.quantum = description["quantum"]
+        self.inputs  = [tuple(signal) for signal in description["inputs"]]
+        self.outputs = [tuple(signal) for signal in description["outputs"]]
+        self._in_layout,  self._in_size  = self._layout(self.inputs)
+        self._out_layout, self._out_size = self._layout(self.outputs)
+
+        batch, running = self._batch([None] * self.quantum)
+        self.transport.send(batch)
+        while running:
+            try:
+                samples = self.transport.recv()
+            except EOFError:
+                return
+            samples = [self._decode(samples[offset:offset + self._out_size])
+                       for offset in range(0, len(samples), self._out_size)]
+            batch, running = self._batch(samples)
+            self.transport.send(batch)
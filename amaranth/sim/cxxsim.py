@@ -0,0 +1,291 @@
+import os.path
+import ctypes
+import weakref
+
+from ..hdl import *
+from ..hdl.ast import SignalDict
+from .._toolchain.yosys import find_yosys
+from .._toolchain.cxx import build_cxx
+from ..back import rtlil
+from ._pyrtl import _CommandCompiler
+from .pysim import _PySimulation, PySimEngine
+
+
+__all__ = ["CxxrtlSimEngine"]
+
+
+# Keep in sync with `backends/cxxrtl/cxxrtl_capi.h`.
+_CXXRTL_MEMORY  = 2
+_CXXRTL_OUTLINE = 4
+
+_CXXRTL_INPUT       = 1 << 0
+_CXXRTL_DRIVEN_SYNC = 1 << 2
+
+
+class _cxxrtl_object(ctypes.Structure):
+    _fields_ = [
+        ("type",    ctypes.c_uint32),
+        ("flags",   ctypes.c_uint32),
+        ("width",   ctypes.c_size_t),
+        ("lsb_at",  ctypes.c_size_t),
+        ("depth",   ctypes.c_size_t),
+        ("zero_at", ctypes.c_size_t),
+        ("curr",    ctypes.POINTER(ctypes.c_uint32)),
+        ("next",    ctypes.POINTER(ctypes.c_uint32)),
+        ("outline", ctypes.c_void_p),
+    ]
+
+
+class _CxxrtlLibrary:
+    def __init__(self, filename):
+        self._library = library = ctypes.cdll.LoadLibrary(filename)
+
+        library.cxxrtl_design_create.argtypes = []
+        library.cxxrtl_design_create.restype  = ctypes.c_void_p
+        library.cxxrtl_create.argtypes = [ctypes.c_void_p]
+        library.cxxrtl_create.restype  = ctypes.c_void_p
+        library.cxxrtl_destroy.argtypes = [ctypes.c_void_p]
+        library.cxxrtl_destroy.restype  = None
+        library.cxxrtl_reset.argtypes = [ctypes.c_void_p]
+        library.cxxrtl_reset.restype  = None
+        library.cxxrtl_step.argtypes = [ctypes.c_void_p]
+        library.cxxrtl_step.restype  = ctypes.c_size_t
+        library.cxxrtl_get_parts.argtypes = [ctypes.c_void_p, ctypes.c_char_p,
+                                             ctypes.POINTER(ctypes.c_size_t)]
+        library.cxxrtl_get_parts.restype  = ctypes.POINTER(_cxxrtl_object)
+        library.cxxrtl_outline_eval.argtypes = [ctypes.c_void_p]
+        library.cxxrtl_outline_eval.restype  = None
+
+        self.create        = library.cxxrtl_create
+        self.design_create = library.cxxrtl_design_create
+        self.destroy       = library.cxxrtl_destroy
+        self.reset         = library.cxxrtl_reset
+        self.step          = library.cxxrtl_step
+        self.get_parts     = library.cxxrtl_get_parts
+        self.outline_eval  = library.cxxrtl_outline_eval
+
+
+class _CxxrtlObject:
+    """A signal (or a single word of a memory) in a CXXRTL design."""
+    def __init__(self, library, parts, count, *, address=None):
+        self.library = library
+        self.parts   = [parts[index] for index in range(count)]
+        self.address = address
+
+    @property
+    def flags(self):
+        flags = 0
+        for part in self.parts:
+            flags |= part.flags
+        return flags
+
+    def _offset(self, part):
+        if self.address is None:
+            return 0
+        else:
+            return (self.address - part.zero_at) * ((part.width + 31) // 32)
+
+    def get(self):
+        value = 0
+        for part in self.parts:
+            if part.type == _CXXRTL_OUTLINE:
+                self.library.outline_eval(part.outline)
+            offset = self._offset(part)
+            for chunk in range((part.width + 31) // 32):
+                value |= part.curr[offset + chunk] << (part.lsb_at + chunk * 32)
+        return value
+
+    def set(self, value):
+        for part in self.parts:
+            # Wires are updated through their next state, and committed by the design; values
+            # and memories are updated in place.
+            storage = part.next if part.next else part.curr
+            offset = self._offset(part)
+            part_value = (value >> part.lsb_at) & ((1 << part.width) - 1)
+            for chunk in range((part.width + 31) // 32):
+                storage[offset + chunk] = (part_value >> (chunk * 32)) & 0xffffffff
+
+
+class _CxxrtlSimulation(_PySimulation):
+    """Simulation state backed by a CXXRTL design.
+
+    Every signal used by a testbench or clock process is assigned a slot, just as it is in
+    :class:`_PySimulation`. Slots of signals that are present in the design are kept in sync with
+    it: pending changes are written to the design before it is stepped, and changes made by
+    the design are read back afterwards. Signals that are not present in the design (e.g. ones
+    that are only used by the testbench) behave exactly like they do in :class:`_PySimulation`.
+    """
+    def __init__(self, fragment):
+        super().__init__()
+
+        rtlil_text, name_map = rtlil.convert_fragment(fragment)
+        yosys = find_yosys(lambda ver: ver >= (0, 10))
+        # Public wires are not inlined, so that every signal observed by a testbench is stored in
+        # the design, rather than recomputed by an outline on every access.
+        cxx_source = yosys.run(["-q", "-"], "\n".join([
+            "read_ilang <<rtlil\n{}\nrtlil".format(rtlil_text),
+            "write_cxxrtl -O4",
+        ]))
+        include_dir = yosys.data_dir() / "include"
+        self._build_dir, so_filename = build_cxx(
+            cxx_sources={
+                "sim_top.cc": cxx_source,
+                # The C API implementation does not depend on the design, and is compiled as
+                # a separate translation unit, in parallel with the design.
+                "sim_capi.cc": "#include <backends/cxxrtl/cxxrtl_capi.cc>\n",
+            },
+            output_name="sim_top",
+            # Yosys 0.10 generates `#include <backends/cxxrtl/cxxrtl.h>`, later versions generate
+            # `#include <cxxrtl/cxxrtl.h>`.
+            include_dirs=[str(include_dir), str(include_dir / "backends" / "cxxrtl" / "runtime")],
+            macros=[],
+        )
+        self._library = _CxxrtlLibrary(os.path.join(self._build_dir.name, so_filename))
+        self._handle  = None
+        # The native state is released once this object is garbage collected (or at exit), unless
+        # `close()` releases it earlier. Finalizers run in the reverse order of registration, so
+        # the design is destroyed before the build directory is removed.
+        self._cleanup = weakref.finalize(self, self._build_dir.cleanup)
+        self._destroy = None
+
+        # CXXRTL names are hierarchical names of signals without the toplevel, separated with
+        # spaces.
+        self._names = SignalDict()
+        for signal, (toplevel, *name) in name_map.items():
+            self._names[signal] = (" ".join(name), None)
+        # Memories are emitted by the RTLIL backend into the same module as the signals connected
+        # to their ports.
+        for memory, port_signal in self._find_memories(fragment):
+            if port_signal in name_map:
+                toplevel, *hierarchy, _ = name_map[port_signal]
+                for address, word in enumerate(memory._array):
+                    self._names[word] = (" ".join((*hierarchy, memory.name)), address)
+
+        self.objects = []
+        self.design  = dict()
+        self.stale   = False
+        self._create_design()
+
+    def _find_memories(self, fragment):
+        if isinstance(fragment, Instance) and fragment.type in ("$memrd", "$memwr"):
+            port_signal, _ = fragment.named_ports["ADDR"]
+            if isinstance(port_signal, Signal):
+                yield fragment.parameters["MEMID"], port_signal
+        for subfragment, subfragment_name in fragment.subfragments:
+            yield from self._find_memories(subfragment)
+
+    def _get_object(self, signal):
+        if signal not in self._names:
+            return None
+        name, address = self._names[signal]
+        count = ctypes.c_size_t()
+        parts = self._library.get_parts(self._handle, name.encode("utf-8"), ctypes.byref(count))
+        if not parts:
+            return None
+        if address is not None and parts[0].type != _CXXRTL_MEMORY:
+            return None
+        return _CxxrtlObject(self._library, parts, count.value, address=address)
+
+    def close(self):
+        if self._destroy is not None:
+            self._destroy()
+            self._handle = None
+        self._cleanup()
+
+    def _create_design(self):
+        # `cxxrtl_reset` reallocates the storage of memories, which invalidates the pointers
+        # to it that were previously returned by `cxxrtl_get_parts`; the design is recreated
+        # instead.
+        if self._destroy is not None:
+            self._destroy()
+        self._handle = self._library.create(self._library.design_create())
+        self._destroy = weakref.finalize(self, self._library.destroy, self._handle)
+
+        # CXXRTL initializes inputs to zero, and does not know the reset values of some storage
+        # elements (such as read ports of memories), so the reset values of these signals are
+        # written to the design explicitly.
+        for signal, (name, address) in self._names.items():
+            if address is not None:
+                continue
+            object = self._get_object(signal)
+            if object is not None and object.flags & (_CXXRTL_INPUT | _CXXRTL_DRIVEN_SYNC):
+                object.set(signal.reset)
+        self._library.step(self._handle)
+
+        self.objects = [self._get_object(signal) for signal in self.slots]
+
+    def reset(self):
+        super().reset()
+        self._create_design()
+        self.design.clear()
+        # Slots have been reset to the reset values of their signals, and have to be updated
+        # with the values of the combinational logic computed by the design.
+        self.stale = True
+
+    def get_signal(self, signal):
+        try:
+            return self.signals[signal]
+        except KeyError:
+            index = super().get_signal(signal)
+            object = self._get_object(signal)
+            self.objects.append(object)
+            if object is not None:
+                self.curr[index] = self.next[index] = object.get()
+            return index
+
+    def commit(self, changed=None):
+        curr, next, objects = self.curr, self.next, self.objects
+
+        # The design is treated like any other process: it observes the values committed during
+        # the previous delta cycle, and its changes are committed during this one, together with
+        # the changes made by the processes that ran concurrently with it.
+        if self.stale:
+            # A CXXRTL step stops once the combinational logic converges, even if the commit of
+            # a clock edge has changed the state it depends on (e.g. the contents of a memory with
+            # an asynchronous read port). Step once more to re-evaluate it.
+            self._library.step(self._handle)
+            self._library.step(self._handle)
+            self.stale = False
+            for index, object in enumerate(objects):
+                if object is not None:
+                    value = object.get()
+                    if value != curr[index]:
+                        next[index] = self.design[index] = value
+                        self.pending.add(index)
+
+        # Write every other signal change to the design. It will be stepped during the next
+        # delta cycle.
+        for index in self.pending:
+            if objects[index] is not None and next[index] != self.design.get(index, curr[index]):
+                objects[index].set(next[index])
+                self.stale = True
+        self.design.clear()
+
+        converged = super().commit(changed)
+        return converged and not self.stale
+
+
+class CxxrtlSimEngine(PySimEngine):
+    """Simulation engine backed by CXXRTL.
+
+    The design is converted to C++ using the CXXRTL backend of Yosys, compiled to a shared
+    library, and simulated using the CXXRTL C API. Testbench and clock processes are run
+    exactly as they are by :class:`PySimEngine`.
+    """
+    def __init__(self, fragment):
+        # The design is not compiled to Python processes, so `PySimEngine.__init__` is not used.
+        self._state = _CxxrtlSimulation(fragment)
+        self._timeline = self._state.timeline
+
+        self._fragment = fragment
+        self._processes = set()
+        self._commands = _CommandCompiler(self._state)
+        self._trace_sinks = []
+        self._profiler = None
+        self._stepping = False
+
+    def checkpoint(self):
+        raise TypeError("Checkpoints are not supported by the CXXRTL simulation engine")
+
+    def fork(self):
+        raise TypeError("Forking is not supported by the CXXRTL simulation engine")
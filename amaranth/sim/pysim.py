@@ -1,27 +1,83 @@
 from contextlib import contextmanager
+import os
 import itertools
+import heapq
 import re
+import array
+import fnmatch
+import collections
+import asyncio
+import time
+import json
+import multiprocessing
 from vcd import VCDWriter
 from vcd.gtkw import GTKWSave
 
 from ..hdl import *
-from ..hdl.ast import SignalDict
+from ..hdl.ast import SignalDict, SignalSet
 from ._base import *
-from ._pyrtl import _FragmentCompiler
+from ._pyrtl import _FragmentCompiler, _CommandCompiler, _CodeCache, PyRTLProcess
 from ._pycoro import PyCoroProcess
 from ._pyclock import PyClockProcess
 
 
-__all__ = ["PySimEngine"]
+__all__ = ["PySimEngine", "PyLevelizedSimEngine", "PyCycleSimEngine"]
 
 
 class _NameExtractor:
-    def __init__(self):
+    """Extracts hierarchical names of signals in a fragment.
+
+    If ``include`` is not ``None``, only names that match one of the glob patterns in it (e.g.
+    ``top.cpu.*``) are extracted; names that match one of the glob patterns in ``exclude`` are
+    not. If ``depth`` is not ``None``, only names in fragments at most ``depth`` levels below
+    the toplevel one are extracted. Subfragments that cannot contain any matching names are not
+    visited at all.
+    """
+    def __init__(self, *, include=None, exclude=(), depth=None):
         self.names = SignalDict()
+        self.include = None if include is None else list(include)
+        self.exclude = list(exclude)
+        self.depth = depth
+
+    @staticmethod
+    def _pattern_prefix(pattern):
+        return re.split(r"[*?\[]", pattern, maxsplit=1)[0]
+
+    def _may_match(self, hierarchy):
+        # Conservatively determines whether any name below `hierarchy` could be extracted.
+        if self.depth is not None and len(hierarchy) - 1 > self.depth:
+            return False
+        scope = ".".join(hierarchy) + "."
+        for pattern in self.exclude:
+            # If the scope itself matches a pattern that ends with a wildcard, then so does any
+            # name in it.
+            if pattern.endswith("*") and fnmatch.fnmatchcase(scope, pattern):
+                return False
+        if self.include is None:
+            return True
+        for pattern in self.include:
+            prefix = self._pattern_prefix(pattern)
+            if scope.startswith(prefix) or prefix.startswith(scope):
+                return True
+        return False
+
+    def _matches(self, name):
+        name = ".".join(name)
+        if any(fnmatch.fnmatchcase(name, pattern) for pattern in self.exclude):
+            return False
+        if self.include is None:
+            return True
+        return any(fnmatch.fnmatchcase(name, pattern) for pattern in self.include)
 
     def __call__(self, fragment, *, hierarchy=("top",)):
+        if not self._may_match(hierarchy):
+            return self.names
+
+        filtered = self.include is not None or bool(self.exclude)
         def add_signal_name(signal):
             hierarchical_signal_name = (*hierarchy, signal.name)
+            if filtered and not self._matches(hierarchical_signal_name):
+                return
             if signal not in self.names:
                 self.names[signal] = {hierarchical_signal_name}
             else:
@@ -34,9 +90,16 @@ class _NameExtractor:
                 if domain.rst is not None:
                     add_signal_name(domain.rst)
 
+        # Memory words are only traced if requested explicitly, since there could be very many
+        # of them.
+        memory_words = SignalSet()
+        if isinstance(fragment, Instance) and fragment.type in ("$memrd", "$memwr"):
+            memory_words.update(fragment.parameters["MEMID"]._array)
+
         for statement in fragment.statements:
             for signal in statement._lhs_signals() | statement._rhs_signals():
-                if not isinstance(signal, (ClockSignal, ResetSignal)):
+                if not isinstance(signal, (ClockSignal, ResetSignal)) and \
+                        signal not in memory_words:
                     add_signal_name(signal)
 
         for subfragment_index, (subfragment, subfragment_name) in enumerate(fragment.subfragments):
@@ -47,6 +110,140 @@ class _NameExtractor:
         return self.names
 
 
+def _write_vcd_process(connection, vcd_filename):
+    # Runs in the process started by `_VCDWriterProcess`, executing the commands it sends. Once
+    # the file is opened, and once it is closed, `None` is sent back; if anything fails, the error
+    # is sent back instead, and the process exits.
+    try:
+        with open(vcd_filename, "wt", buffering=1 << 20) as vcd_file:
+            connection.send(None)
+            vcd_writer = None
+            vcd_vars   = []
+            slot_vars  = {}
+            running = True
+            while running:
+                for command, *args in connection.recv():
+                    if command == "write":
+                        change = vcd_writer.change
+                        for timestamp, changes in args[0]:
+                            vcd_timestamp = _VCDWriter.timestamp_to_vcd(timestamp)
+                            for slot, value in changes:
+                                change(slot_vars[slot], vcd_timestamp, value)
+                    elif command == "open":
+                        vcd_writer = VCDWriter(vcd_file, **args[0])
+                    elif command == "var":
+                        scope, name, var_type, size, init = args
+                        vcd_vars.append(vcd_writer.register_var(
+                            scope=scope, name=name, var_type=var_type, size=size, init=init))
+                    elif command == "alias":
+                        scope, name, var = args
+                        vcd_writer.register_alias(scope=scope, name=name, var=vcd_vars[var])
+                    elif command == "slots":
+                        slot_vars = {slot: vcd_vars[var] for slot, var in args[0].items()}
+                    elif command == "close":
+                        if vcd_writer is not None:
+                            vcd_writer.close(_VCDWriter.timestamp_to_vcd(args[0]))
+                        running = False
+                    else:
+                        assert False # :nocov:
+    except Exception as error:
+        try:
+            connection.send(error)
+        except Exception:
+            # The exception could not be pickled.
+            connection.send(RuntimeError("Writing VCD file failed: {!r}".format(error)))
+    else:
+        connection.send(None)
+
+
+class _VCDWriterProcess:
+    """Writer of a VCD file in a separate process.
+
+    Implements the subset of the interface of :class:`vcd.VCDWriter` used by :class:`_VCDWriter`,
+    with :meth:`open` instead of the constructor. Variables are checked for duplicate names when
+    they are registered, exactly like :class:`vcd.VCDWriter` does, and the commands to register
+    them and to record changes are sent to the writer process in batches, which formats and writes
+    the file. Changes are identified by signal slot rather than by variable (see :meth:`map_slots`)
+    and by simulation time rather than by VCD timestamp. An error raised by the writer process is
+    re-raised by the next method that sends it commands.
+    """
+    # Changes are sent to the writer process once this many timesteps have been recorded.
+    BATCH_SIZE = 256
+
+    def __init__(self, vcd_filename):
+        self._commands    = []
+        self._scope_names = {}
+        self._var_count   = 0
+        self._connection, connection = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_write_vcd_process,
+                                                args=(connection, vcd_filename), daemon=True)
+        self._process.start()
+        connection.close()
+        # Wait until the file is opened, so that e.g. a nonexistent directory is reported here.
+        self._receive()
+
+    def _receive(self):
+        try:
+            error = self._connection.recv()
+        except EOFError:
+            error = RuntimeError("VCD writer process has exited unexpectedly")
+        if error is not None:
+            process, self._process = self._process, None
+            self._connection.close()
+            process.join()
+            raise error
+
+    def _flush(self):
+        commands, self._commands = self._commands, []
+        if self._process is None:
+            return
+        try:
+            self._connection.send(commands)
+        except OSError:
+            # The writer process has exited, most likely after sending an error.
+            self._receive()
+            raise
+
+    def open(self, **kwargs):
+        self._commands.append(("open", kwargs))
+
+    def _check_name(self, scope, name):
+        scope_names = self._scope_names.setdefault(tuple(scope), set())
+        if name in scope_names:
+            raise KeyError("Duplicate var {} in scope {}".format(name, ".".join(scope)))
+        scope_names.add(name)
+
+    def register_var(self, scope, name, var_type, size, init):
+        self._check_name(scope, name)
+        self._commands.append(("var", tuple(scope), name, var_type, size, init))
+        self._var_count += 1
+        return self._var_count - 1
+
+    def register_alias(self, scope, name, var):
+        self._check_name(scope, name)
+        self._commands.append(("alias", tuple(scope), name, var))
+
+    def map_slots(self, slot_vars):
+        """Identify the variables by the slots of signals in ``slot_vars``."""
+        self._commands.append(("slots", slot_vars))
+
+    def write(self, batch):
+        """Record the ``(timestamp, [(slot, value), ...])`` changes in ``batch``."""
+        self._commands.append(("write", batch))
+        if len(self._commands) >= self.BATCH_SIZE:
+            self._flush()
+
+    def close(self, timestamp=None):
+        if self._process is None:
+            return
+        self._commands.append(("close", timestamp))
+        self._flush()
+        self._receive()
+        self._connection.close()
+        self._process.join()
+        self._process = None
+
+
 class _VCDWriter:
     @staticmethod
     def timestamp_to_vcd(timestamp):
@@ -56,16 +253,23 @@ class _VCDWriter:
     def decode_to_vcd(signal, value):
         return signal.decoder(value).expandtabs().replace(" ", "_")
 
-    def __init__(self, fragment, *, vcd_file, gtkw_file=None, traces=()):
-        if isinstance(vcd_file, str):
-            vcd_file = open(vcd_file, "wt")
+    def __init__(self, state, fragment, *, vcd_file, gtkw_file=None, traces=(),
+                 include=None, exclude=(), depth=None, sample_domain=None, history=None,
+                 trigger=None, background=False):
+        # In background mode, `vcd_file` is a filename, and the file is written by another
+        # process; only the changes are recorded by this one.
+        self.vcd_process = None
+        if background:
+            self.vcd_process = _VCDWriterProcess(vcd_file)
+        elif isinstance(vcd_file, str):
+            # Changes are written one line at a time; buffer them in larger chunks.
+            vcd_file = open(vcd_file, "wt", buffering=1 << 20)
         if isinstance(gtkw_file, str):
             gtkw_file = open(gtkw_file, "wt")
 
         self.vcd_vars = SignalDict()
         self.vcd_file = vcd_file
-        self.vcd_writer = vcd_file and VCDWriter(self.vcd_file,
-            timescale="100 ps", comment="Generated by Amaranth")
+        self.vcd_writer = None
 
         self.gtkw_names = SignalDict()
         self.gtkw_file = gtkw_file
@@ -73,32 +277,89 @@ class _VCDWriter:
 
         self.traces = []
 
-        signal_names = _NameExtractor()(fragment)
-
+        # Indexed by signal slot; `(vcd_var, None)` for signals without a decoder, and
+        # `(vcd_var, decoded)` for signals with one, where `decoded` caches the strings their
+        # decoder returned for each value. Changes of signals that are not traced are filtered
+        # out using `traced_slots` before they reach the writer.
+        self.slots = state.slots
+        self.slot_vars = dict()
+        self.traced_slots = set()
+
+        # In sampling mode, traced slots that changed since the previous sample are accumulated
+        # in `dirty`, and are written out on the next active edge of the clock, if their value is
+        # different from the previously sampled one. The initial state is also sampled.
+        self.sample_slot = None
+        if sample_domain is not None:
+            self.sample_slot  = state.get_signal(sample_domain.clk)
+            self.sample_value = 1 if sample_domain.clk_edge == "pos" else 0
+            self.sample_first = True
+            self.sampled = dict()
+            self.dirty   = set()
+
+        # In flight recorder mode, the changes made during the last `history` timesteps (or
+        # samples) are kept in a ring buffer, and only written out once `dump()` is called.
+        # The values of traced slots as of the last change that fell out of the ring buffer
+        # are kept in `history_base`.
+        self.history = None
+        if history is not None:
+            self.history = collections.deque()
+            self.history_depth   = history
+            self.history_base    = dict()
+            self.history_base_at = 0.0
+        # A tuple `(run, args)` of a compiled command; `dump()` is called once it is true.
+        self.trigger = trigger
+
+        signal_names = _NameExtractor(include=include, exclude=exclude, depth=depth)(fragment)
+
+        # Signals listed in `traces` are always included, even if they are filtered out.
         trace_names = SignalDict()
         for trace in traces:
             if trace not in signal_names:
                 trace_names[trace] = {("top", trace.name)}
             self.traces.append(trace)
 
-        if self.vcd_writer is None:
+        if self.vcd_file is None:
             return
 
+        self.signal_names = []
         for signal, names in itertools.chain(signal_names.items(), trace_names.items()):
+            for (*var_scope, var_name) in names:
+                if re.search(r"[ \t\r\n]", var_name):
+                    raise NameError("Signal '{}.{}' contains a whitespace character"
+                                    .format(".".join(var_scope), var_name))
+
+            slot = state.get_signal(signal)
+            self.signal_names.append((signal, slot, names))
+            self.traced_slots.add(slot)
+            if self.sample_slot is not None:
+                self.sampled[slot] = signal.reset
+            if self.history is not None:
+                self.history_base[slot] = signal.reset
+
+        if self.history is None:
+            self._open(timestamp=0.0)
+
+    def _open(self, *, timestamp, values=None):
+        vcd_options = dict(timescale="100 ps", comment="Generated by Amaranth",
+                           init_timestamp=self.timestamp_to_vcd(timestamp))
+        if self.vcd_process is not None:
+            self.vcd_writer = self.vcd_process
+            self.vcd_writer.open(**vcd_options)
+        else:
+            self.vcd_writer = VCDWriter(self.vcd_file, **vcd_options)
+
+        for signal, slot, names in self.signal_names:
+            value = signal.reset if values is None else values[slot]
             if signal.decoder:
                 var_type = "string"
                 var_size = 1
-                var_init = self.decode_to_vcd(signal, signal.reset)
+                var_init = self.decode_to_vcd(signal, value)
             else:
                 var_type = "wire"
                 var_size = signal.width
-                var_init = signal.reset
+                var_init = value
 
             for (*var_scope, var_name) in names:
-                if re.search(r"[ \t\r\n]", var_name):
-                    raise NameError("Signal '{}.{}' contains a whitespace character"
-                                    .format(".".join(var_scope), var_name))
-
                 suffix = None
                 while True:
                     try:
@@ -122,25 +383,110 @@ class _VCDWriter:
                 if signal not in self.gtkw_names:
                     self.gtkw_names[signal] = (*var_scope, var_name_suffix)
 
-    def update(self, timestamp, signal, value):
-        vcd_var = self.vcd_vars.get(signal)
-        if vcd_var is None:
-            return
+            self.slot_vars[slot] = (self.vcd_vars[signal], dict() if signal.decoder else None)
+
+        if self.vcd_process is not None:
+            self.vcd_process.map_slots({slot: vcd_var
+                                        for slot, (vcd_var, decoded) in self.slot_vars.items()})
+            # Decoders are called by this process, since they cannot always be sent to another one.
+            self.decoded_slots = {slot: decoded
+                                  for slot, (vcd_var, decoded) in self.slot_vars.items()
+                                  if decoded is not None}
 
-        vcd_timestamp = self.timestamp_to_vcd(timestamp)
-        if signal.decoder:
-            var_value = self.decode_to_vcd(signal, value)
+    def update(self, timestamp, changed, curr):
+        """Record the changes made while settling the design.
+
+        ``changed`` is the set of slots whose values have changed, and ``curr`` are the values of
+        all slots.
+        """
+        if self.sample_slot is None:
+            changes = [(slot, curr[slot]) for slot in changed & self.traced_slots]
+        else:
+            self.dirty.update(changed & self.traced_slots)
+            changes = []
+            if self.sample_first or (self.sample_slot in changed and
+                                     curr[self.sample_slot] == self.sample_value):
+                self.sample_first = False
+                sampled = self.sampled
+                for slot in self.dirty:
+                    value = curr[slot]
+                    if sampled[slot] != value:
+                        sampled[slot] = value
+                        changes.append((slot, value))
+                self.dirty.clear()
+
+        if not changes:
+            pass
+        elif self.history is not None:
+            if len(self.history) == self.history_depth:
+                self.history_base_at, evicted = self.history.popleft()
+                self.history_base.update(evicted)
+            self.history.append((timestamp, changes))
         else:
-            var_value = value
-        self.vcd_writer.change(vcd_var, vcd_timestamp, var_value)
+            self._write(((timestamp, changes),))
+
+        if self.trigger is not None:
+            run, args = self.trigger
+            if run(*args):
+                self.trigger = None
+                self.dump()
+
+    def dump(self):
+        """Write out the history recorded in flight recorder mode.
+
+        Changes made afterwards are written out as they happen. Does nothing if not in flight
+        recorder mode, or if the history has already been written out.
+        """
+        if self.history is None or self.vcd_file is None:
+            return
+        history, self.history = self.history, None
+        self._open(timestamp=self.history_base_at, values=self.history_base)
+        self._write(history)
+
+    def _write(self, batch):
+        if self.vcd_process is not None:
+            if self.decoded_slots:
+                batch = [(timestamp, [(slot, self._decode(slot, value))
+                                      if slot in self.decoded_slots else (slot, value)
+                                      for slot, value in changes])
+                         for timestamp, changes in batch]
+            self.vcd_process.write(batch)
+            return
+
+        slot_vars = self.slot_vars
+        change = self.vcd_writer.change
+        for timestamp, changes in batch:
+            vcd_timestamp = self.timestamp_to_vcd(timestamp)
+            for slot, value in changes:
+                vcd_var, decoded = slot_vars[slot]
+                if decoded is not None:
+                    try:
+                        value = decoded[value]
+                    except KeyError:
+                        value = decoded[value] = self.decode_to_vcd(self.slots[slot], value)
+                change(vcd_var, vcd_timestamp, value)
+
+    def _decode(self, slot, value):
+        decoded = self.decoded_slots[slot]
+        try:
+            return decoded[value]
+        except KeyError:
+            decoded[value] = self.decode_to_vcd(self.slots[slot], value)
+            return decoded[value]
 
     def close(self, timestamp):
-        if self.vcd_writer is not None:
+        if self.vcd_process is not None:
+            self.vcd_process.close(timestamp)
+        elif self.vcd_writer is not None:
             self.vcd_writer.close(self.timestamp_to_vcd(timestamp))
 
-        if self.gtkw_save is not None:
-            self.gtkw_save.dumpfile(self.vcd_file.name)
-            self.gtkw_save.dumpfile_size(self.vcd_file.tell())
+        if self.gtkw_save is not None and self.vcd_writer is not None:
+            if self.vcd_process is not None:
+                self.gtkw_save.dumpfile(self.vcd_file)
+                self.gtkw_save.dumpfile_size(os.path.getsize(self.vcd_file))
+            else:
+                self.gtkw_save.dumpfile(self.vcd_file.name)
+                self.gtkw_save.dumpfile_size(self.vcd_file.tell())
 
             self.gtkw_save.treeopen("top")
             for signal in self.traces:
@@ -150,24 +496,287 @@ class _VCDWriter:
                     suffix = ""
                 self.gtkw_save.trace(".".join(self.gtkw_names[signal]) + suffix)
 
-        if self.vcd_file is not None:
+        if self.vcd_file is not None and self.vcd_process is None:
             self.vcd_file.close()
         if self.gtkw_file is not None:
             self.gtkw_file.close()
 
 
+class _TraceRecorder:
+    """In-memory trace of the changes of selected signals.
+
+    Changes are recorded into growable typed arrays, one pair of arrays per signal: timestamps
+    (in picoseconds) as 64-bit integers, and values as 64-bit integers, or as Python integers for
+    signals wider than 64 bits. The value of each signal at the start of the recording is
+    recorded as well.
+    """
+    @staticmethod
+    def timestamp_to_trace(timestamp):
+        return round(timestamp * (10 ** 12)) # 1/(1 ps)
+
+    def __init__(self, state, traces, *, timestamp):
+        self.columns = SignalDict()
+        self.slot_columns = dict()
+        for signal in traces:
+            if signal in self.columns:
+                continue
+            if len(signal) > 64:
+                values = []
+            elif signal.shape().signed:
+                values = array.array("q")
+            else:
+                values = array.array("Q")
+            if signal.shape().signed and len(signal) > 0:
+                sign_bit = 1 << (len(signal) - 1)
+            else:
+                sign_bit = None
+            column = (array.array("q"), values, sign_bit)
+            self.columns[signal] = column
+            self.slot_columns[state.get_signal(signal)] = column
+        self.traced_slots = set(self.slot_columns)
+
+        self.update(timestamp, self.traced_slots, state.curr)
+
+    def update(self, timestamp, changed, curr):
+        timestamp = self.timestamp_to_trace(timestamp)
+        slot_columns = self.slot_columns
+        for slot in changed & self.traced_slots:
+            timestamps, values, sign_bit = slot_columns[slot]
+            value = curr[slot]
+            if sign_bit is not None and value >= sign_bit:
+                # Not every engine stores the values of signed signals as negative integers.
+                value -= sign_bit << 1
+            timestamps.append(timestamp)
+            values.append(value)
+
+    def numpy(self, signal):
+        """Recorded changes of ``signal``, as a tuple of NumPy arrays.
+
+        Returns a tuple ``(timestamps, values)``, where ``timestamps`` is an array of ``int64``
+        timestamps in picoseconds, and ``values`` is an array of ``int64`` or ``uint64`` values,
+        or an array of Python integers if ``signal`` is wider than 64 bits. The arrays are copies,
+        and are not updated with further changes.
+        """
+        import numpy
+        timestamps, values, sign_bit = self.columns[signal]
+        if isinstance(values, list):
+            return numpy.array(timestamps, dtype=numpy.int64), numpy.array(values, dtype=object)
+        return numpy.array(timestamps), numpy.array(values)
+
+    def values_at(self, signal, times):
+        """Values of ``signal`` at each of ``times`` (in seconds), as a NumPy array.
+
+        ``times`` may be any sequence of numbers, including a NumPy array. The values are returned
+        with the same ``dtype`` as by :meth:`numpy`. The value at a time when ``signal`` changes is
+        the value after the change. Times before the start of the recording are treated as
+        the start of the recording.
+        """
+        import numpy
+        timestamps, values, sign_bit = self.columns[signal]
+        times = numpy.rint(numpy.asarray(times, dtype=numpy.float64) * 10 ** 12)
+        # The arrays are viewed in place rather than copied, since only a few of their elements
+        # are selected.
+        indices = numpy.searchsorted(numpy.frombuffer(timestamps, dtype=numpy.int64),
+                                     times.astype(numpy.int64), side="right") - 1
+        numpy.clip(indices, 0, None, out=indices)
+        if isinstance(values, list):
+            return numpy.array([values[index] for index in indices.tolist()], dtype=object)
+        dtype = numpy.int64 if values.typecode == "q" else numpy.uint64
+        return numpy.frombuffer(values, dtype=dtype)[indices]
+
+
+class _Profiler:
+    """Profile of a simulation.
+
+    While a profile is being recorded, the processes of the simulation, as well as its methods
+    that settle the design, commit signal changes, and update waveform files, are replaced with
+    wrappers that measure them; they are restored once the recording stops. This way, the hot
+    loop of the engine does not do any extra work unless a profile is being recorded.
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.process_stats = dict()
+        self.signal_commits = collections.Counter()
+        self.delta_cycles = collections.Counter()
+        self.trace_time = 0.0
+        self.wall_time = 0.0
+        self._commits = 0
+        self._wrapped = []
+
+    def _wrap(self, owner, name, wrapper):
+        # Methods are wrapped by shadowing them with an instance attribute, which is deleted
+        # afterwards; attributes that hold a function (e.g. in `__slots__`) are reassigned.
+        is_attribute = not hasattr(owner, "__dict__") or name in vars(owner)
+        self._wrapped.append((owner, name, getattr(owner, name), is_attribute))
+        setattr(owner, name, wrapper)
+
+    def add_process(self, process):
+        if process in self.process_stats:
+            return
+        stats = self.process_stats[process] = [0, 0.0]
+        run = process.run
+        perf_counter = time.perf_counter
+        def profiled_run():
+            start = perf_counter()
+            try:
+                run()
+            finally:
+                stats[0] += 1
+                stats[1] += perf_counter() - start
+        self._wrap(process, "run", profiled_run)
+
+    def _wrap_commit(self, owner, name, *, delta_cycle):
+        commit = getattr(owner, name)
+        signal_commits = self.signal_commits
+        def profiled_commit(changed=None):
+            if delta_cycle:
+                self._commits += 1
+            committed = set()
+            result = commit(committed)
+            signal_commits.update(committed)
+            if changed is not None:
+                changed.update(committed)
+            return result
+        self._wrap(owner, name, profiled_commit)
+
+    def start(self):
+        engine = self.engine
+        for process in engine._processes:
+            self.add_process(process)
+
+        # Combinational processes evaluated in levelized order commit their changes within
+        # a delta cycle; these commits are not counted as delta cycles.
+        self._wrap_commit(engine._state, "commit", delta_cycle=True)
+        if hasattr(engine, "_commit_comb"):
+            self._wrap_commit(engine, "_commit_comb", delta_cycle=False)
+
+        settle = engine._settle
+        def profiled_settle(changed):
+            commits = self._commits
+            settle(changed)
+            self.delta_cycles[self._commits - commits] += 1
+        self._wrap(engine, "_settle", profiled_settle)
+
+        trace = engine._trace
+        def profiled_trace(changed):
+            start = time.perf_counter()
+            trace(changed)
+            self.trace_time += time.perf_counter() - start
+        self._wrap(engine, "_trace", profiled_trace)
+
+        self._started_at = time.perf_counter()
+
+    def stop(self):
+        self.wall_time += time.perf_counter() - self._started_at
+        for owner, name, original, is_attribute in reversed(self._wrapped):
+            if is_attribute:
+                setattr(owner, name, original)
+            else:
+                delattr(owner, name)
+        self._wrapped.clear()
+
+    def _process_name(self, process):
+        if isinstance(process, PyRTLProcess):
+            return ".".join(process.hierarchy), process.domain or "comb"
+        elif isinstance(process, PyClockProcess):
+            return self.engine._state.slots[process.slot].name, "clock"
+        elif isinstance(process, PyCoroProcess):
+            constructor = process.constructor
+            return getattr(constructor, "__qualname__", repr(constructor)), "process"
+        else:
+            return repr(process), "other"
+
+    def as_dict(self, *, limit=None):
+        """The profile, as a dictionary of built-in types (e.g. for serializing it as JSON).
+
+        The processes compiled from the same fragment and domain are aggregated. Processes and
+        signals are sorted in descending order of time spent and of commit count, respectively;
+        if ``limit`` is not ``None``, only that many of each are included.
+        """
+        processes = dict()
+        for process, (runs, elapsed) in self.process_stats.items():
+            name, kind = self._process_name(process)
+            entry = processes.setdefault((name, kind),
+                {"name": name, "kind": kind, "processes": 0, "runs": 0, "time": 0.0})
+            entry["processes"] += 1
+            entry["runs"] += runs
+            entry["time"] += elapsed
+        processes = sorted(processes.values(), key=lambda entry: entry["time"], reverse=True)
+
+        signal_names = _NameExtractor()(self.engine._fragment)
+        signals = []
+        for index, commits in self.signal_commits.most_common(limit):
+            signal = self.engine._state.slots[index]
+            if signal in signal_names:
+                # Prefer the name in the most deeply nested fragment, which is usually the one
+                # driving the signal.
+                name = ".".join(min(signal_names[signal], key=lambda name: (-len(name), name)))
+            else:
+                name = signal.name
+            signals.append({"name": name, "commits": commits})
+
+        return {
+            "wall_time": self.wall_time,
+            "trace_time": self.trace_time,
+            "processes": processes[:limit],
+            "delta_cycles": {str(deltas): steps
+                             for deltas, steps in sorted(self.delta_cycles.items())},
+            "signals": signals,
+        }
+
+    def json(self, *, limit=None):
+        """The profile, as a JSON string; see :meth:`as_dict`."""
+        return json.dumps(self.as_dict(limit=limit), indent=2)
+
+    def table(self, *, limit=20):
+        """The profile, as human-readable tables."""
+        profile = self.as_dict(limit=limit)
+        lines = []
+        lines.append("{:>10}  {:>6}  {:>10}  {:>5}  {}"
+                     .format("time, s", "%", "runs", "procs", "process"))
+        for entry in profile["processes"]:
+            lines.append("{:>10.4f}  {:>6.1%}  {:>10}  {:>5}  {} ({})".format(
+                entry["time"], entry["time"] / max(self.wall_time, 1e-9), entry["runs"],
+                entry["processes"], entry["name"], entry["kind"]))
+        lines.append("{:>10.4f}  {:>6.1%}  {:>10}  {:>5}  (waveform writing)".format(
+            self.trace_time, self.trace_time / max(self.wall_time, 1e-9), "", ""))
+        lines.append("{:>10.4f}  {:>6.1%}  {:>10}  {:>5}  (total)".format(
+            self.wall_time, 1, "", ""))
+        lines.append("")
+        lines.append("{:>10}  {}".format("steps", "delta cycles"))
+        for deltas, steps in profile["delta_cycles"].items():
+            lines.append("{:>10}  {}".format(steps, deltas))
+        lines.append("")
+        lines.append("{:>10}  {}".format("commits", "signal"))
+        for entry in profile["signals"]:
+            lines.append("{:>10}  {}".format(entry["commits"], entry["name"]))
+        return "\n".join(lines)
+
+
 class _Timeline:
     def __init__(self):
         self.now = 0.0
+        # Every waiting process is recorded in `deadlines`; processes sharing a deadline are
+        # grouped in `waiters`, and each distinct deadline is pushed to the `queue` heap once.
+        # Cancelled deadlines are left in the heap and skipped lazily when they are popped.
         self.deadlines = dict()
+        self.waiters = dict()
+        self.queue = []
 
     def reset(self):
         self.now = 0.0
         self.deadlines.clear()
+        self.waiters.clear()
+        self.queue.clear()
 
     def at(self, run_at, process):
         assert process not in self.deadlines
         self.deadlines[process] = run_at
+        try:
+            self.waiters[run_at].add(process)
+        except KeyError:
+            self.waiters[run_at] = {process}
+            heapq.heappush(self.queue, run_at)
 
     def delay(self, delay_by, process):
         if delay_by is None:
@@ -176,26 +785,32 @@ class _Timeline:
             run_at = self.now + delay_by
         self.at(run_at, process)
 
+    def cancel(self, process):
+        run_at = self.deadlines.pop(process, None)
+        if run_at is None:
+            return False
+        processes = self.waiters[run_at]
+        processes.remove(process)
+        if not processes:
+            del self.waiters[run_at]
+        return True
+
+    def next_deadline(self):
+        while self.queue and self.queue[0] not in self.waiters:
+            heapq.heappop(self.queue)
+        if self.queue:
+            return self.queue[0]
+
     def advance(self):
-        nearest_processes = set()
-        nearest_deadline = None
-        for process, deadline in self.deadlines.items():
-            if deadline is None:
-                if nearest_deadline is not None:
-                    nearest_processes.clear()
-                nearest_processes.add(process)
-                nearest_deadline = self.now
+        while self.queue:
+            nearest_deadline = heapq.heappop(self.queue)
+            nearest_processes = self.waiters.pop(nearest_deadline, None)
+            if nearest_processes:
                 break
-            elif nearest_deadline is None or deadline <= nearest_deadline:
-                assert deadline >= self.now
-                if nearest_deadline is not None and deadline < nearest_deadline:
-                    nearest_processes.clear()
-                nearest_processes.add(process)
-                nearest_deadline = deadline
-
-        if not nearest_processes:
+        else:
             return False
 
+        assert nearest_deadline >= self.now
         for process in nearest_processes:
             process.runnable = True
             del self.deadlines[process]
@@ -204,44 +819,31 @@ class _Timeline:
         return True
 
 
-class _PySignalState(BaseSignalState):
-    __slots__ = ("signal", "curr", "next", "waiters", "pending")
-
-    def __init__(self, signal, pending):
-        self.signal = signal
-        self.pending = pending
-        self.waiters = dict()
-        self.curr = self.next = signal.reset
-
-    def set(self, value):
-        if self.next == value:
-            return
-        self.next = value
-        self.pending.add(self)
-
-    def commit(self):
-        if self.curr == self.next:
-            return False
-        self.curr = self.next
-
-        awoken_any = False
-        for process, trigger in self.waiters.items():
-            if trigger is None or trigger == self.curr:
-                process.runnable = awoken_any = True
-        return awoken_any
-
-
 class _PySimulation(BaseSimulation):
     def __init__(self):
         self.timeline = _Timeline()
+        # Signal state is stored as a structure of arrays indexed by slot number, so that
+        # the generated code can access it with plain indexing operations.
         self.signals  = SignalDict()
         self.slots    = []
+        self.curr     = []
+        self.next     = []
+        self.waiters  = dict()
         self.pending  = set()
+        # Words of each native memory occupy consecutive slots, starting with the slot used as
+        # the key of this dictionary.
+        self.memories = dict()
+        self.memory_slots = set()
+        # Processes waiting on an asyncio future (or `None`, if they are only yielding to the event
+        # loop), and whether the simulation is running within an event loop.
+        self.external = dict()
+        self.asynchronous = False
 
     def reset(self):
         self.timeline.reset()
-        for signal, index in self.signals.items():
-            self.slots[index].curr = self.slots[index].next = signal.reset
+        self.external.clear()
+        for index, signal in enumerate(self.slots):
+            self.curr[index] = self.next[index] = signal.reset
         self.pending.clear()
 
     def get_signal(self, signal):
@@ -249,60 +851,282 @@ class _PySimulation(BaseSimulation):
             return self.signals[signal]
         except KeyError:
             index = len(self.slots)
-            self.slots.append(_PySignalState(signal, self.pending))
+            self.slots.append(signal)
+            self.curr.append(signal.reset)
+            self.next.append(signal.reset)
             self.signals[signal] = index
             return index
 
+    def add_memory(self, memory):
+        if memory in self.memories.values():
+            return
+        words = memory._array
+        assert not any(word in self.signals for word in words)
+        base = len(self.slots)
+        # Processes reading from a memory are sensitive to every word of it. Registering each of
+        # them separately would be prohibitively expensive for large memories, so every word
+        # shares the same waiter dictionary.
+        waiters = dict()
+        for word in words:
+            self.waiters[self.get_signal(word)] = waiters
+        self.memories[base] = memory
+        self.memory_slots.update(range(base, len(self.slots)))
+
+    def is_memory_word(self, index):
+        return index in self.memory_slots
+
+    def set(self, index, value):
+        if self.next[index] == value:
+            return
+        self.next[index] = value
+        self.pending.add(index)
+
     def add_trigger(self, process, signal, *, trigger=None):
         index = self.get_signal(signal)
-        assert (process not in self.slots[index].waiters or
-                self.slots[index].waiters[process] == trigger)
-        self.slots[index].waiters[process] = trigger
+        waiters = self.waiters.setdefault(index, dict())
+        assert (process not in waiters or waiters[process] == trigger)
+        waiters[process] = trigger
 
     def remove_trigger(self, process, signal):
         index = self.get_signal(signal)
-        assert process in self.slots[index].waiters
-        del self.slots[index].waiters[process]
+        assert process in self.waiters[index]
+        del self.waiters[index][process]
 
     def wait_interval(self, process, interval):
         self.timeline.delay(interval, process)
 
     def commit(self, changed=None):
         converged = True
-        for signal_state in self.pending:
-            if signal_state.commit():
-                converged = False
-        if changed is not None:
-            changed.update(self.pending)
+        curr, next, waiters = self.curr, self.next, self.waiters
+        for index in self.pending:
+            value = next[index]
+            if curr[index] == value:
+                continue
+            curr[index] = value
+            if changed is not None:
+                changed.add(index)
+            if index in waiters:
+                for process, trigger in waiters[index].items():
+                    if trigger is None or trigger == value:
+                        process.runnable = True
+                        converged = False
         self.pending.clear()
         return converged
 
 
+def _levelize(processes):
+    """Order combinational processes by their dependencies.
+
+    Returns the strongly connected components of the dependency graph of ``processes`` (where
+    a process depends on every process driving one of its inputs) in topological order, such that
+    every component only depends on itself and on the components preceding it. Components that
+    include more than one process, or a single process depending on itself, are combinational
+    loops.
+    """
+    drivers = SignalDict()
+    for process in processes:
+        for signal in process.outputs:
+            drivers[signal] = process
+
+    dependents = {process: dict() for process in processes}
+    for process in processes:
+        for signal in process.inputs:
+            if signal in drivers:
+                dependents[drivers[signal]][process] = None
+
+    # Tarjan's algorithm, written iteratively to handle arbitrarily long chains of processes.
+    # It finds components in reverse topological order.
+    components = []
+    indexes  = dict()
+    lowlinks = dict()
+    stack    = []
+    on_stack = set()
+    for root in processes:
+        if root in indexes:
+            continue
+        indexes[root] = lowlinks[root] = len(indexes)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(dependents[root]))]
+        while work:
+            process, successors = work[-1]
+            for successor in successors:
+                if successor not in indexes:
+                    indexes[successor] = lowlinks[successor] = len(indexes)
+                    stack.append(successor)
+                    on_stack.add(successor)
+                    work.append((successor, iter(dependents[successor])))
+                    break
+                elif successor in on_stack:
+                    lowlinks[process] = min(lowlinks[process], indexes[successor])
+            else:
+                work.pop()
+                if work:
+                    predecessor, _ = work[-1]
+                    lowlinks[predecessor] = min(lowlinks[predecessor], lowlinks[process])
+                if lowlinks[process] == indexes[process]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.remove(member)
+                        component.append(member)
+                        if member is process:
+                            break
+                    components.append(component)
+    components.reverse()
+    return components
+
+
+class _PySimCheckpoint:
+    """Snapshot of the state of a :class:`PySimEngine`.
+
+    The generators of coroutine processes cannot be copied, so only whether each of them has
+    finished is recorded. Processes compiled from the design only wait on fixed sets of signals,
+    so only whether each of them is runnable is recorded.
+    """
+    def __init__(self, engine):
+        self.engine    = engine
+        self.now       = engine._timeline.now
+        self.values    = list(engine._state.curr)
+        # Coroutine processes are restarted when a checkpoint is restored, and do not have
+        # deadlines to restore.
+        self.deadlines = {process: run_at
+                          for process, run_at in engine._timeline.deadlines.items()
+                          if not isinstance(process, PyCoroProcess)}
+        self.processes = dict()
+        for process in engine._processes:
+            if isinstance(process, PyCoroProcess):
+                self.processes[process] = process.coroutine is None
+            elif isinstance(process, PyClockProcess):
+                self.processes[process] = (process.runnable, process.initial)
+            else:
+                self.processes[process] = process.runnable
+
+
 class PySimEngine(BaseEngine):
     def __init__(self, fragment):
         self._state = _PySimulation()
         self._timeline = self._state.timeline
 
         self._fragment = fragment
-        self._processes = _FragmentCompiler(self._state)(self._fragment)
-        self._vcd_writers = []
+        self._code_cache = _CodeCache.default()
+        self._processes = _FragmentCompiler(self._state, cache=self._code_cache)(self._fragment)
+        self._commands = _CommandCompiler(self._state)
+        self._trace_sinks = []
+        self._profiler = None
+        self._stepping = False
+
+    def _add_process(self, process):
+        self._processes.add(process)
+        if self._profiler is not None:
+            self._profiler.add_process(process)
 
     def add_coroutine_process(self, process, *, default_cmd):
-        self._processes.add(PyCoroProcess(self._state, self._fragment.domains, process,
-                                          default_cmd=default_cmd))
+        process = PyCoroProcess(self._state, self._fragment.domains, process,
+                                default_cmd=default_cmd, compiler=self._commands)
+        self._add_process(process)
+        return process
 
     def add_clock_process(self, clock, *, phase, period):
-        self._processes.add(PyClockProcess(self._state, clock,
-                                           phase=phase, period=period))
+        process = PyClockProcess(self._state, clock, phase=phase, period=period)
+        self._add_process(process)
+        return process
+
+    def _remove_process(self, process):
+        if isinstance(process, PyCoroProcess):
+            process.clear_triggers()
+            self._state.external.pop(process, None)
+        self._timeline.cancel(process)
+        self._processes.remove(process)
+
+    def remove_process(self, process):
+        if process not in self._processes or isinstance(process, PyRTLProcess):
+            raise ValueError("Process {!r} is not a user or clock process of this simulation"
+                             .format(process))
+        self._remove_process(process)
+
+    def clear(self):
+        for process in list(self._processes):
+            if not isinstance(process, PyRTLProcess):
+                self._remove_process(process)
+        self.reset()
 
     def reset(self):
+        for process in self._processes:
+            if isinstance(process, PyCoroProcess):
+                process.clear_triggers()
         self._state.reset()
         for process in self._processes:
             process.reset()
 
-    def _step(self):
-        changed = set() if self._vcd_writers else None
-
+    def checkpoint(self):
+        return _PySimCheckpoint(self)
+
+    def restore(self, checkpoint):
+        assert checkpoint.engine is self
+        if self._trace_sinks:
+            # Waveforms and traces are recorded in order of time, which cannot go backwards.
+            raise ValueError("Cannot restore a checkpoint while writing waveforms or recording "
+                             "traces")
+        # Signals that were first used after the checkpoint had their reset values at that time.
+        state = self._state
+        for index, signal in enumerate(state.slots):
+            if index < len(checkpoint.values):
+                state.curr[index] = state.next[index] = checkpoint.values[index]
+            else:
+                state.curr[index] = state.next[index] = signal.reset
+        state.pending.clear()
+        state.external.clear()
+
+        for process in list(self._processes):
+            if process not in checkpoint.processes:
+                self._remove_process(process)
+        for process, process_state in checkpoint.processes.items():
+            if process not in self._processes:
+                # The process was removed (e.g. by `clear()`) after the checkpoint was taken.
+                self._add_process(process)
+            if isinstance(process, PyCoroProcess):
+                process.clear_triggers()
+                if process_state:
+                    process.coroutine = None
+                    process.runnable  = False
+                    process.passive   = True
+                else:
+                    process.reset()
+            elif isinstance(process, PyClockProcess):
+                process.runnable, process.initial = process_state
+            else:
+                process.runnable = process_state
+
+        self._timeline.reset()
+        self._timeline.now = checkpoint.now
+        for process, run_at in checkpoint.deadlines.items():
+            self._timeline.at(run_at, process)
+
+    def fork(self):
+        # Returns the new engine, and a dictionary mapping user and clock processes of this
+        # engine to the corresponding processes of the new one.
+        engine = type(self)(self._fragment)
+        processes = dict()
+        for process in self._processes:
+            if isinstance(process, PyClockProcess):
+                clone = engine.add_clock_process(self._state.slots[process.slot],
+                                                 phase=process.phase, period=process.period)
+                clone.runnable = process.runnable
+                clone.initial  = process.initial
+                if process in self._timeline.deadlines:
+                    engine._timeline.at(self._timeline.deadlines[process], clone)
+                processes[process] = clone
+            elif isinstance(process, PyCoroProcess) and process.coroutine is not None:
+                processes[process] = engine.add_coroutine_process(process.constructor,
+                                                                  default_cmd=process.default_cmd)
+        engine._timeline.now = self._timeline.now
+        for signal, value in zip(self._state.slots, self._state.curr):
+            index = engine._state.get_signal(signal)
+            engine._state.curr[index] = engine._state.next[index] = value
+        return engine, processes
+
+    def _settle(self, changed):
         # Performs the two phases of a delta cycle in a loop:
         converged = False
         while not converged:
@@ -315,27 +1139,499 @@ class PySimEngine(BaseEngine):
             # 2. commit: apply every queued signal change, waking up any waiting processes
             converged = self._state.commit(changed)
 
-        for vcd_writer in self._vcd_writers:
-            for signal_state in changed:
-                vcd_writer.update(self._timeline.now,
-                    signal_state.signal, signal_state.curr)
+    def _propagate(self, changed):
+        # Like `_settle()`, but only runs the processes compiled from the design. Any other
+        # processes that are runnable (such as a clock process about to toggle the clock) are left
+        # to run during the next step.
+        converged = False
+        while not converged:
+            for process in self._processes:
+                if process.runnable and isinstance(process, PyRTLProcess):
+                    process.runnable = False
+                    process.run()
+            converged = self._state.commit(changed)
+
+    def _scheduled(self):
+        # Whether advancing the simulation can still change anything.
+        return bool(self._state.external or self._timeline.next_deadline() is not None or
+                    any(process.runnable for process in self._processes))
+
+    def _trace(self, changed):
+        for trace_sink in self._trace_sinks:
+            trace_sink.update(self._timeline.now, changed, self._state.curr)
+
+    def _step(self):
+        changed = set() if self._trace_sinks else None
+
+        self._stepping = True
+        try:
+            self._settle(changed)
+        finally:
+            self._stepping = False
+
+        if changed:
+            self._trace(changed)
 
     def advance(self):
         self._step()
+        if self._state.external:
+            # Time does not advance while a process is waiting on an asyncio future.
+            return True
         self._timeline.advance()
         return any(not process.passive for process in self._processes)
 
+    async def advance_async(self):
+        state = self._state
+        state.asynchronous = True
+        try:
+            result = self.advance()
+            while state.external:
+                futures = [future for future in state.external.values() if future is not None]
+                if len(futures) < len(state.external):
+                    await asyncio.sleep(0)
+                else:
+                    await asyncio.wait(futures, return_when=asyncio.FIRST_COMPLETED)
+                for process, future in list(state.external.items()):
+                    if future is None or future.done():
+                        del state.external[process]
+                        process.runnable = True
+                result = self.advance()
+            return result
+        finally:
+            state.asynchronous = False
+
+    def peek(self, value):
+        if self._state.pending and not self._stepping:
+            # Propagate the changes made by `poke()` through the design (unless called from
+            # a process, which observes the values committed during the previous delta cycle, just
+            # like with `yield value`). Processes scheduled at the current time, including clock
+            # processes, do not run until the simulation is advanced, so the result does not depend
+            # on whether anything was poked.
+            changed = set() if self._trace_sinks else None
+            self._propagate(changed)
+            if changed:
+                self._trace(changed)
+        run, args = self._commands(value)
+        return Const.normalize(run(*args), value.shape())
+
+    def poke(self, lhs, value):
+        if type(lhs) is Signal and isinstance(value, int):
+            self._state.set(self._state.get_signal(lhs), Const.normalize(value, lhs.shape()))
+        else:
+            run, args = self._commands(lhs.eq(value))
+            run(*args)
+
+    def run_vectors(self, *, inputs, outputs, clock, edge, count):
+        state, curr = self._state, self._state.curr
+        input_slots = [(state.get_signal(signal), values) for signal, values in inputs.items()]
+        output_slots = []
+        for signal, values in outputs.items():
+            if signal.shape().signed and len(signal) > 0:
+                sign_bit = 1 << (len(signal) - 1)
+            else:
+                sign_bit = None
+            output_slots.append((state.get_signal(signal), values, sign_bit))
+        clock_slot   = state.get_signal(clock)
+        clock_active = 1 if edge == "pos" else 0
+
+        for row in range(count):
+            for slot, values in input_slots:
+                state.set(slot, values[row])
+            # Advance until the design settles after an active edge of the clock.
+            while True:
+                clock_value, now = curr[clock_slot], self._timeline.now
+                self.advance()
+                if curr[clock_slot] != clock_value and curr[clock_slot] == clock_active:
+                    break
+                # Time does not advance if there is nothing left to run (which is rare otherwise,
+                # so it is cheap to check whether that is the case only then).
+                if self._timeline.now == now and not self._scheduled():
+                    raise RuntimeError("Simulation has stopped before the next active edge of "
+                                       "clock {!r}"
+                                       .format(clock.name))
+            for slot, values, sign_bit in output_slots:
+                value = curr[slot]
+                if sign_bit is not None and value >= sign_bit:
+                    # Not every engine stores the values of signed signals as negative integers.
+                    value -= sign_bit << 1
+                values[row] = value
+
     @property
     def now(self):
         return self._timeline.now
 
     @contextmanager
-    def write_vcd(self, *, vcd_file, gtkw_file, traces):
-        vcd_writer = _VCDWriter(self._fragment,
-            vcd_file=vcd_file, gtkw_file=gtkw_file, traces=traces)
+    def write_vcd(self, *, vcd_file, gtkw_file, traces, include=None, exclude=(), depth=None,
+                  sample_domain=None, history=None, trigger=None, background=False):
+        if trigger is not None:
+            trigger = self._commands(Value.cast(trigger))
+        vcd_writer = _VCDWriter(self._state, self._fragment,
+            vcd_file=vcd_file, gtkw_file=gtkw_file, traces=traces,
+            include=include, exclude=exclude, depth=depth, sample_domain=sample_domain,
+            history=history, trigger=trigger, background=background)
         try:
-            self._vcd_writers.append(vcd_writer)
-            yield
+            self._trace_sinks.append(vcd_writer)
+            yield vcd_writer
+        except Exception:
+            # Most importantly, an exception raised by one of the processes.
+            vcd_writer.dump()
+            raise
         finally:
             vcd_writer.close(self._timeline.now)
-            self._vcd_writers.remove(vcd_writer)
+            self._trace_sinks.remove(vcd_writer)
+
+    @contextmanager
+    def record_trace(self, *, traces):
+        recorder = _TraceRecorder(self._state, traces, timestamp=self._timeline.now)
+        try:
+            self._trace_sinks.append(recorder)
+            yield recorder
+        finally:
+            self._trace_sinks.remove(recorder)
+
+    @contextmanager
+    def profile(self):
+        if self._profiler is not None:
+            raise ValueError("Simulation is already being profiled")
+        profiler = _Profiler(self)
+        profiler.start()
+        try:
+            self._profiler = profiler
+            yield profiler
+        finally:
+            self._profiler = None
+            profiler.stop()
+
+
+class PyLevelizedSimEngine(PySimEngine):
+    """Python simulation engine with levelized combinational evaluation.
+
+    Combinational processes are ordered by their dependencies when the design is compiled, and
+    each time the design is settled, every combinational process whose inputs have changed runs
+    exactly once, after all of the processes it depends on. Unlike delta cycle iteration, this
+    does not require one delta cycle per combinational process along a path through the design.
+    Delta cycle iteration is only used within combinational loops.
+    """
+    def __init__(self, fragment):
+        super().__init__(fragment)
+
+        comb_processes = [process for process in self._processes
+                          if isinstance(process, PyRTLProcess) and process.is_comb]
+        self._comb_processes = set(comb_processes)
+        self._comb_levels = _levelize(comb_processes)
+
+    def _settle(self, changed):
+        converged = False
+        while not converged:
+            # 1. eval: run and suspend every non-waiting sequential, clock, or user process once,
+            #    and commit all queued signal changes
+            for process in self._processes:
+                if process.runnable and process not in self._comb_processes:
+                    process.runnable = False
+                    process.run()
+            converged = self._state.commit(changed)
+
+            # 2. comb: run every non-waiting combinational process after the ones it depends on,
+            #    committing signal changes immediately so that the dependents observe them
+            for level in self._comb_levels:
+                while True:
+                    ran_any = False
+                    for process in level:
+                        if process.runnable:
+                            process.runnable = False
+                            process.run()
+                            ran_any = True
+                    if not ran_any:
+                        break
+                    # A combinational signal change could have awoken a non-combinational
+                    # process, so repeat the first phase (which is cheap if that is not the case).
+                    if not self._commit_comb(changed):
+                        converged = False
+
+    def _commit_comb(self, changed):
+        # Commits the changes made by a level of combinational processes. This is a part of
+        # the delta cycle being settled rather than a delta cycle of its own, so it bypasses
+        # `self._state.commit`, which is replaced with a wrapper while profiling.
+        return _PySimulation.commit(self._state, changed)
+
+
+class PyCycleSimEngine(PyLevelizedSimEngine):
+    """Cycle-based Python simulation engine.
+
+    Intended for designs with a single clock domain that does not have an asynchronous reset.
+    Rather than running a process only when a signal it is sensitive to changes, this engine
+    evaluates the design on a fixed schedule: on each active edge of the clock, every synchronous
+    process runs once, and then every combinational process runs once, in levelized order (see
+    :class:`PyLevelizedSimEngine`). The combinational logic is evaluated the same way after
+    a testbench process changes any signals. The clock of the design is driven by the engine
+    itself, without scheduling its edges on the timeline (although it may also be driven by
+    a testbench process). Testbench processes behave exactly as they do with :class:`PySimEngine`,
+    except that they cannot wait on changes of signals driven by combinational logic.
+
+    This avoids the overhead of tracking which processes are sensitive to which signals, which
+    dominates the simulation time of designs where much of the logic changes on every cycle.
+    Designs where most of the logic is idle most of the time may simulate slower.
+    """
+    def __init__(self, fragment):
+        domains = [fragment.domains[domain_name]
+                   for domain_name in sorted(self._find_domains(fragment))]
+        if len(domains) > 1:
+            raise ValueError("Cycle-based simulation requires a design with at most one clock "
+                             "domain, not {}"
+                             .format(", ".join(repr(domain.name) for domain in domains)))
+        for domain in domains:
+            if domain.rst is not None and domain.async_reset:
+                raise ValueError("Cycle-based simulation does not support domain {!r} with "
+                                 "an asynchronous reset"
+                                 .format(domain.name))
+
+        super().__init__(fragment)
+
+        self._domain = domains[0] if domains else None
+        # The clock of the design is inlined into the engine; `_clock_process` is only used to
+        # identify it, and is never run.
+        self._clock_process = None
+        if self._domain is not None:
+            self._clock_index  = self._state.get_signal(self._domain.clk)
+            self._clock_active = 1 if self._domain.clk_edge == "pos" else 0
+        else:
+            self._clock_index  = None
+        self._clock_slot   = None
+        self._clock_phase  = None
+        self._clock_period = None
+        self._clock_at     = None
+        self._clock_edge   = False
+        # Processes that are not compiled from the design (testbench processes, and any clock
+        # processes that are not driving the clock of the design) are run when they are woken up,
+        # just like they are by `PySimEngine`.
+        self._sequential = [process for process in self._processes
+                            if not isinstance(process, PyRTLProcess)]
+        self._coroutines = []
+
+        # Processes compiled from the design run on a schedule, and are not sensitive to any
+        # signals, which makes committing signal changes cheaper.
+        self._sync_processes = []
+        for process in self._processes:
+            if not isinstance(process, PyRTLProcess):
+                continue
+            if process.is_comb:
+                signals = process.inputs
+            else:
+                signals = [self._domain.clk]
+                self._sync_processes.append(process)
+            for signal in signals:
+                index = self._state.get_signal(signal)
+                waiters = self._state.waiters.get(index)
+                if waiters is not None:
+                    waiters.pop(process, None)
+                    if not waiters:
+                        del self._state.waiters[index]
+
+        # Combinational processes are grouped into stages, such that every process only depends
+        # on the processes in the preceding stages, and signal changes only need to be committed
+        # once per stage. A stage that includes a combinational loop is evaluated repeatedly
+        # until it converges.
+        drivers = SignalDict()
+        for process in self._comb_processes:
+            for signal in process.outputs:
+                drivers[signal] = process
+        depths = dict()
+        self._comb_stages = []
+        for level in self._comb_levels:
+            depth = 0
+            for process in level:
+                for signal in process.inputs:
+                    if signal in drivers and drivers[signal] not in level:
+                        depth = max(depth, depths[drivers[signal]] + 1)
+            is_loop = len(level) > 1 or any(signal in level[0].outputs
+                                            for signal in level[0].inputs)
+            for process in level:
+                depths[process] = depth
+            while len(self._comb_stages) <= depth:
+                self._comb_stages.append(([], False))
+            stage_processes, stage_is_loop = self._comb_stages[depth]
+            stage_processes.extend(level)
+            self._comb_stages[depth] = (stage_processes, stage_is_loop or is_loop)
+        # The combinational logic is evaluated on every edge of the clock if it uses the clock.
+        self._comb_clocked = (self._domain is not None and
+            any(self._domain.clk in process.inputs for process in self._comb_processes))
+        self._comb_stale = True
+
+    def _find_domains(self, fragment):
+        domain_names = {domain_name for domain_name in fragment.drivers if domain_name is not None}
+        for subfragment, subfragment_name in fragment.subfragments:
+            domain_names |= self._find_domains(subfragment)
+        return domain_names
+
+    def add_clock_process(self, clock, *, phase, period):
+        if (self._domain is not None and clock is self._domain.clk and
+                self._clock_slot is None):
+            self._clock_process = PyClockProcess(self._state, clock, phase=phase, period=period)
+            self._clock_slot   = self._state.get_signal(clock)
+            self._clock_phase  = phase
+            self._clock_period = period
+            self._clock_at     = phase
+            return self._clock_process
+        else:
+            return super().add_clock_process(clock, phase=phase, period=period)
+
+    def _add_process(self, process):
+        super()._add_process(process)
+        self._sequential.append(process)
+        if isinstance(process, PyCoroProcess):
+            self._coroutines.append(process)
+
+    def _remove_process(self, process):
+        if process is self._clock_process:
+            self._clock_process = None
+            self._clock_slot    = None
+            self._clock_edge    = False
+            return
+        super()._remove_process(process)
+        self._sequential.remove(process)
+        if process in self._coroutines:
+            self._coroutines.remove(process)
+
+    def remove_process(self, process):
+        if process is not None and process is self._clock_process:
+            self._remove_process(process)
+        else:
+            super().remove_process(process)
+
+    def clear(self):
+        if self._clock_process is not None:
+            self._remove_process(self._clock_process)
+        super().clear()
+
+    def reset(self):
+        super().reset()
+        self._clock_at   = self._clock_phase
+        self._clock_edge = False
+        self._comb_stale = True
+
+    def checkpoint(self):
+        checkpoint = super().checkpoint()
+        checkpoint.clock = (self._clock_process, self._clock_slot, self._clock_phase,
+                            self._clock_period, self._clock_at, self._clock_edge)
+        return checkpoint
+
+    def restore(self, checkpoint):
+        super().restore(checkpoint)
+        (self._clock_process, self._clock_slot, self._clock_phase,
+            self._clock_period, self._clock_at, self._clock_edge) = checkpoint.clock
+        self._comb_stale = True
+
+    def fork(self):
+        engine, processes = super().fork()
+        if self._clock_process is not None:
+            processes[self._clock_process] = engine.add_clock_process(self._domain.clk,
+                phase=self._clock_phase, period=self._clock_period)
+            engine._clock_at   = self._clock_at
+            engine._clock_edge = self._clock_edge
+        return engine, processes
+
+    def _scheduled(self):
+        # Processes compiled from the design are not run according to their `runnable` flags.
+        return bool(self._clock_slot is not None or self._state.external or
+                    self._timeline.next_deadline() is not None or
+                    any(process.runnable for process in self._sequential))
+
+    def _commit_comb(self, changed):
+        # Equivalent to `_PySimulation.commit()`, except that nothing can be waiting on a signal
+        # driven by a combinational process.
+        curr, next, pending = self._state.curr, self._state.next, self._state.pending
+        if changed is None:
+            for index in pending:
+                curr[index] = next[index]
+        else:
+            for index in pending:
+                value = next[index]
+                if curr[index] != value:
+                    curr[index] = value
+                    changed.add(index)
+        pending.clear()
+
+    def _propagate(self, changed):
+        state = self._state
+        if not (state.pending or self._comb_stale):
+            return
+        self._comb_stale = False
+        if self._clock_index in state.pending:
+            # The clock of the design is driven by a testbench process.
+            clock_value = state.curr[self._clock_index]
+            state.commit(changed)
+            if (state.curr[self._clock_index] != clock_value and
+                    state.curr[self._clock_index] == self._clock_active):
+                for process in self._sync_processes:
+                    process.run()
+                state.commit(changed)
+        else:
+            state.commit(changed)
+        for processes, is_loop in self._comb_stages:
+            while True:
+                for process in processes:
+                    process.run()
+                if not is_loop:
+                    self._commit_comb(changed)
+                    break
+                stage_changed = set()
+                self._commit_comb(stage_changed)
+                if changed is not None:
+                    changed.update(stage_changed)
+                if not stage_changed:
+                    break
+
+    def _settle(self, changed):
+        state = self._state
+        if self._clock_edge:
+            self._clock_edge = False
+            # Processes woken up at the same time as the clock edge observe the values of signals
+            # before the edge, and their changes are committed together with it, exactly as if
+            # the clock was driven by a clock process.
+            for process in self._sequential:
+                if process.runnable:
+                    process.runnable = False
+                    process.run()
+            clock_value = 1 - state.curr[self._clock_slot]
+            state.set(self._clock_slot, clock_value)
+            state.commit(changed)
+            if clock_value == self._clock_active:
+                for process in self._sync_processes:
+                    process.run()
+            elif self._comb_clocked:
+                self._comb_stale = True
+            elif not state.pending and not any(process.runnable for process in self._sequential):
+                # Nothing is sensitive to this edge of the clock.
+                return
+
+        while True:
+            # 1. eval: run and suspend every non-waiting testbench or clock process once
+            for process in self._sequential:
+                if process.runnable:
+                    process.runnable = False
+                    process.run()
+
+            # 2. comb: if any signals have changed, commit the changes and run every
+            #    combinational process, stage by stage
+            self._propagate(changed)
+
+            if not any(process.runnable for process in self._sequential):
+                break
+
+    def advance(self):
+        self._step()
+        if self._state.external:
+            return True
+
+        deadline = self._timeline.next_deadline()
+        if self._clock_slot is not None and (deadline is None or self._clock_at <= deadline):
+            if deadline == self._clock_at:
+                self._timeline.advance()
+            else:
+                self._timeline.now = self._clock_at
+            self._clock_at += self._clock_period / 2
+            self._clock_edge = True
+        else:
+            self._timeline.advance()
+
+        return any(not process.passive for process in self._coroutines)
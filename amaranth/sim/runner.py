@@ -0,0 +1,213 @@
+import os
+import time
+import traceback
+import concurrent.futures
+
+from .core import Simulator
+from ._pyrtl import _CodeCache
+
+
+__all__ = ["ScenarioResult", "RegressionReport", "run_regression"]
+
+
+class ScenarioResult:
+    """Outcome of a single scenario of a regression.
+
+    Attributes
+    ----------
+    name : str
+        Name of the scenario: ``"seed N"`` for seeds, or the name of the scenario callable.
+    passed : bool
+        ``True`` if neither the scenario nor the simulation raised an exception.
+    error : str or None
+        Formatted traceback of the exception, if the scenario failed.
+    wall_time : float
+        Time spent setting up and running the simulation, in seconds.
+    sim_time : float
+        Simulated time at the end of the scenario, in seconds.
+    cycles : int
+        Number of active edges of the clock of the regression domain, or 0 if the scenario
+        did not add a clock for it.
+    cycles_per_second : float
+        Simulated cycles per second of wall time.
+    """
+    def __init__(self, *, name, passed, error, wall_time, sim_time, cycles):
+        self.name      = name
+        self.passed    = passed
+        self.error     = error
+        self.wall_time = wall_time
+        self.sim_time  = sim_time
+        self.cycles    = cycles
+
+    @property
+    def cycles_per_second(self):
+        if self.wall_time == 0:
+            return 0.0
+        return self.cycles / self.wall_time
+
+    def __repr__(self):
+        return "(scenario {!r} {} {:.3f}s {} cycles)".format(
+            self.name, "pass" if self.passed else "FAIL", self.wall_time, self.cycles)
+
+
+class RegressionReport:
+    """Results of a regression, in the order in which the scenarios were given.
+
+    Iterating over a report yields a :class:`ScenarioResult` for each scenario.
+    """
+    def __init__(self, results, *, wall_time):
+        self.results   = list(results)
+        self.wall_time = wall_time
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __len__(self):
+        return len(self.results)
+
+    @property
+    def passed(self):
+        return [result for result in self.results if result.passed]
+
+    @property
+    def failed(self):
+        return [result for result in self.results if not result.passed]
+
+    def summary(self):
+        """A human-readable summary of the regression, with the traceback of every failure."""
+        lines = []
+        for result in self.failed:
+            lines.append("FAIL: {}".format(result.name))
+            lines.append(result.error.rstrip())
+        total_cycles = sum(result.cycles for result in self.results)
+        lines.append("{} passed, {} failed in {:.3f}s ({:.0f} cycles/s per scenario)"
+                     .format(len(self.passed), len(self.failed), self.wall_time,
+                             total_cycles / max(sum(result.wall_time for result in self.results),
+                                                1e-9)))
+        return "\n".join(lines)
+
+
+# The design is elaborated and compiled once per worker process, and the simulation is reused for
+# every scenario run by that worker.
+_worker = None
+
+
+def _worker_init(factory, engine, domain, cache_dir):
+    global _worker
+    dut = factory()
+    if cache_dir is None:
+        sim = Simulator(dut, engine=engine)
+    else:
+        with _CodeCache.in_directory(cache_dir):
+            sim = Simulator(dut, engine=engine)
+    _worker = (dut, sim, domain)
+
+
+def _scenario_name(scenario):
+    if isinstance(scenario, int):
+        return "seed {}".format(scenario)
+    return getattr(scenario, "__qualname__", None) or repr(scenario)
+
+
+def _count_cycles(sim, domain):
+    # Only the clocks added by `Simulator.add_clock` have a known period.
+    for clock_domain, process in sim._clocked.items():
+        if clock_domain.name == domain and process is not None:
+            now = sim._engine.now
+            if now < process.phase:
+                return 0
+            return int((now - process.phase) / process.period + 1e-9) + 1
+    return 0
+
+
+def _worker_run(task):
+    dut, sim, domain = _worker
+    scenario, testbench = task
+    name = _scenario_name(scenario)
+    error = None
+    start = time.perf_counter()
+    try:
+        sim.clear()
+        if isinstance(scenario, int):
+            testbench(sim, dut, scenario)
+        else:
+            scenario(sim, dut)
+        sim.run()
+    except Exception:
+        error = traceback.format_exc()
+    wall_time = time.perf_counter() - start
+    return ScenarioResult(name=name, passed=error is None, error=error, wall_time=wall_time,
+                          sim_time=sim._engine.now, cycles=_count_cycles(sim, domain))
+
+
+def run_regression(factory, scenarios, *, testbench=None, engine="pysim", domain="sync",
+                   workers=None, cache_dir=None):
+    """Run many independent simulations of a design, in parallel.
+
+    The scenarios are spread over a pool of worker processes. Each worker calls ``factory`` and
+    compiles the design it returns only once; before each scenario, the simulation is cleared
+    (see :meth:`Simulator.clear`). A scenario adds clocks and processes to the simulation, which
+    is then run until every non-passive process finishes. A scenario fails if it raises an
+    exception, or if one of its processes does (e.g. a failing ``assert``).
+
+    If the worker processes are started with the ``spawn`` method (the default on macOS and
+    Windows), ``factory``, ``testbench`` and every scenario must be picklable, e.g. functions
+    defined at the top level of a module.
+
+    Arguments
+    ---------
+    factory : callable
+        Function returning the elaboratable to simulate.
+    scenarios : iterable of callable or int
+        Scenarios to run. A callable is called as ``scenario(sim, dut)``, where ``sim`` is the
+        :class:`Simulator` and ``dut`` is the elaboratable returned by ``factory``. An integer is
+        a seed, and ``testbench(sim, dut, seed)`` is called for it.
+    testbench : callable
+        Function called for scenarios that are seeds.
+    engine : str
+        Simulation engine to use; see :class:`Simulator`.
+    domain : str
+        Clock domain whose cycles are counted in the results.
+    workers : None or int
+        Number of worker processes. If ``None``, one per CPU is used. If ``0``, the scenarios
+        are run one after another in the current process, which is useful for debugging.
+    cache_dir : None or str
+        If specified, the on-disk cache of compiled processes in this directory is used by every
+        worker, so that the design is only compiled once overall, rather than once per worker.
+
+    Returns
+    -------
+    :class:`RegressionReport`
+    """
+    tasks = []
+    for scenario in scenarios:
+        if isinstance(scenario, int):
+            if testbench is None:
+                raise TypeError("Scenario {!r} is a seed, but no testbench was specified"
+                                .format(scenario))
+        elif not callable(scenario):
+            raise TypeError("Scenario must be a callable or an integer seed, not {!r}"
+                            .format(scenario))
+        tasks.append((scenario, testbench))
+
+    start = time.perf_counter()
+    if workers == 0:
+        global _worker
+        saved_worker = _worker
+        try:
+            _worker_init(factory, engine, domain, cache_dir)
+            results = [_worker_run(task) for task in tasks]
+        finally:
+            _worker = saved_worker
+    else:
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = max(1, min(workers, len(tasks)))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                initializer=_worker_init,
+                initargs=(factory, engine, domain, cache_dir)) as executor:
+            # Send scenarios to the workers a few at a time, to amortize the communication cost,
+            # while keeping the workers balanced if some scenarios take longer than others.
+            chunksize = max(1, len(tasks) // (workers * 4))
+            results = list(executor.map(_worker_run, tasks, chunksize=chunksize))
+    return RegressionReport(results, wall_time=time.perf_counter() - start)
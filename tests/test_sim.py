@@ -1,4 +1,8 @@
 import os
+import gc
+import json
+import asyncio
+import tempfile
 from contextlib import contextmanager
 
 from amaranth._utils import flatten
@@ -9,11 +13,14 @@ from amaranth.hdl.rec import *
 from amaranth.hdl.dsl import  *
 from amaranth.hdl.ir import *
 from amaranth.sim import *
+from amaranth.sim.pysim import _VCDWriterProcess
 
 from .utils import *
 
 
 class SimulatorUnitTestCase(FHDLTestCase):
+    engine = "pysim"
+
     def assertStatement(self, stmt, inputs, output, reset=0):
         inputs = [Value.cast(i) for i in inputs]
         output = Value.cast(output)
@@ -27,7 +34,7 @@ class SimulatorUnitTestCase(FHDLTestCase):
         for signal in flatten(s._lhs_signals() for s in Statement.cast(stmt)):
             frag.add_driver(signal)
 
-        sim = Simulator(frag)
+        sim = Simulator(frag, engine=self.engine)
         def process():
             for isig, input in zip(isigs, inputs):
                 yield isig.eq(input)
@@ -332,6 +339,27 @@ class SimulatorUnitTestCase(FHDLTestCase):
         for i in range(10):
             self.assertStatement(stmt, [C(i)], C(0))
 
+    def test_switch_many_cases(self):
+        stmt = lambda y, a: Switch(a, {
+            **{(n,): y.eq(n + 1) for n in range(16)},
+            ("10---", "11000"): y.eq(20),
+            ("111--",): y.eq(30),
+            (): y.eq(40),
+        })
+        for n in range(16):
+            self.assertStatement(stmt, [C(n, 5)], C(n + 1, 6))
+        self.assertStatement(stmt, [C(0b10000, 5)], C(20, 6))
+        self.assertStatement(stmt, [C(0b10111, 5)], C(20, 6))
+        self.assertStatement(stmt, [C(0b11000, 5)], C(20, 6))
+        self.assertStatement(stmt, [C(0b11001, 5)], C(40, 6))
+        self.assertStatement(stmt, [C(0b11100, 5)], C(30, 6))
+        self.assertStatement(stmt, [C(0b11111, 5)], C(30, 6))
+
+    def test_switch_many_cases_no_default(self):
+        stmt = lambda y, a: Switch(a, {(n,): y.eq(n + 1) for n in range(16)})
+        self.assertStatement(stmt, [C(3, 5)],  C(4, 5))
+        self.assertStatement(stmt, [C(24, 5)], C(5, 5), reset=5)
+
     def test_shift_left(self):
         stmt1 = lambda y, a: y.eq(a.shift_left(1))
         self.assertStatement(stmt1, [C(0b10100010, 8)], C(   0b101000100, 9))
@@ -398,9 +426,11 @@ class SimulatorUnitTestCase(FHDLTestCase):
 
 
 class SimulatorIntegrationTestCase(FHDLTestCase):
+    engine = "pysim"
+
     @contextmanager
     def assertSimulation(self, module, deadline=None):
-        sim = Simulator(module)
+        sim = Simulator(module, engine=self.engine)
         yield sim
         with sim.write_vcd("test.vcd", "test.gtkw"):
             if deadline is None:
@@ -458,7 +488,7 @@ class SimulatorIntegrationTestCase(FHDLTestCase):
 
     def test_reset(self):
         self.setUp_counter()
-        sim = Simulator(self.m)
+        sim = Simulator(self.m, engine=self.engine)
         sim.add_clock(1e-6)
         times = 0
         def process():
@@ -559,6 +589,49 @@ class SimulatorIntegrationTestCase(FHDLTestCase):
                 self.assertEqual((yield self.i), 0b10101111)
             sim.add_process(process)
 
+    def test_array_register_file(self):
+        regs  = Array(Signal(8, name=f"r{i}", reset=i) for i in range(5))
+        waddr = Signal(3)
+        wdata = Signal(8)
+        whigh = Signal()
+        raddr = Signal(3)
+        rdata = Signal(8)
+        rsum  = Signal(9)
+
+        m = Module()
+        with m.If(whigh):
+            m.d.sync += regs[waddr][4:].eq(wdata)
+        with m.Else():
+            m.d.sync += regs[waddr].eq(wdata)
+        m.d.comb += rdata.eq(regs[raddr])
+        m.d.comb += rsum.eq(Array([regs[0] + 1, regs[1], wdata])[raddr])
+        with self.assertSimulation(m) as sim:
+            sim.add_clock(1e-6)
+            def process():
+                self.assertEqual((yield Cat(*regs)), 0x0403020100)
+                yield waddr.eq(1)
+                yield wdata.eq(0x12)
+                yield
+                yield waddr.eq(7) # out of bounds, selects the last element
+                yield wdata.eq(0x34)
+                yield
+                yield waddr.eq(1)
+                yield whigh.eq(1)
+                yield wdata.eq(0xf)
+                yield
+                yield Settle()
+                self.assertEqual((yield Cat(*regs)), 0x340302f200)
+                for addr, value in [(0, 1), (1, 0xf2), (2, 0xf), (5, 0xf)]:
+                    yield raddr.eq(addr)
+                    yield Settle()
+                    self.assertEqual((yield rdata), (yield regs[min(addr, 4)]))
+                    self.assertEqual((yield rsum), value)
+                    self.assertEqual((yield Array([C(10), C(20), raddr + 1])[raddr]),
+                                     [10, 20, addr + 1, addr + 1, addr + 1, addr + 1][addr])
+                    self.assertEqual((yield Array([C(30), C(40), raddr + 2])[raddr]),
+                                     [30, 40, addr + 2, addr + 2, addr + 2, addr + 2][addr])
+            sim.add_sync_process(process)
+
     def test_run_until(self):
         m = Module()
         s = Signal()
@@ -571,6 +644,25 @@ class SimulatorIntegrationTestCase(FHDLTestCase):
                 self.fail()
             sim.add_process(process)
 
+    def test_delay_order(self):
+        log = []
+        with self.assertSimulation(Module()) as sim:
+            def make_process(index, interval):
+                def process():
+                    for _ in range(3):
+                        yield Delay(interval)
+                        log.append((sim._engine.now, index))
+                return process
+            for index, interval in enumerate([3.0, 1.0, 2.0, 1.0]):
+                sim.add_process(make_process(index, interval))
+        self.assertEqual([now for now, index in log], sorted(now for now, index in log))
+        self.assertEqual(sorted(log), sorted([
+            (1.0, 1), (2.0, 1), (3.0, 1),
+            (1.0, 3), (2.0, 3), (3.0, 3),
+            (2.0, 2), (4.0, 2), (6.0, 2),
+            (3.0, 0), (6.0, 0), (9.0, 0),
+        ]))
+
     def test_add_process_wrong(self):
         with self.assertSimulation(Module()) as sim:
             with self.assertRaisesRegex(TypeError,
@@ -607,6 +699,46 @@ class SimulatorIntegrationTestCase(FHDLTestCase):
         with self.assertSimulation(m) as sim:
             sim.add_clock(1, if_exists=True)
 
+    def test_command_reuse(self):
+        a = Signal(8)
+        b = Signal(9)
+        const = Const(1, 1)
+        with self.assertSimulation(Module()) as sim:
+            def process():
+                commands = sim._engine._commands.cache
+                for _ in range(2):
+                    for value in range(16):
+                        yield a.eq(value)
+                        yield Settle()
+                        yield b.eq(Cat(const, a[1:], const))
+                        yield Settle()
+                        self.assertEqual((yield a), value)
+                        self.assertEqual((yield b), 0x101 | value)
+                    if _ == 0:
+                        size = len(commands)
+                self.assertEqual(len(commands), size)
+            sim.add_process(process)
+
+    def test_command_array_const(self):
+        sig = Signal(8)
+        idx = Signal()
+        const = Const(5, 8)
+        with self.assertSimulation(Module()) as sim:
+            def process():
+                # The same constant is used inside and outside of an array element computed by
+                # a function.
+                yield sig.eq(3)
+                yield Settle()
+                self.assertEqual((yield const + Array([const, sig + 1])[idx]), 10)
+                yield idx.eq(1)
+                yield Settle()
+                self.assertEqual((yield const + Array([const, sig + 1])[idx]), 9)
+                self.assertEqual((yield const + Array([const + 1, sig])[idx]), 8)
+                yield idx.eq(0)
+                yield Settle()
+                self.assertEqual((yield const + Array([const + 1, sig])[idx]), 11)
+            sim.add_process(process)
+
     def test_command_wrong(self):
         survived = False
         with self.assertSimulation(Module()) as sim:
@@ -737,6 +869,42 @@ class SimulatorIntegrationTestCase(FHDLTestCase):
             sim.add_clock(1e-6)
             sim.add_process(process)
 
+    def test_memory_out_of_bounds(self):
+        self.m = Module()
+        self.memory = Memory(width=8, depth=3, init=[0x11, 0x22, 0x33])
+        self.m.submodules.rdport = self.rdport = self.memory.read_port(domain="comb")
+        self.m.submodules.wrport = self.wrport = self.memory.write_port()
+        with self.assertSimulation(self.m) as sim:
+            def process():
+                yield self.rdport.addr.eq(3)
+                yield Settle()
+                self.assertEqual((yield self.rdport.data), 0x33)
+                yield self.wrport.addr.eq(3)
+                yield self.wrport.data.eq(0x44)
+                yield self.wrport.en.eq(1)
+                yield
+                yield Settle()
+                self.assertEqual((yield self.rdport.data), 0x44)
+                self.assertEqual((yield self.memory[2]), 0x44)
+                self.assertEqual((yield self.memory[1]), 0x22)
+            sim.add_clock(1e-6)
+            sim.add_sync_process(process)
+
+    def test_memory_trace(self):
+        self.setUp_memory()
+        with tempfile.TemporaryDirectory() as dirname:
+            vcd_filename = os.path.join(dirname, "test.vcd")
+            for traces, traced in [((), False), ((self.memory[1],), True)]:
+                sim = Simulator(self.m, engine=self.engine)
+                sim.add_clock(1e-6)
+                with sim.write_vcd(vcd_filename, traces=traces):
+                    sim.run_until(1e-5, run_passive=True)
+                with open(vcd_filename) as vcd_file:
+                    vcd_text = vcd_file.read()
+                self.assertIn("memory_r_data", vcd_text)
+                self.assertNotIn("memory(0)", vcd_text)
+                self.assertEqual("memory(1)" in vcd_text, traced)
+
     def test_memory_read_only(self):
         self.m = Module()
         self.memory = Memory(width=8, depth=4, init=[0xaa, 0x55])
@@ -797,11 +965,749 @@ class SimulatorIntegrationTestCase(FHDLTestCase):
             sim.add_sync_process(process_gen)
             sim.add_sync_process(process_check)
 
+    def test_vcd_decoder(self):
+        m = Module()
+        count = Signal(4)
+        state = Signal(2, decoder=lambda value: "state {}".format(value))
+        m.d.sync += count.eq(count + 1)
+        m.d.comb += state.eq(count[1:3])
+        with tempfile.TemporaryDirectory() as dirname:
+            vcd_filename = os.path.join(dirname, "test.vcd")
+            sim = Simulator(m, engine=self.engine)
+            sim.add_clock(1e-6)
+            with sim.write_vcd(vcd_filename):
+                sim.run_until(1e-3, run_passive=True)
+            with open(vcd_filename) as vcd_file:
+                vcd_text = vcd_file.read()
+        for value in range(4):
+            self.assertIn("state_{}".format(value), vcd_text)
+
+    def test_vcd_decoder_error(self):
+        m = Module()
+        count = Signal(4)
+        state = Signal(2, decoder=lambda value: str(1 // (3 - value)))
+        m.d.sync += count.eq(count + 1)
+        m.d.comb += state.eq(count[1:3])
+        sim = Simulator(m, engine=self.engine)
+        sim.add_clock(1e-6)
+        with self.assertRaises(ZeroDivisionError):
+            with open(os.path.devnull, "w") as f:
+                with sim.write_vcd(f):
+                    sim.run_until(1e-3, run_passive=True)
+
+    def test_vcd_background(self):
+        m = Module()
+        count = Signal(4)
+        state = Signal(2, decoder=lambda value: "state {}".format(value))
+        m.d.sync += count.eq(count + 1)
+        m.d.comb += state.eq(count[1:3])
+        for kwargs in ({}, {"history": 8, "trigger": count == 10}):
+            with self.subTest(**kwargs):
+                texts = []
+                with tempfile.TemporaryDirectory() as dirname:
+                    for background in (False, True):
+                        vcd_filename = os.path.join(dirname, "test.vcd")
+                        gtkw_filename = os.path.join(dirname, "test.gtkw")
+                        sim = Simulator(m, engine=self.engine)
+                        sim.add_clock(1e-6)
+                        with sim.write_vcd(vcd_filename, gtkw_filename, traces=[count, state],
+                                           background=background, **kwargs):
+                            sim.run_until(1e-4, run_passive=True)
+                        with open(vcd_filename) as vcd_file:
+                            vcd_text = vcd_file.read().split("$timescale")[1]
+                        with open(gtkw_filename) as gtkw_file:
+                            gtkw_text = gtkw_file.read().split("[dumpfile]")[1]
+                        texts.append((vcd_text, gtkw_text))
+                self.assertIn("state_3", texts[1][0])
+                self.assertEqual(texts[0], texts[1])
+
+    def test_vcd_background_error(self):
+        sim = Simulator(Module(), engine=self.engine)
+        with tempfile.TemporaryDirectory() as dirname:
+            with self.assertRaises(FileNotFoundError):
+                with sim.write_vcd(os.path.join(dirname, "missing", "test.vcd"),
+                                   background=True):
+                    pass
+
+    def test_vcd_wrong_background(self):
+        sim = Simulator(Module(), engine=self.engine)
+        with self.assertRaisesRegex(TypeError,
+                r"^Writing waveforms in the background requires the VCD file to be specified "
+                r"by name, not <_io\.TextIOWrapper .+>$"):
+            with open(os.path.devnull, "w") as f:
+                with sim.write_vcd(f, background=True):
+                    pass
+
+    def test_vcd_filter(self):
+        m = Module()
+        m.submodules.cpu = cpu = Module()
+        m.submodules.uart = uart = Module()
+        cpu.submodules.alu = alu = Module()
+        top_s, cpu_s, uart_s, alu_s = (Signal(name=name + "_s")
+                                       for name in ("top", "cpu", "uart", "alu"))
+        m.d.sync += top_s.eq(~top_s)
+        cpu.d.sync += cpu_s.eq(~cpu_s)
+        uart.d.sync += uart_s.eq(~uart_s)
+        alu.d.sync += alu_s.eq(~alu_s)
+        def traced(**kwargs):
+            with tempfile.TemporaryDirectory() as dirname:
+                vcd_filename = os.path.join(dirname, "test.vcd")
+                sim = Simulator(m, engine=self.engine)
+                sim.add_clock(1e-6)
+                with sim.write_vcd(vcd_filename, **kwargs):
+                    sim.run_until(1e-5, run_passive=True)
+                with open(vcd_filename) as vcd_file:
+                    vcd_text = vcd_file.read()
+            return [name for name in ("top_s", "cpu_s", "uart_s", "alu_s") if name in vcd_text]
+        self.assertEqual(traced(), ["top_s", "cpu_s", "uart_s", "alu_s"])
+        self.assertEqual(traced(include="top.cpu.*"), ["cpu_s", "alu_s"])
+        self.assertEqual(traced(include=["top.cpu.*"], exclude=["top.cpu.alu.*"]), ["cpu_s"])
+        self.assertEqual(traced(include=["top.*_s"], depth=1), ["top_s", "cpu_s", "uart_s"])
+        self.assertEqual(traced(depth=0), ["top_s"])
+        self.assertEqual(traced(depth=0, traces=[alu_s]), ["top_s", "alu_s"])
+
+    def test_vcd_sample_domain(self):
+        m = Module()
+        count = Signal(4)
+        double = Signal(5)
+        glitch = Signal()
+        glitch_out = Signal()
+        m.d.sync += count.eq(count + 1)
+        m.d.comb += double.eq(count * 2)
+        m.d.comb += glitch_out.eq(glitch)
+        with tempfile.TemporaryDirectory() as dirname:
+            vcd_filename = os.path.join(dirname, "test.vcd")
+            sim = Simulator(m, engine=self.engine)
+            sim.add_clock(1e-6)
+            def process():
+                for _ in range(5):
+                    yield Delay(0.6e-6)
+                    yield glitch.eq(1)
+                    yield Delay(0.3e-6)
+                    yield glitch.eq(0)
+                    yield Delay(0.1e-6)
+            sim.add_process(process)
+            with sim.write_vcd(vcd_filename, sample_domain="sync"):
+                sim.run()
+            with open(vcd_filename) as vcd_file:
+                vcd_lines = vcd_file.read().splitlines()
+        var_ids = {}
+        for line in vcd_lines:
+            if line.startswith("$var"):
+                _, _, _, var_id, var_name, *_ = line.split()
+                var_ids[var_name] = var_id
+        timestamps = set()
+        changes = []
+        for line in vcd_lines:
+            if line.startswith("#"):
+                timestamps.add(int(line[1:]))
+            elif line.startswith("b"):
+                value, var_id = line[1:].split()
+                changes.append((var_id, int(value, 2)))
+            elif line[:1] in ("0", "1"):
+                changes.append((line[1:], int(line[0])))
+        # Every change is recorded on a rising edge of the clock (or at the start or the end).
+        self.assertEqual({round(timestamp, -2) for timestamp in timestamps} - {0, 50000},
+                         {5000 + 10000 * n for n in range(5)})
+        self.assertNotIn((var_ids["glitch_out"], 1), changes)
+        self.assertEqual([value for var_id, value in changes if var_id == var_ids["double"]],
+                         [0, 2, 4, 6, 8, 10])
+
+    def test_vcd_wrong_sample_domain(self):
+        sim = Simulator(Module(), engine=self.engine)
+        with self.assertRaisesRegex(ValueError,
+                r"^Domain 'sync' is not present in simulation$"):
+            with open(os.path.devnull, "w") as f:
+                with sim.write_vcd(f, sample_domain="sync"):
+                    pass
+
+    def setUp_flight_recorder(self):
+        self.m = Module()
+        self.count = Signal(8)
+        self.m.d.sync += self.count.eq(self.count + 1)
+
+    def assertFlightRecorder(self, vcd_filename, counts):
+        with open(vcd_filename) as vcd_file:
+            vcd_lines = vcd_file.read().splitlines()
+        self.assertEqual([int(line[1:].split()[0], 2) for line in vcd_lines
+                          if line.startswith("b")], counts)
+
+    def test_vcd_flight_recorder_exception(self):
+        self.setUp_flight_recorder()
+        with tempfile.TemporaryDirectory() as dirname:
+            vcd_filename = os.path.join(dirname, "test.vcd")
+            sim = Simulator(self.m, engine=self.engine)
+            sim.add_clock(1e-6)
+            def process():
+                for _ in range(30):
+                    yield
+                raise ZeroDivisionError
+            sim.add_sync_process(process)
+            with self.assertRaises(ZeroDivisionError):
+                with sim.write_vcd(vcd_filename, history=10):
+                    sim.run()
+            # The initial value, followed by the changes made during the last 10 timesteps (and
+            # therefore 5 clock cycles).
+            self.assertFlightRecorder(vcd_filename, [25, 26, 27, 28, 29, 30])
+
+    def test_vcd_flight_recorder_trigger(self):
+        self.setUp_flight_recorder()
+        with tempfile.TemporaryDirectory() as dirname:
+            vcd_filename = os.path.join(dirname, "test.vcd")
+            sim = Simulator(self.m, engine=self.engine)
+            sim.add_clock(1e-6)
+            with sim.write_vcd(vcd_filename, history=4, trigger=self.count == 100):
+                sim.run_until(103e-6, run_passive=True)
+            # Once the history is written, further changes are written as they happen.
+            self.assertFlightRecorder(vcd_filename, [98, 99, 100, 101, 102, 103])
+
+    def test_vcd_flight_recorder_dump(self):
+        self.setUp_flight_recorder()
+        with tempfile.TemporaryDirectory() as dirname:
+            vcd_filename = os.path.join(dirname, "test.vcd")
+            sim = Simulator(self.m, engine=self.engine)
+            sim.add_clock(1e-6)
+            with sim.write_vcd(vcd_filename, history=2, sample_domain="sync") as recorder:
+                sim.run_until(50e-6, run_passive=True)
+                recorder.dump()
+            self.assertFlightRecorder(vcd_filename, [48, 49, 50])
+
+    def test_vcd_flight_recorder_no_trigger(self):
+        self.setUp_flight_recorder()
+        with tempfile.TemporaryDirectory() as dirname:
+            vcd_filename = os.path.join(dirname, "test.vcd")
+            sim = Simulator(self.m, engine=self.engine)
+            sim.add_clock(1e-6)
+            with sim.write_vcd(vcd_filename, history=10, trigger=self.count == 100):
+                sim.run_until(50e-6, run_passive=True)
+            with open(vcd_filename) as vcd_file:
+                self.assertEqual(vcd_file.read(), "")
+
+    def test_vcd_wrong_history(self):
+        sim = Simulator(Module(), engine=self.engine)
+        with self.assertRaisesRegex(TypeError,
+                r"^History length must be a positive integer, not 0$"):
+            with open(os.path.devnull, "w") as f:
+                with sim.write_vcd(f, history=0):
+                    pass
+
+    def test_vcd_wrong_trigger(self):
+        m = Module()
+        stop = Signal()
+        m.d.comb += stop.eq(1)
+        sim = Simulator(m, engine=self.engine)
+        f = open(os.path.devnull, "w")
+        with self.assertRaisesRegex(ValueError,
+                r"^Trigger can only be used in flight recorder mode, i.e. together with "
+                r"history$"):
+            with sim.write_vcd(f, trigger=stop):
+                pass
+        self.assertTrue(f.closed)
+
+    def setUp_record_trace(self):
+        self.m = Module()
+        self.count = Signal(4)
+        self.neg = Signal(signed(8))
+        self.wide = Signal(72)
+        self.m.d.sync += self.count.eq(self.count + 1)
+        self.m.d.comb += self.neg.eq(-self.count)
+        self.m.d.comb += self.wide.eq(self.count << 68)
+
+    def test_record_trace_values_at(self):
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest("NumPy is not installed")
+        self.setUp_record_trace()
+        sim = Simulator(self.m, engine=self.engine)
+        sim.add_clock(1e-6)
+        with sim.record_trace([self.count, self.neg, self.wide]) as trace:
+            sim.run_until(3e-6, run_passive=True)
+        times = [-1e-6, 0, 0.4e-6, 0.5e-6, 1.7e-6, 2.5e-6, 10e-6]
+        values = trace.values_at(self.count, times)
+        self.assertEqual(values.dtype, numpy.uint64)
+        self.assertEqual(values.tolist(), [0, 0, 0, 1, 2, 3, 3])
+        values = trace.values_at(self.neg, times)
+        self.assertEqual(values.dtype, numpy.int64)
+        self.assertEqual(values.tolist(), [0, 0, 0, -1, -2, -3, -3])
+        values = trace.values_at(self.wide, times)
+        self.assertEqual(values.dtype, object)
+        self.assertEqual(values.tolist(), [n << 68 for n in (0, 0, 0, 1, 2, 3, 3)])
+        # Recording continues to work after the arrays have been viewed.
+        self.assertEqual(trace.values_at(self.count, []).tolist(), [])
+
+    def test_record_trace_values_at_numpy(self):
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest("NumPy is not installed")
+        self.setUp_record_trace()
+        sim = Simulator(self.m, engine=self.engine)
+        sim.add_clock(1e-6)
+        with sim.record_trace([self.count]) as trace:
+            sim.run_until(1e-6, run_passive=True)
+            values = trace.values_at(self.count, numpy.arange(4) * 0.5e-6)
+            self.assertEqual(values.tolist(), [0, 1, 1, 1])
+            sim.run_until(3e-6, run_passive=True)
+        values = trace.values_at(self.count, numpy.arange(8) * 0.5e-6)
+        self.assertEqual(values.tolist(), [0, 1, 1, 2, 2, 3, 3, 3])
+
+    def test_record_trace_numpy(self):
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest("NumPy is not installed")
+        self.setUp_record_trace()
+        sim = Simulator(self.m, engine=self.engine)
+        sim.add_clock(1e-6)
+        with sim.record_trace([self.count, self.neg, self.wide]) as trace:
+            sim.run_until(3e-6, run_passive=True)
+        timestamps, values = trace.numpy(self.count)
+        self.assertEqual(timestamps.dtype, numpy.int64)
+        self.assertEqual(timestamps.tolist(), [0, 500_000, 1_500_000, 2_500_000])
+        self.assertEqual(values.tolist(), [0, 1, 2, 3])
+        timestamps, values = trace.numpy(self.neg)
+        self.assertEqual(values.dtype, numpy.int64)
+        self.assertEqual(values.tolist(), [0, -1, -2, -3])
+        timestamps, values = trace.numpy(self.wide)
+        self.assertEqual(values.dtype, object)
+        self.assertEqual(values.tolist(), [0, 1 << 68, 2 << 68, 3 << 68])
+
+    def test_checkpoint_restore(self):
+        self.setUp_memory()
+        counter = Signal(8)
+        self.m.d.sync += counter.eq(counter + 1)
+        sim = Simulator(self.m, engine=self.engine)
+        sim.add_clock(1e-6)
+        def boot():
+            yield self.wrport.addr.eq(1)
+            yield self.wrport.data.eq(0x11)
+            yield self.wrport.en.eq(1)
+            yield
+            yield self.wrport.en.eq(0)
+        sim.add_sync_process(boot)
+        sim.run_until(10e-6, run_passive=True)
+        checkpoint = sim.checkpoint()
+
+        results = []
+        for data in (0x22, 0x33):
+            def scenario():
+                results.append(((yield counter), (yield self.memory[1]), (yield self.memory[2])))
+                yield self.wrport.addr.eq(2)
+                yield self.wrport.data.eq(data)
+                yield self.wrport.en.eq(1)
+                for _ in range(5):
+                    yield
+                results.append(((yield counter), (yield self.memory[1]), (yield self.memory[2])))
+            sim.restore(checkpoint)
+            sim.add_sync_process(scenario)
+            sim.run()
+        self.assertEqual(results, [
+            (10, 0x11, 0x00), (15, 0x11, 0x22),
+            (10, 0x11, 0x00), (15, 0x11, 0x33),
+        ])
+
+    def test_checkpoint_restart(self):
+        counter = Signal(8)
+        m = Module()
+        m.d.sync += counter.eq(counter + 1)
+        sim = Simulator(m, engine=self.engine)
+        sim.add_clock(1e-6)
+        started = []
+        def process():
+            started.append((yield counter))
+            for _ in range(10):
+                yield
+        sim.add_sync_process(process)
+        sim.run_until(5e-6, run_passive=True)
+        checkpoint = sim.checkpoint()
+        sim.run()
+        sim.restore(checkpoint)
+        sim.run()
+        # The process was running when the checkpoint was taken, so it is restarted (after
+        # the next clock edge, as it was added with `add_sync_process`).
+        self.assertEqual(started, [0, 5])
+
+    def test_fork(self):
+        counter = Signal(8)
+        m = Module()
+        m.d.sync += counter.eq(counter + 1)
+        sim = Simulator(m, engine=self.engine)
+        sim.add_clock(1e-6)
+        sim.run_until(5e-6, run_passive=True)
+        fork = sim.fork()
+        sim.run_until(10e-6, run_passive=True)
+        results = []
+        def process():
+            results.append((yield counter))
+            yield
+            results.append((yield counter))
+        fork.add_sync_process(process)
+        fork.run()
+        self.assertEqual(results, [5, 6])
+        sim.add_sync_process(process)
+        sim.run()
+        self.assertEqual(results, [5, 6, 10, 11])
+
+    def test_checkpoint_wrong(self):
+        sim1 = Simulator(Module(), engine=self.engine)
+        sim2 = Simulator(Module(), engine=self.engine)
+        with self.assertRaisesRegex(ValueError,
+                r"^Cannot restore a checkpoint of a different simulation$"):
+            sim2.restore(sim1.checkpoint())
+
+    def test_checkpoint_trace(self):
+        counter = Signal(8)
+        m = Module()
+        m.d.sync += counter.eq(counter + 1)
+        sim = Simulator(m, engine=self.engine)
+        sim.add_clock(1e-6)
+        checkpoint = sim.checkpoint()
+        with sim.record_trace([counter]):
+            sim.run_until(3e-6, run_passive=True)
+            with self.assertRaisesRegex(ValueError,
+                    r"^Cannot restore a checkpoint while writing waveforms or recording "
+                    r"traces$"):
+                sim.restore(checkpoint)
+        sim.restore(checkpoint)
+        self.assertEqual(sim._engine.now, 0)
+        with open(os.path.devnull, "w") as f:
+            with sim.write_vcd(f):
+                sim.run_until(3e-6, run_passive=True)
+                with self.assertRaisesRegex(ValueError,
+                        r"^Cannot restore a checkpoint while writing waveforms or recording "
+                        r"traces$"):
+                    sim.restore(checkpoint)
+        sim.restore(checkpoint)
+        self.assertEqual(sim._engine.now, 0)
+
+    def test_clear(self):
+        counter = Signal(8)
+        m = Module()
+        m.d.sync += counter.eq(counter + 1)
+        sim = Simulator(m, engine=self.engine)
+        results = []
+        for cycles in (3, 5):
+            sim.clear()
+            sim.add_clock(1e-6)
+            def process():
+                for _ in range(cycles):
+                    yield
+                results.append(((yield counter), round(sim._engine.now, 9)))
+            sim.add_sync_process(process)
+            sim.run()
+        self.assertEqual(results, [(3, 3.5e-6), (5, 5.5e-6)])
+
+    def test_checkpoint_clear(self):
+        counter = Signal(8)
+        m = Module()
+        m.d.sync += counter.eq(counter + 1)
+        sim = Simulator(m, engine=self.engine)
+        clock = sim.add_clock(1e-6)
+        results = []
+        def process():
+            yield Passive()
+            while True:
+                yield Tick()
+                results.append((yield counter))
+        sim.add_process(process)
+        checkpoint = sim.checkpoint()
+        for remove in (sim.clear, lambda: sim.remove_process(clock)):
+            sim.advance_cycles(2)
+            remove()
+            sim.restore(checkpoint)
+            results.clear()
+            sim.advance_cycles(3)
+            self.assertEqual(sim.peek(counter), 3)
+            self.assertEqual(results, [0, 1, 2])
+
+    def test_remove_process(self):
+        counter = Signal(8)
+        m = Module()
+        m.d.sync += counter.eq(counter + 1)
+        sim = Simulator(m, engine=self.engine)
+        clock = sim.add_clock(1e-6)
+        results = []
+        def process_a():
+            yield
+            results.append("a")
+        def process_b():
+            yield
+            results.append("b")
+        a = sim.add_sync_process(process_a)
+        b = sim.add_sync_process(process_b)
+        sim.remove_process(a)
+        sim.run()
+        self.assertEqual(results, ["b"])
+
+        # Replace the clock with a slower one.
+        sim.reset()
+        sim.remove_process(clock)
+        sim.remove_process(b)
+        sim.add_clock(4e-6)
+        def process_c():
+            for _ in range(2):
+                yield
+            results.append((yield counter))
+        sim.add_sync_process(process_c)
+        sim.run()
+        self.assertEqual(results, ["b", 2])
+        self.assertAlmostEqual(sim._engine.now, 12e-6)
+
+    def test_remove_process_wrong(self):
+        sim = Simulator(Module(), engine=self.engine)
+        def process():
+            yield Delay(1e-6)
+        p = sim.add_process(process)
+        sim.remove_process(p)
+        with self.assertRaisesRegex(ValueError,
+                r"^Process .+ is not a user or clock process of this simulation$"):
+            sim.remove_process(p)
+
+    def test_profile(self):
+        count = Signal(8)
+        doubled = Signal(9)
+        sub = Module()
+        sub.d.sync += count.eq(count + 1)
+        m = Module()
+        m.submodules.sub = sub
+        m.d.comb += doubled.eq(count * 2)
+        sim = Simulator(m, engine=self.engine)
+        sim.add_clock(1e-6)
+        def testbench():
+            for _ in range(10):
+                yield
+        with sim.write_vcd("test.vcd"):
+            with sim.profile() as profile:
+                sim.add_sync_process(testbench)
+                sim.run()
+        result = profile.as_dict()
+        processes = {(entry["name"], entry["kind"]): entry for entry in result["processes"]}
+        self.assertIn(("SimulatorIntegrationTestCase.test_profile.<locals>.testbench", "process"),
+                      processes)
+        if self.engine != "pysim-cycle":
+            # The cycle-based engine drives the clock of the design itself.
+            self.assertIn(("clk", "clock"), processes)
+        if self.engine.startswith("pysim"):
+            self.assertGreaterEqual(processes[("top.sub", "sync")]["runs"], 10)
+            self.assertGreaterEqual(processes[("top", "comb")]["runs"], 10)
+        signals = {entry["name"]: entry["commits"] for entry in result["signals"]}
+        self.assertGreaterEqual(signals["top.sub.count"], 10)
+        self.assertGreaterEqual(signals["top.doubled"], 10)
+        self.assertGreater(sum(result["delta_cycles"].values()), 0)
+        self.assertGreater(result["trace_time"], 0)
+        self.assertIn("<locals>.testbench (process)", profile.table())
+        self.assertEqual(json.loads(profile.json(limit=1))["signals"], result["signals"][:1])
+
+        # Profiling stops at the end of the context manager.
+        sim.reset()
+        sim.add_sync_process(testbench)
+        sim.run()
+        self.assertEqual(profile.as_dict(), result)
+
+    def test_switch_many_cases_array(self):
+        m = Module()
+        op = Signal(5, reset=17)
+        index = Signal(2, reset=2)
+        array = Array(Signal(8, name=f"a{n}") for n in range(4))
+        with m.Switch(op):
+            for n in range(20):
+                with m.Case(n):
+                    m.d.sync += array[index].eq(n + 1)
+        sim = Simulator(m, engine=self.engine)
+        sim.add_clock(1e-6)
+        def testbench():
+            yield
+            for n, signal in enumerate(array):
+                self.assertEqual((yield signal), 18 if n == 2 else 0)
+        sim.add_sync_process(testbench)
+        sim.run()
+
+    def test_profile_wrong(self):
+        sim = Simulator(Module(), engine=self.engine)
+        with sim.profile():
+            with self.assertRaisesRegex(ValueError,
+                    r"^Simulation is already being profiled$"):
+                with sim.profile():
+                    pass
+
+    def setUp_vectors(self):
+        self.i = Signal(signed(8))
+        self.o_comb = Signal(signed(9))
+        self.o_sync = Signal(8)
+        self.m = Module()
+        self.m.d.comb += self.o_comb.eq(self.i * 2)
+        self.m.d.sync += self.o_sync.eq(self.i + 1)
+
+    def test_run_vectors(self):
+        self.setUp_vectors()
+        sim = Simulator(self.m, engine=self.engine)
+        sim.add_clock(1e-6)
+        samples = [0, 1, -1, 100, -128, 127]
+        with sim.write_vcd("test.vcd"):
+            results = sim.run_vectors([(self.i, samples)], [self.o_comb, self.o_sync])
+        self.assertEqual(list(results[self.o_comb]), [sample * 2 for sample in samples])
+        self.assertEqual(list(results[self.o_sync]), [(sample + 1) & 0xff for sample in samples])
+        # Six active edges, the first of which is at 0.5 us.
+        self.assertEqual(round(sim._engine.now * 1e9), 6000)
+
+        # Outputs can be written into preallocated sequences, and processes keep running.
+        cycles = []
+        def process():
+            yield Passive()
+            while True:
+                yield
+                cycles.append((yield self.i))
+        sim.add_sync_process(process)
+        o_sync = [None] * 3
+        results = sim.run_vectors(SignalDict([(self.i, [3, 2, 1])]), [(self.o_sync, o_sync)])
+        self.assertIs(results[self.o_sync], o_sync)
+        self.assertEqual(o_sync, [4, 3, 2])
+        # A sync process only starts after the first edge.
+        self.assertEqual(cycles, [2, 1])
+
+    def test_run_vectors_numpy(self):
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest("NumPy is not installed")
+        self.setUp_vectors()
+        sim = Simulator(self.m, engine=self.engine)
+        sim.add_clock(1e-6)
+        samples = numpy.arange(-100, 100, dtype=numpy.int16)
+        o_comb = numpy.zeros(len(samples), dtype=numpy.int64)
+        sim.run_vectors([(self.i, samples)], [(self.o_comb, o_comb)])
+        self.assertTrue((o_comb == samples * 2).all())
+
+    def test_run_vectors_wrong(self):
+        self.setUp_vectors()
+        sim = Simulator(self.m, engine=self.engine)
+        with self.assertRaisesRegex(ValueError,
+                r"^Domain 'sync' is not driven by a clock process$"):
+            sim.run_vectors([(self.i, [1])])
+        with self.assertRaisesRegex(ValueError,
+                r"^Domain 'foo' is not present in simulation$"):
+            sim.run_vectors([(self.i, [1])], domain="foo")
+        sim.add_clock(1e-6)
+        with self.assertRaisesRegex(ValueError,
+                r"^Input vectors must all have the same length, not 1, 2$"):
+            sim.run_vectors([(self.i, [1]), (self.o_sync, [1, 2])])
+        with self.assertRaisesRegex(ValueError,
+                r"^Output vector for \(sig o_sync\) has length 1, which is shorter than "
+                r"the input vectors \(2\)$"):
+            sim.run_vectors([(self.i, [1, 2])], [(self.o_sync, [0])])
+
+    def test_peek_poke(self):
+        self.setUp_vectors()
+        sim = Simulator(self.m, engine=self.engine)
+        sim.add_clock(1e-6)
+        self.assertEqual(sim.peek(self.o_sync), 0)
+        sim.poke(self.i, -3)
+        self.assertEqual(sim.peek(self.i), -3)
+        self.assertEqual(sim.peek(self.o_comb), -6)
+        self.assertEqual(sim.peek(self.o_sync), 0)
+        sim.advance_cycles()
+        self.assertEqual(sim.peek(self.o_sync), 0xfe)
+        self.assertEqual(sim.peek(self.o_sync[4:] + 1), 0x10)
+        sim.poke(self.i[:4], 0)
+        self.assertEqual(sim.peek(self.i), -16)
+        sim.advance_cycles(3)
+        self.assertEqual(sim.peek(self.o_sync), 0xf1)
+        self.assertEqual(round(sim._engine.now * 1e9), 4000)
+
+    def test_peek_poke_edge_pending(self):
+        self.setUp_vectors()
+        sim = Simulator(self.m, engine=self.engine)
+        sim.add_clock(1e-6)
+        sim.poke(self.i, 1)
+        sim.advance_cycles(3)
+        sim.advance()
+        # The clock is about to rise, but poking a signal does not make it rise any earlier.
+        self.assertEqual(round(sim._engine.now * 1e9), 3500)
+        self.assertEqual(sim.peek(self.o_sync), 2)
+        sim.poke(self.i, 5)
+        self.assertEqual(sim.peek(self.o_comb), 10)
+        self.assertEqual(sim.peek(self.o_sync), 2)
+        self.assertEqual(sim.peek(self.o_sync), 2)
+        sim.advance()
+        self.assertEqual(sim.peek(self.o_sync), 6)
+
+    def test_advance_cycles_wrong(self):
+        self.setUp_vectors()
+        sim = Simulator(self.m, engine=self.engine)
+        with self.assertRaisesRegex(ValueError,
+                r"^Domain 'sync' is not driven by a clock process$"):
+            sim.advance_cycles()
+        clock = sim.add_clock(1e-6)
+        sim.advance_cycles()
+        # The clock process is removed behind the back of the simulator.
+        sim._engine.remove_process(clock)
+        with self.assertRaisesRegex(RuntimeError,
+                r"^Simulation has stopped before the next active edge of clock 'clk'$"):
+            sim.advance_cycles()
+
+    def run_async(self, coroutine):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    def test_async_process(self):
+        self.setUp_vectors()
+        sim = Simulator(self.m, engine=self.engine)
+        sim.add_clock(1e-6)
+        async def model(value):
+            await asyncio.sleep(0.01)
+            return (value + 1) & 0xff
+        results = []
+        async def testbench():
+            for value in [1, -2, 3]:
+                sim.poke(self.i, value)
+                expected = asyncio.ensure_future(model(value))
+                await sim.tick()
+                await asyncio.sleep(0)
+                now = sim._engine.now
+                results.append((sim.peek(self.o_sync), await expected))
+                # Time does not advance while a process waits on the event loop.
+                self.assertEqual(sim._engine.now, now)
+        sim.add_sync_process(testbench)
+        self.run_async(sim.run_async())
+        self.assertEqual(results, [(2, 2), (255, 255), (4, 4)])
+
+    def test_async_changed(self):
+        self.setUp_vectors()
+        sim = Simulator(self.m, engine=self.engine)
+        changes = []
+        async def driver():
+            for value in [5, 5, 6]:
+                await sim.delay(1e-6)
+                sim.poke(self.i, value)
+        async def monitor():
+            await Passive()
+            while True:
+                await sim.changed(self.o_comb)
+                changes.append((round(sim._engine.now * 1e9), sim.peek(self.o_comb)))
+        sim.add_process(driver)
+        sim.add_process(monitor)
+        self.run_async(sim.run_async())
+        self.assertEqual(changes, [(1000, 10), (3000, 12)])
+
+    def test_async_wrong(self):
+        sim = Simulator(Module(), engine=self.engine)
+        async def process():
+            await asyncio.sleep(0)
+        sim.add_process(process)
+        with self.assertRaisesRegex(RuntimeError,
+                r"^Process .+ is waiting on an asyncio future or task, which requires running "
+                r"the simulation with run_async\(\)$"):
+            sim.run()
+
     def test_vcd_wrong_nonzero_time(self):
         s = Signal()
         m = Module()
         m.d.sync += s.eq(s)
-        sim = Simulator(m)
+        sim = Simulator(m, engine=self.engine)
         sim.add_clock(1e-6)
         sim.run_until(1e-5)
         with self.assertRaisesRegex(ValueError,
@@ -811,6 +1717,347 @@ class SimulatorIntegrationTestCase(FHDLTestCase):
                     pass
 
 
+class LevelizedSimulatorUnitTestCase(SimulatorUnitTestCase):
+    engine = "pysim-levelized"
+
+
+class LevelizedSimulatorIntegrationTestCase(SimulatorIntegrationTestCase):
+    engine = "pysim-levelized"
+
+    def test_comb_chain(self):
+        m = Module()
+        a = Signal(8)
+        y = a
+        for index in range(20):
+            stage = Module()
+            z = Signal(8, name="z{}".format(index))
+            stage.d.comb += z.eq(y + 1)
+            m.submodules["stage{}".format(index)] = stage
+            y = z
+        with self.assertSimulation(m) as sim:
+            self.assertEqual([[signal.name for level_process in level
+                                             for signal in level_process.outputs]
+                              for level in sim._engine._comb_levels],
+                             [["z{}".format(index)] for index in range(20)])
+            def process():
+                yield a.eq(10)
+                yield Settle()
+                self.assertEqual((yield y), 30)
+            sim.add_process(process)
+
+    def test_profile_comb_chain(self):
+        m = Module()
+        a = Signal(8)
+        y = a
+        for index in range(20):
+            stage = Module()
+            z = Signal(8, name="z{}".format(index))
+            stage.d.comb += z.eq(y + 1)
+            m.submodules["stage{}".format(index)] = stage
+            y = z
+        m.d.sync += a.eq(a + 1)
+        sim = Simulator(m, engine=self.engine)
+        sim.add_clock(1e-6)
+        with sim.profile() as profile:
+            sim.run_until(1e-5, run_passive=True)
+        result = profile.as_dict()
+        # The commits made by each level of combinational processes are a part of one delta cycle.
+        self.assertLessEqual(max(map(int, result["delta_cycles"])), 3)
+        signals = {entry["name"]: entry["commits"] for entry in result["signals"]}
+        self.assertEqual(signals["top.stage19.z19"], signals["top.stage0.z0"])
+
+    def test_comb_groups(self):
+        m = Module()
+        a = Signal(8)
+        x = Signal(8)
+        y = Signal(4)
+        z = Signal(4)
+        m.d.comb += x.eq(a + 1)
+        m.d.comb += Cat(y, z).eq(a)
+        with self.assertSimulation(m) as sim:
+            self.assertEqual(sorted(sorted(signal.name for signal in process.outputs)
+                                    for process in sim._engine._comb_processes),
+                             [["x"], ["y", "z"]])
+            def process():
+                yield a.eq(0x12)
+                yield Settle()
+                self.assertEqual((yield x), 0x13)
+                self.assertEqual((yield y), 0x2)
+                self.assertEqual((yield z), 0x1)
+            sim.add_process(process)
+
+    def test_comb_groups_switch(self):
+        m = Module()
+        a = Signal(2)
+        x = Signal(8)
+        y = Signal(8)
+        z = Signal(8)
+        m.d.comb += z.eq(a + 1)
+        with m.Switch(a):
+            with m.Case(0):
+                m.d.comb += x.eq(1)
+            with m.Case(1):
+                m.d.comb += y.eq(2)
+            with m.Default():
+                m.d.comb += [x.eq(3), y.eq(4)]
+        with self.assertSimulation(m) as sim:
+            self.assertEqual(sorted(sorted(signal.name for signal in process.outputs)
+                                    for process in sim._engine._comb_processes),
+                             [["x"], ["y"], ["z"]])
+            def process():
+                for value, (x_value, y_value) in enumerate([(1, 0), (0, 2), (3, 4), (3, 4)]):
+                    yield a.eq(value)
+                    yield Settle()
+                    self.assertEqual((yield x), x_value)
+                    self.assertEqual((yield y), y_value)
+                    self.assertEqual((yield z), value + 1)
+            sim.add_process(process)
+
+    def test_comb_loop(self):
+        m = Module()
+        a = Signal()
+        b = Signal()
+        x = Signal()
+        y = Signal()
+        m.submodules.p = p = Module()
+        m.submodules.q = q = Module()
+        p.d.comb += x.eq(y & a)
+        q.d.comb += y.eq(x | b)
+        with self.assertSimulation(m) as sim:
+            self.assertEqual(len(sim._engine._comb_levels), 1)
+            def process():
+                self.assertEqual((yield y), 0)
+                yield b.eq(1)
+                yield Settle()
+                self.assertEqual((yield x), 0)
+                self.assertEqual((yield y), 1)
+                yield a.eq(1)
+                yield Settle()
+                self.assertEqual((yield x), 1)
+                yield b.eq(0)
+                yield Settle()
+                self.assertEqual((yield x), 1)
+                self.assertEqual((yield y), 1)
+                yield a.eq(0)
+                yield Settle()
+                self.assertEqual((yield x), 0)
+                self.assertEqual((yield y), 0)
+            sim.add_process(process)
+
+
+class CycleSimulatorUnitTestCase(SimulatorUnitTestCase):
+    engine = "pysim-cycle"
+
+
+class CycleSimulatorIntegrationTestCase(SimulatorIntegrationTestCase):
+    engine = "pysim-cycle"
+
+    def test_async_changed(self):
+        self.skipTest("Waiting on changes of combinational signals is not supported by "
+                      "the cycle-based engine")
+
+    def test_comb_stages(self):
+        m = Module()
+        a = Signal(8)
+        b = Signal(8)
+        x = Signal(8)
+        y = Signal(8)
+        z = Signal(8)
+        m.d.comb += x.eq(a + 1)
+        m.d.comb += y.eq(b + 1)
+        m.d.comb += z.eq(x + y)
+        with self.assertSimulation(m) as sim:
+            self.assertEqual([sorted(signal.name for process in processes
+                                                 for signal in process.outputs)
+                              for processes, is_loop in sim._engine._comb_stages],
+                             [["x", "y"], ["z"]])
+            def process():
+                yield a.eq(1)
+                yield b.eq(2)
+                yield Settle()
+                self.assertEqual((yield z), 5)
+            sim.add_process(process)
+
+    def test_wrong_multiple_domains(self):
+        m = Module()
+        m.domains.a = ClockDomain()
+        m.domains.b = ClockDomain()
+        m.d.a += Signal().eq(1)
+        m.d.b += Signal().eq(1)
+        with self.assertRaisesRegex(ValueError,
+                r"^Cycle-based simulation requires a design with at most one clock domain, "
+                r"not 'a', 'b'$"):
+            Simulator(m, engine=self.engine)
+
+    def test_wrong_async_reset(self):
+        m = Module()
+        m.domains.sync = ClockDomain(async_reset=True)
+        m.d.sync += Signal().eq(1)
+        with self.assertRaisesRegex(ValueError,
+                r"^Cycle-based simulation does not support domain 'sync' with an asynchronous "
+                r"reset$"):
+            Simulator(m, engine=self.engine)
+
+
+class CxxrtlSimulatorIntegrationTestCase(SimulatorIntegrationTestCase):
+    engine = "cxxsim"
+
+    def setUp(self):
+        # Keep compiled designs out of the cache of the user running the tests.
+        self.cxx_cache_dir = tempfile.TemporaryDirectory(prefix="amaranth_cxx_cache_")
+        self.environ = dict(os.environ)
+        os.environ["AMARANTH_CXX_CACHE_DIR"] = self.cxx_cache_dir.name
+
+    def tearDown(self):
+        self.cxx_cache_dir.cleanup()
+        os.environ.clear()
+        os.environ.update(self.environ)
+
+    def test_memory_out_of_bounds(self):
+        self.skipTest("CXXRTL treats out of bounds memory accesses as assertion failures")
+
+    def test_checkpoint_restore(self):
+        self.skipTest("CXXRTL engine does not support checkpoints")
+
+    def test_checkpoint_restart(self):
+        self.skipTest("CXXRTL engine does not support checkpoints")
+
+    def test_fork(self):
+        self.skipTest("CXXRTL engine does not support forking")
+
+    def test_checkpoint_wrong(self):
+        self.skipTest("CXXRTL engine does not support checkpoints")
+
+    def test_checkpoint_trace(self):
+        self.skipTest("CXXRTL engine does not support checkpoints")
+
+    def test_checkpoint_clear(self):
+        self.skipTest("CXXRTL engine does not support checkpoints")
+
+    def test_native_state_released(self):
+        sim = Simulator(Module(), engine=self.engine)
+        state = sim._engine._state
+        build_dir = state._build_dir.name
+        destroy = state._destroy
+        self.assertTrue(destroy.alive)
+        del sim, state
+        gc.collect()
+        self.assertFalse(destroy.alive)
+        self.assertFalse(os.path.exists(build_dir))
+
+    def test_checkpoint_unsupported(self):
+        sim = Simulator(Module(), engine=self.engine)
+        with self.assertRaisesRegex(TypeError,
+                r"^Checkpoints are not supported by the CXXRTL simulation engine$"):
+            sim.checkpoint()
+        with self.assertRaisesRegex(TypeError,
+                r"^Forking is not supported by the CXXRTL simulation engine$"):
+            sim.fork()
+
+    def test_memory_reset(self):
+        self.setUp_memory()
+        sim = Simulator(self.m, engine=self.engine)
+        def process():
+            self.assertEqual((yield self.memory[1]), 0x55)
+            yield self.memory[1].eq(0x33)
+            yield Settle()
+            self.assertEqual((yield self.memory[1]), 0x33)
+        sim.add_process(process)
+        sim.run()
+        sim.reset()
+        sim.run()
+
+
+class VCDWriterProcessTestCase(FHDLTestCase):
+    def test_error(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            writer = _VCDWriterProcess(os.path.join(dirname, "test.vcd"))
+            writer.open(timescale="100 ps")
+            var = writer.register_var(["top"], "a", "wire", 4, 0)
+            writer.map_slots({0: var})
+            writer.write([(0.0, [(0, "invalid")])])
+            # The error is re-raised once the writer process receives the change.
+            with self.assertRaisesRegex(ValueError, r"^Invalid vector value \(invalid\)$"):
+                for n in range(1, _VCDWriterProcess.BATCH_SIZE):
+                    writer.write([(n * 1e-6, [(0, n & 0xf)])])
+                writer.close(1.0)
+            writer.close(1.0)
+
+    def test_duplicate_name(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            writer = _VCDWriterProcess(os.path.join(dirname, "test.vcd"))
+            writer.open(timescale="100 ps")
+            var = writer.register_var(["top"], "a", "wire", 4, 0)
+            with self.assertRaisesRegex(KeyError, r"Duplicate var a in scope top"):
+                writer.register_alias(["top"], "a", var)
+            writer.register_alias(["top", "sub"], "a", var)
+            writer.close(1.0)
+
+
+class PySimCodeCacheTestCase(FHDLTestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory(prefix="amaranth_pysim_cache_")
+        self.environ = dict(os.environ)
+        os.environ["AMARANTH_PYSIM_CACHE_DIR"] = self.cache_dir.name
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+        os.environ.clear()
+        os.environ.update(self.environ)
+
+    def counter(self, width):
+        m = Module()
+        en = Signal()
+        count = Signal(width)
+        with m.If(en):
+            m.d.sync += count.eq(count + 1)
+        return m, en, count
+
+    def simulate(self, m, en, count):
+        sim = Simulator(m)
+        sim.add_clock(1e-6)
+        def process():
+            yield en.eq(1)
+            for _ in range(5):
+                yield
+            self.assertEqual((yield count), 4)
+        sim.add_sync_process(process)
+        sim.run()
+        return sim._engine._code_cache
+
+    def test_hit(self):
+        cache = self.simulate(*self.counter(8))
+        hits, misses = cache.hits, cache.misses
+        self.assertEqual(hits, 0)
+        self.assertEqual(misses, 1)
+        self.simulate(*self.counter(8))
+        self.assertEqual(cache.hits, hits + 1)
+        self.assertEqual(cache.misses, misses)
+
+    def test_miss(self):
+        cache = self.simulate(*self.counter(8))
+        self.simulate(*self.counter(9))
+        self.assertEqual(cache.hits, 0)
+        self.assertEqual(cache.misses, 2)
+
+    def test_slot_remap(self):
+        cache = self.simulate(*self.counter(8))
+        # The same process, using different slots in a larger design.
+        dut, en, count = self.counter(8)
+        m = Module()
+        m.submodules.other = self.counter(4)[0]
+        m.submodules.dut = dut
+        self.simulate(m, en, count)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 2)
+
+    def test_persistent(self):
+        cache = self.simulate(*self.counter(8))
+        cache._entries.clear()
+        self.simulate(*self.counter(8))
+        self.assertEqual(cache.hits, 1)
+
+
 class SimulatorRegressionTestCase(FHDLTestCase):
     def test_bug_325(self):
         dut = Module()
@@ -860,3 +2107,5 @@ class SimulatorRegressionTestCase(FHDLTestCase):
                 r"^Adding a clock process that drives a clock domain object named 'sync', "
                 r"which is distinct from an identically named domain in the simulated design$"):
             sim.add_clock(1e-6, domain=ClockDomain("sync"))
+
+
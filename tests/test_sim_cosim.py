@@ -0,0 +1,160 @@
+import os
+import time
+import tempfile
+import threading
+
+from amaranth.hdl import *
+from amaranth.sim import *
+from amaranth.sim.cosim import *
+
+from .utils import *
+
+
+class CosimTestCase(FHDLTestCase):
+    def setUp_accumulator(self):
+        self.inc = Signal(signed(4))
+        self.acc = Signal(16)
+        self.m = Module()
+        self.m.d.sync += self.acc.eq(self.acc + self.inc)
+
+    @staticmethod
+    def step(outputs):
+        return (-3 if outputs is None else outputs[0] % 5 - 2,)
+
+    def reference(self, quantum, cycles):
+        # Inputs for the first `quantum` cycles are computed without any outputs, and the inputs
+        # for every further cycle from the outputs sampled `quantum` cycles earlier.
+        incs, accs, acc = [], [], 0
+        for cycle in range(cycles):
+            if cycle < quantum:
+                incs.append(self.step(None)[0])
+            else:
+                incs.append(self.step((accs[cycle - quantum],))[0])
+            accs.append(acc)
+            acc = (acc + incs[-1]) & 0xffff
+        return accs
+
+    def run_cosim(self, sim_transport, peer_transport, quantum, cycles=20):
+        self.addCleanup(sim_transport.close)
+        self.addCleanup(peer_transport.close)
+        self.setUp_accumulator()
+        samples = []
+        def model(outputs):
+            if outputs is not None:
+                samples.append(outputs[0])
+            if len(samples) == cycles:
+                return None
+            return self.step(outputs)
+        peer = CosimPeer(peer_transport, model)
+        thread = threading.Thread(target=peer.run)
+        thread.start()
+        try:
+            bridge = CosimBridge(sim_transport, inputs=[self.inc], outputs=[self.acc],
+                                 quantum=quantum)
+            sim = Simulator(self.m)
+            sim.add_clock(1e-6)
+            sim.add_process(bridge.process)
+            sim.run()
+        finally:
+            thread.join()
+        self.assertEqual(peer.quantum, quantum)
+        self.assertEqual(peer.inputs, [("inc", 4, True)])
+        self.assertEqual(peer.outputs, [("acc", 16, False)])
+        self.assertEqual(samples, self.reference(quantum, cycles))
+        return sim
+
+    def test_socket_lock_step(self):
+        sim_transport, peer_transport = SocketTransport.pair()
+        sim = self.run_cosim(sim_transport, peer_transport, quantum=1)
+        # The model finishes after 20 samples, in the middle of a batch, and the inputs it
+        # computed before are still applied.
+        self.assertEqual(round(sim._engine.now * 1e9), 20000)
+
+    def test_socket_quantum(self):
+        sim_transport, peer_transport = SocketTransport.pair()
+        self.run_cosim(sim_transport, peer_transport, quantum=8)
+
+    def test_unix_socket(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cosim.sock")
+            transports = {}
+            def listen():
+                transports["sim"] = SocketTransport.listen(path)
+            thread = threading.Thread(target=listen)
+            thread.start()
+            deadline = time.monotonic() + 10
+            while not os.path.exists(path):
+                self.assertLess(time.monotonic(), deadline, "socket was not created in time")
+                time.sleep(0.001)
+            peer_transport = SocketTransport.connect(path)
+            thread.join()
+            # The socket file is removed once the peer connects.
+            self.assertFalse(os.path.exists(path))
+            self.run_cosim(transports["sim"], peer_transport, quantum=4)
+
+    def test_mmap(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cosim.shm")
+            # A small ring, so that messages wrap around.
+            sim_transport = MmapTransport.create(path, capacity=128, timeout=10)
+            peer_transport = MmapTransport(path, side="peer", timeout=10)
+            self.run_cosim(sim_transport, peer_transport, quantum=3, cycles=50)
+
+    def test_wrong_quantum(self):
+        sim_transport, peer_transport = SocketTransport.pair()
+        self.addCleanup(sim_transport.close)
+        self.addCleanup(peer_transport.close)
+        with self.assertRaisesRegex(ValueError,
+                r"^Quantum must be a positive integer, not 0$"):
+            CosimBridge(sim_transport, quantum=0)
+        with self.assertRaisesRegex(TypeError,
+                r"^Quantum must be an integer, not 1.0$"):
+            CosimBridge(sim_transport, quantum=1.0)
+
+    def test_wrong_mmap(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cosim.shm")
+            with open(path, "wb") as file:
+                file.write(b"\0" * 64)
+            with self.assertRaisesRegex(ValueError,
+                    r"^File '.+' is not a co-simulation shared memory file$"):
+                MmapTransport(path, side="sim")
+            with self.assertRaisesRegex(ValueError,
+                    r"^Capacity must be a positive multiple of 8, not 12$"):
+                MmapTransport.create(path, capacity=12)
+            transport = MmapTransport.create(path, capacity=16)
+            try:
+                with self.assertRaisesRegex(ValueError,
+                        r"^Message of 13 bytes does not fit into a ring of 16 bytes$"):
+                    transport.send(b"\0" * 13)
+            finally:
+                transport.close()
+
+    def test_mmap_timeout(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cosim.shm")
+            transport = MmapTransport.create(path, capacity=16, timeout=0.01)
+            self.addCleanup(transport.close)
+            # A peer that never responds, e.g. because it has crashed.
+            with self.assertRaisesRegex(TimeoutError,
+                    r"^Co-simulation peer did not respond within 0.01 s$"):
+                transport.recv()
+            transport.send(b"\0" * 12)
+            with self.assertRaisesRegex(TimeoutError,
+                    r"^Co-simulation peer did not respond within 0.01 s$"):
+                transport.send(b"\0")
+
+    def test_wrong_batch(self):
+        sim_transport, peer_transport = SocketTransport.pair()
+        self.addCleanup(sim_transport.close)
+        self.addCleanup(peer_transport.close)
+        self.setUp_accumulator()
+        sim = Simulator(self.m)
+        sim.add_clock(1e-6)
+        sim.add_process(CosimBridge(sim_transport, inputs=[self.inc, self.acc],
+                                    quantum=2).process)
+        peer_transport.send(b"\0" * 7)
+        with self.assertRaisesRegex(ValueError,
+                r"^Co-simulation peer sent a batch of 7 bytes, which is not a whole number of "
+                r"rows of 3 bytes, up to 2 rows$"):
+            sim.run()
@@ -0,0 +1,110 @@
+import os
+import tempfile
+
+from amaranth.hdl import *
+from amaranth.sim import *
+from amaranth.sim._pyrtl import _CodeCache
+
+from .utils import *
+
+
+class _Counter(Elaboratable):
+    def __init__(self):
+        self.en  = Signal()
+        self.out = Signal(8)
+
+    def elaborate(self, platform):
+        m = Module()
+        with m.If(self.en):
+            m.d.sync += self.out.eq(self.out + 1)
+        return m
+
+
+def _count_to_4(sim, dut):
+    sim.add_clock(1e-6)
+    def process():
+        yield dut.en.eq(1)
+        for _ in range(4):
+            yield
+        yield
+        assert (yield dut.out) == 4
+    sim.add_sync_process(process)
+
+
+def _count_wrong(sim, dut):
+    sim.add_clock(1e-6)
+    def process():
+        yield
+        assert (yield dut.out) == 1, "counter is not enabled"
+    sim.add_sync_process(process)
+
+
+def _count_to_seed(sim, dut, seed):
+    sim.add_clock(1e-6)
+    def process():
+        yield dut.en.eq(1)
+        for _ in range(seed):
+            yield
+        yield
+        assert (yield dut.out) == seed
+    sim.add_sync_process(process)
+
+
+class RegressionRunnerTestCase(FHDLTestCase):
+    def test_sequential(self):
+        report = run_regression(_Counter, [_count_to_4, _count_wrong, _count_to_4], workers=0)
+        self.assertEqual(len(report), 3)
+        self.assertEqual([result.passed for result in report], [True, False, True])
+        self.assertEqual(report.failed[0].name, "_count_wrong")
+        self.assertIn("counter is not enabled", report.failed[0].error)
+        self.assertIsNone(report.passed[0].error)
+        # The first clock edge is at 0.5 us, and the process finishes after the 6th one.
+        self.assertEqual(report.passed[0].cycles, 6)
+        self.assertEqual(round(report.passed[0].sim_time * 1e9), 6000)
+        self.assertGreater(report.passed[0].cycles_per_second, 0)
+        self.assertIn("2 passed, 1 failed", report.summary())
+        self.assertIn("FAIL: _count_wrong", report.summary())
+
+    def test_seeds(self):
+        report = run_regression(_Counter, range(1, 9), testbench=_count_to_seed, workers=2)
+        self.assertEqual([result.name for result in report],
+                         ["seed {}".format(seed) for seed in range(1, 9)])
+        self.assertEqual(report.failed, [])
+        self.assertEqual([result.cycles for result in report], [seed + 2 for seed in range(1, 9)])
+
+    def test_cache_dir(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            report = run_regression(_Counter, [_count_to_4, _count_to_4], workers=2,
+                                    cache_dir=cache_dir)
+            entries = os.listdir(cache_dir)
+        self.assertEqual(len(report.passed), 2)
+        self.assertNotEqual(entries, [])
+        self.assertTrue(all(entry.endswith(".pysim") for entry in entries))
+
+    def test_cache_dir_sequential(self):
+        saved_cache_dir = os.environ.pop("AMARANTH_PYSIM_CACHE_DIR", None)
+        try:
+            with tempfile.TemporaryDirectory() as cache_dir:
+                report = run_regression(_Counter, [_count_to_4], workers=0, cache_dir=cache_dir)
+                self.assertEqual(len(report.passed), 1)
+                self.assertNotEqual(os.listdir(cache_dir), [])
+                self.assertNotIn("AMARANTH_PYSIM_CACHE_DIR", os.environ)
+                # The second run compiles nothing, and finds every process in the cache.
+                cache = _CodeCache._get(cache_dir)
+                misses = cache.misses
+                run_regression(_Counter, [_count_to_4], workers=0, cache_dir=cache_dir)
+                self.assertEqual(cache.misses, misses)
+                self.assertGreater(cache.hits, 0)
+            # Simulators constructed afterwards do not use the cache.
+            self.assertIsNone(_CodeCache.default())
+        finally:
+            if saved_cache_dir is not None:
+                os.environ["AMARANTH_PYSIM_CACHE_DIR"] = saved_cache_dir
+
+    def test_wrong_scenario(self):
+        with self.assertRaisesRegex(TypeError,
+                r"^Scenario 1 is a seed, but no testbench was specified$"):
+            run_regression(_Counter, [1], workers=0)
+        with self.assertRaisesRegex(TypeError,
+                r"^Scenario must be a callable or an integer seed, not 'a'$"):
+            run_regression(_Counter, ["a"], workers=0)
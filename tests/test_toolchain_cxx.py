@@ -1,21 +1,30 @@
 import os
+import time
 import ctypes
 import tempfile
+import sysconfig
 import unittest
 
 from amaranth._toolchain.cxx import *
+from amaranth._toolchain.cxx import _compiler_executable, _compiler_identity
 
 
 class ToolchainCxxTestCase(unittest.TestCase):
     def setUp(self):
         self.include_dir = None
         self.build_dir = None
+        self.cache_dir = tempfile.TemporaryDirectory(prefix="amaranth_cxx_cache_")
+        self.environ = dict(os.environ)
+        os.environ["AMARANTH_CXX_CACHE_DIR"] = self.cache_dir.name
 
     def tearDown(self):
         if self.include_dir:
             self.include_dir.cleanup()
         if self.build_dir:
             self.build_dir.cleanup()
+        self.cache_dir.cleanup()
+        os.environ.clear()
+        os.environ.update(self.environ)
 
     def test_filename(self):
         self.build_dir, filename = build_cxx(
@@ -66,3 +75,81 @@ class ToolchainCxxTestCase(unittest.TestCase):
         )
         library = ctypes.cdll.LoadLibrary(os.path.join(self.build_dir.name, filename))
         self.assertEqual(library.answer(), 42)
+
+    def build_answer(self, answer):
+        if self.build_dir:
+            self.build_dir.cleanup()
+        self.build_dir, filename = build_cxx(
+            cxx_sources={"test.cc": """
+                extern "C" int answer() { return ANSWER; }
+            """},
+            output_name="answer",
+            include_dirs=[],
+            macros=[f"ANSWER={answer}"],
+        )
+        library = ctypes.cdll.LoadLibrary(os.path.join(self.build_dir.name, filename))
+        return library.answer()
+
+    def build_answer_cached(self, answer):
+        entries = set(os.listdir(self.cache_dir.name))
+        self.assertEqual(self.build_answer(answer), answer)
+        new_entries = set(os.listdir(self.cache_dir.name)) - entries
+        return new_entries.pop() if new_entries else None
+
+    def test_cache(self):
+        entry_42 = self.build_answer_cached(42)
+        entry_43 = self.build_answer_cached(43)
+        self.assertIsNotNone(entry_42)
+        self.assertIsNotNone(entry_43)
+        # Replace a cached shared object to check that it is used instead of compiling.
+        os.replace(os.path.join(self.cache_dir.name, entry_43),
+                   os.path.join(self.cache_dir.name, entry_42))
+        self.assertEqual(self.build_answer(42), 43)
+
+    def test_cache_evict(self):
+        entry_42 = self.build_answer_cached(42)
+        entry_size = os.path.getsize(os.path.join(self.cache_dir.name, entry_42))
+        os.environ["AMARANTH_CXX_CACHE_SIZE"] = str(entry_size * 2)
+        entry_43 = self.build_answer_cached(43)
+        self.assertIsNone(self.build_answer_cached(42))
+        entry_44 = self.build_answer_cached(44)
+        # The least recently used entry is evicted first.
+        self.assertIsNotNone(entry_43)
+        self.assertNotIn(entry_43, os.listdir(self.cache_dir.name))
+        self.assertEqual(set(os.listdir(self.cache_dir.name)), {entry_42, entry_44})
+
+    def test_cache_evict_stale_temp(self):
+        stale_filename = os.path.join(self.cache_dir.name, ".tmp_stale")
+        fresh_filename = os.path.join(self.cache_dir.name, ".tmp_fresh")
+        for filename in (stale_filename, fresh_filename):
+            with open(filename, "wb") as f:
+                f.write(b"\0" * 1024)
+        stale_time = time.time() - 2 * 60 * 60
+        os.utime(stale_filename, (stale_time, stale_time))
+        self.build_answer_cached(42)
+        # Temporary files left behind by an interrupted build are removed, but the ones that
+        # could still be written by a concurrent build are not.
+        self.assertFalse(os.path.exists(stale_filename))
+        self.assertTrue(os.path.exists(fresh_filename))
+
+    def test_compiler_executable(self):
+        self.assertEqual(_compiler_executable("g++ -fPIC"), "g++")
+        self.assertEqual(_compiler_executable("ccache g++ -fPIC"), "g++")
+        self.assertEqual(_compiler_executable("/usr/bin/sccache clang++"), "clang++")
+        self.assertEqual(_compiler_executable("env CCACHE_DISABLE=1 ccache c++"), "c++")
+        cxx = sysconfig.get_config_var("CXX")
+        self.assertEqual(_compiler_identity(["ccache " + cxx])[1:],
+                         _compiler_identity([cxx])[1:])
+
+    def test_cache_opt_in(self):
+        del os.environ["AMARANTH_CXX_CACHE_DIR"]
+        with tempfile.TemporaryDirectory() as cache_home:
+            os.environ["XDG_CACHE_HOME"] = cache_home
+            self.assertEqual(self.build_answer(42), 42)
+            self.assertEqual(os.listdir(cache_home), [])
+        self.assertEqual(os.listdir(self.cache_dir.name), [])
+
+    def test_cache_disabled(self):
+        os.environ["AMARANTH_CXX_CACHE_SIZE"] = "0"
+        self.assertEqual(self.build_answer(42), 42)
+        self.assertEqual(os.listdir(self.cache_dir.name), [])